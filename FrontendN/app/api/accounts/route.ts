@@ -50,17 +50,19 @@ async function proxyRequest(
     }
     
     // Преобразуем ответ FastAPI в формат FrontendN
-    if (endpoint === '/accounts' && data.data?.account) {
-      // Преобразуем формат счетов
+    if (endpoint.startsWith('/accounts') && data.data?.account) {
+      // Преобразуем формат счетов (балансы приходят в том же ответе, include=balances)
       const accounts = data.data.account.map((acc: any) => {
         const accountNumber = acc.account[0]?.identification || acc.accountId
         const bankName = acc.account[0]?.name || 'My Bank'
+        const balance = acc.balance?.[0]
+        const amount = balance ? parseFloat(balance.amount.amount) : 0
         
         return {
           id: acc.accountId,
           bankName,
           accountNumber,
-          balance: 0, // Баланс загружается отдельно
+          balance: balance?.creditDebitIndicator === 'Debit' ? -amount : amount,
           currency: acc.currency,
           type: acc.accountSubType?.toLowerCase().includes('savings')
             ? 'savings'
@@ -70,36 +72,7 @@ async function proxyRequest(
         }
       })
       
-      // Загружаем балансы для каждого счета
-      const accountsWithBalances = await Promise.all(
-        accounts.map(async (account: any) => {
-          try {
-            const balanceResponse = await fetch(
-              `${API_BASE_URL}/accounts/${account.id}/balances`,
-              {
-                headers: {
-                  'Authorization': authHeader || '',
-                  'Content-Type': 'application/json',
-                },
-              }
-            )
-            
-            if (balanceResponse.ok) {
-              const balanceData = await balanceResponse.json()
-              const balance = balanceData.data?.balance?.[0]
-              if (balance) {
-                const amount = parseFloat(balance.amount.amount)
-                account.balance = balance.creditDebitIndicator === 'Debit' ? -amount : amount
-              }
-            }
-          } catch (error) {
-            console.error(`Ошибка загрузки баланса для ${account.id}:`, error)
-          }
-          return account
-        })
-      )
-      
-      return NextResponse.json(accountsWithBalances)
+      return NextResponse.json(accounts)
     }
     
     return NextResponse.json(data)
@@ -125,7 +98,7 @@ async function proxyRequest(
 }
 
 export async function GET(req: NextRequest) {
-  return proxyRequest(req, '/accounts')
+  return proxyRequest(req, '/accounts?include=balances')
 }
 
 export async function POST(req: NextRequest) {
@@ -30,6 +30,8 @@ export async function POST(req: NextRequest) {
       )
     }
     
+    // SBank: если согласие нужно подписать, backend сразу отдает job_id и links -
+    // статус задания компонент получает сам (/consent-jobs/{id}/events)
     const data = await response.json()
     return NextResponse.json(data)
   } catch (error: any) {
@@ -38,6 +38,33 @@ const BANKS = [
   },
 ]
 
+const API_BASE_URL = process.env.NEXT_PUBLIC_BACKEND_URL || 'http://localhost:8001'
+
+const CONSENT_JOB_TIMEOUT_MS = 60_000
+
+// SBank: дождаться подписания согласия через SSE /multibank/consent-jobs/{id}/events
+const waitForConsentJob = (eventsPath: string): Promise<any> =>
+  new Promise((resolve, reject) => {
+    const source = new EventSource(`${API_BASE_URL}${eventsPath}`)
+    const timer = setTimeout(() => {
+      source.close()
+      reject(new Error('Согласие не подписано вовремя'))
+    }, CONSENT_JOB_TIMEOUT_MS)
+
+    source.addEventListener('status', (event) => {
+      const job = JSON.parse((event as MessageEvent).data)
+      if (job.status === 'pending') return
+      clearTimeout(timer)
+      source.close()
+      resolve(job)
+    })
+    source.onerror = () => {
+      clearTimeout(timer)
+      source.close()
+      reject(new Error('Потеряно соединение с ожиданием согласия'))
+    }
+  })
+
 // (removed permanent client_id handling - reverting to dynamic client_id probing)
 
 export default function MultibankAccounts({ currentClientId, onAccountsLoaded, onLoadRef }: MultibankAccountsProps) {
@@ -146,7 +173,17 @@ export default function MultibankAccounts({ currentClientId, onAccountsLoaded, o
           })
 
           if (consentResponse.ok) {
-            const consentData = await consentResponse.json()
+            let consentData = await consentResponse.json()
+            if (consentData.job_id && !consentData.Data?.ConsentId) {
+              console.log(`⏳ ${bank.name}: ждем подписания согласия (${consentData.job_id})`)
+              const job = await waitForConsentJob(
+                consentData.links?.events || `/multibank/consent-jobs/${encodeURIComponent(consentData.job_id)}/events`
+              )
+              if (job.status !== 'authorized') {
+                throw new Error(`Не удалось получить согласие: ${job.error || job.status}`)
+              }
+              consentData = { ...job.consent, job_id: job.job_id, status: job.status }
+            }
             consentId =
               consentData.Data?.ConsentId ||
               consentData.consent_id ||
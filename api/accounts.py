@@ -2,29 +2,133 @@
 Accounts API - Получение информации о счетах клиента
 OpenBanking Russia v2.1 compatible
 """
-from fastapi import APIRouter, Depends, HTTPException, Header
+from fastapi import APIRouter, Depends, HTTPException, Header, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_
+from sqlalchemy import select, and_, tuple_
 from typing import Optional, List
-from datetime import datetime
+from datetime import datetime, timezone
 from pydantic import BaseModel
 from decimal import Decimal
+from urllib.parse import urlencode
+import base64
+import hashlib
+import json
 import uuid
 
+from config import config
 from database import get_db
-from models import Account, Client, Transaction, BankCapital
+from models import Account, Client, Product, ProductAgreement, Transaction
 from services.auth_service import get_current_client, get_optional_client
 from services.consent_service import ConsentService
+from services.account_digest_service import account_digest
+from services.posting_service import PostingService
+from services.capital_service import capital_ledger
+from services.ledger_service import LedgerService
+from services.statement_export_service import StatementExportService
 
 
 router = APIRouter(prefix="/accounts", tags=["2 Счета и балансы"])
 
 
+def _parse_datetime(value: Optional[str], name: str) -> Optional[datetime]:
+    """ISO 8601 (с Z или смещением) -> naive UTC, как хранятся даты в БД"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise HTTPException(400, f"Invalid {name}: expected ISO 8601 date-time")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def _etag(*parts) -> str:
+    """
+    Слабый ETag из версий данных, а не из тела ответа
+
+    Версия счета - Account.ledger_sequence: растет с каждой проводкой.
+    """
+    digest = hashlib.sha1("|".join(str(part) for part in parts).encode()).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def _not_modified(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or etag[2:] in candidates
+
+
+def _conditional(response: Response, if_none_match: Optional[str], etag: str) -> Optional[Response]:
+    """304 без тела, если версия у клиента актуальна; иначе ETag в ответ"""
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if _not_modified(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+
+async def _get_readable_account(
+    db: AsyncSession,
+    account_id: str,
+    current_client: Optional[dict],
+    x_consent_id: Optional[str],
+    x_requesting_bank: Optional[str],
+    permissions: List[str]
+) -> Account:
+    """
+    Счет, который вызывающему разрешено читать
+
+    Собственный клиент - только свои счета. Другой банк - по активному
+    согласию владельца счета (x-consent-id) с нужными permissions.
+    """
+    if not current_client and not (x_requesting_bank and x_consent_id):
+        raise HTTPException(401, "Unauthorized")
+
+    acc_id = int(account_id.replace("acc-", ""))
+    result = await db.execute(
+        select(Account, Client.person_id)
+        .join(Client, Account.client_id == Client.id)
+        .where(Account.id == acc_id)
+    )
+    row = result.first()
+    if not row:
+        raise HTTPException(404, "Account not found")
+    account, owner_person_id = row
+
+    if current_client:
+        if owner_person_id != current_client["client_id"]:
+            raise HTTPException(403, "Access denied")
+        return account
+
+    consent = await ConsentService.check_consent(
+        db=db,
+        client_person_id=owner_person_id,
+        requesting_bank=x_requesting_bank,
+        permissions=permissions
+    )
+    if not consent or consent.consent_id != x_consent_id:
+        raise HTTPException(
+            403,
+            detail={
+                "error": "CONSENT_REQUIRED",
+                "message": "Требуется согласие клиента",
+                "consent_request_url": f"/account-consents/request"
+            }
+        )
+    return account
+
+
 @router.get("", summary="Получить счета")
 async def get_accounts(
+    response: Response,
     client_id: Optional[str] = None,
+    include: Optional[str] = None,
     x_consent_id: Optional[str] = Header(None, alias="x-consent-id"),
     x_requesting_bank: Optional[str] = Header(None, alias="x-requesting-bank"),
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match"),
     current_client: Optional[dict] = Depends(get_optional_client),
     db: AsyncSession = Depends(get_db)
 ):
@@ -33,20 +137,32 @@ async def get_accounts(
     
     Для собственного клиента: используется JWT токен
     Для межбанковского запроса: требуется consent_id и bank token
+
+    - **include**: `balances` и/или `agreements` через запятую - встроить
+      балансы (как в /accounts/{account_id}/balances) и договоры в ответ
+
+    Поддерживает `If-None-Match`: 304, если счета не менялись.
     """
     
+    includes = {part.strip() for part in (include or "").split(",") if part.strip()}
+    unknown = includes - {"balances", "agreements"}
+    if unknown:
+        raise HTTPException(400, f"Unsupported include: {', '.join(sorted(unknown))}")
+    
     # Определяем, чей это запрос
     if x_requesting_bank:
         # Межбанковский запрос - требуется согласие
         if not client_id:
             raise HTTPException(400, "client_id required for interbank requests")
+        if "agreements" in includes:
+            raise HTTPException(403, "include=agreements is available only to the account owner")
         
         # Проверить согласие
         consent = await ConsentService.check_consent(
             db=db,
             client_person_id=client_id,
             requesting_bank=x_requesting_bank,
-            permissions=["ReadAccountsDetail"]
+            permissions=["ReadAccountsDetail"] + (["ReadBalances"] if "balances" in includes else [])
         )
         
         if not consent:
@@ -67,51 +183,86 @@ async def get_accounts(
             raise HTTPException(401, "Unauthorized")
         target_client_id = current_client["client_id"]
     
-    # Получаем клиента для имени
-    client_result = await db.execute(
-        select(Client).where(Client.person_id == target_client_id)
-    )
-    client = client_result.scalar_one_or_none()
-    client_name = client.full_name if client else ""
-    
-    # Получаем счета
+    # Счета вместе с именем владельца одним запросом (баланс - колонка счета)
     result = await db.execute(
-        select(Account)
+        select(Account, Client.full_name)
         .join(Client)
         .where(Client.person_id == target_client_id)
         .where(Account.status == "active")
+        .order_by(Account.id)
     )
-    accounts = result.scalars().all()
-    
-    # Логирование для отладки
-    import logging
-    logger = logging.getLogger(__name__)
-    logger.info(f"Запрос счетов для client_id={target_client_id}, найдено счетов: {len(accounts)}")
-    for acc in accounts:
-        logger.info(f"  - Счет ID={acc.id}, номер={acc.account_number}, баланс={acc.balance}")
-    
-    # Формируем ответ в формате OpenBanking Russia
-    return {
-        "data": {
+    rows = result.all()
+
+    agreements_by_account = {}
+    if "agreements" in includes and rows:
+        agreements_result = await db.execute(
+            select(ProductAgreement, Product.product_id, Product.name, Product.product_type)
+            .join(Product, ProductAgreement.product_id == Product.id)
+            .where(ProductAgreement.account_id.in_([acc.id for acc, _ in rows]))
+            .order_by(ProductAgreement.created_at.desc())
+        )
+        for agreement, product_id, product_name, product_type in agreements_result.all():
+            agreements_by_account.setdefault(agreement.account_id, []).append({
+                "agreement_id": agreement.agreement_id,
+                "product_id": product_id,
+                "product_name": product_name,
+                "product_type": product_type,
+                "amount": float(agreement.amount),
+                "status": agreement.status,
+                "start_date": agreement.start_date.isoformat(),
+                "end_date": agreement.end_date.isoformat() if agreement.end_date else None
+            })
+
+    not_modified = _conditional(response, if_none_match, _etag(
+        "accounts", target_client_id, ",".join(sorted(includes)),
+        [(acc.id, acc.ledger_sequence, acc.status, acc.balance) for acc, _ in rows],
+        [(item["agreement_id"], item["status"]) for items in agreements_by_account.values() for item in items]
+    ))
+    if not_modified:
+        return not_modified
+
+    now = datetime.utcnow().isoformat() + "Z"
+    accounts_data = []
+    for acc, client_name in rows:
+        item = {
+            "accountId": f"acc-{acc.id}",
+            "status": "Enabled" if acc.status == "active" else "Disabled",
+            "currency": acc.currency,
+            "accountType": "Personal" if acc.account_type == "checking" else "Business",
+            "accountSubType": acc.account_type.title(),
+            "nickname": f"{acc.account_type.title()} счет",
+            "openingDate": acc.opened_at.date().isoformat(),
             "account": [
+                {
+                    "schemeName": "RU.CBR.PAN",
+                    "identification": acc.account_number,
+                    "name": client_name or ""
+                }
+            ]
+        }
+        if "balances" in includes:
+            # Та же структура, что у GET /accounts/{account_id}/balances
+            item["balance"] = [
                 {
                     "accountId": f"acc-{acc.id}",
-                    "status": "Enabled" if acc.status == "active" else "Disabled",
-                    "currency": acc.currency,
-                    "accountType": "Personal" if acc.account_type == "checking" else "Business",
-                    "accountSubType": acc.account_type.title(),
-                    "nickname": f"{acc.account_type.title()} счет",
-                    "openingDate": acc.opened_at.date().isoformat(),
-                    "account": [
-                        {
-                            "schemeName": "RU.CBR.PAN",
-                            "identification": acc.account_number,
-                            "name": client_name
-                        }
-                    ]
+                    "type": balance_type,
+                    "dateTime": now,
+                    "amount": {
+                        "amount": str(acc.balance),
+                        "currency": acc.currency
+                    },
+                    "creditDebitIndicator": "Credit"
                 }
-                for acc in accounts
+                for balance_type in ("InterimAvailable", "InterimBooked")
             ]
+        if "agreements" in includes:
+            item["agreements"] = agreements_by_account.get(acc.id, [])
+        accounts_data.append(item)
+    
+    # Формируем ответ в формате OpenBanking Russia
+    return {
+        "data": {
+            "account": accounts_data
         },
         "links": {
             "self": "/accounts"
@@ -165,11 +316,20 @@ async def get_account(
 @router.get("/{account_id}/balances", summary="Получить балансы")
 async def get_balances(
     account_id: str,
+    response: Response,
+    date_time: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match"),
     x_consent_id: Optional[str] = Header(None, alias="x-consent-id"),
     current_client: Optional[dict] = Depends(get_current_client),
     db: AsyncSession = Depends(get_db)
 ):
-    """Получение баланса счета"""
+    """
+    Получение баланса счета
+
+    - **date_time**: остаток на момент времени (ISO 8601) вместо текущего
+
+    Поддерживает `If-None-Match`: 304, если с прошлого запроса не было проводок.
+    """
     
     acc_id = int(account_id.replace("acc-", ""))
     
@@ -185,6 +345,32 @@ async def get_balances(
     import logging
     logger = logging.getLogger(__name__)
     logger.info(f"Запрос баланса для account_id={account_id} (ID={acc_id}), номер={account.account_number}, баланс={account.balance}")
+
+    at = _parse_datetime(date_time, "date_time")
+    not_modified = _conditional(response, if_none_match, _etag(
+        "balances", account.id, account.ledger_sequence, account.balance, date_time or ""
+    ))
+    if not_modified:
+        return not_modified
+
+    if at:
+        balance = await LedgerService.balance_at(db, account, at)
+        return {
+            "data": {
+                "balance": [
+                    {
+                        "accountId": f"acc-{account.id}",
+                        "type": "ClosingBooked",
+                        "dateTime": at.isoformat() + "Z",
+                        "amount": {
+                            "amount": str(balance),
+                            "currency": account.currency
+                        },
+                        "creditDebitIndicator": "Credit" if balance >= 0 else "Debit"
+                    }
+                ]
+            }
+        }
     
     return {
         "data": {
@@ -214,28 +400,142 @@ async def get_balances(
     }
 
 
+@router.get("/{account_id}/statement", summary="Выписка: остатки и обороты за период")
+async def get_statement(
+    account_id: str,
+    from_booking_date_time: Optional[str] = None,
+    to_booking_date_time: Optional[str] = None,
+    x_consent_id: Optional[str] = Header(None, alias="x-consent-id"),
+    x_requesting_bank: Optional[str] = Header(None, alias="x-requesting-bank"),
+    current_client: Optional[dict] = Depends(get_optional_client),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Входящий и исходящий остаток и обороты по счету за период
+
+    Остатки берутся из ledger_entries (остаток после каждой проводки),
+    без суммирования истории. Без from_booking_date_time - с открытия счета,
+    без to_booking_date_time - по текущий момент.
+
+    Доступно владельцу счета или другому банку по согласию
+    (x-consent-id, x-requesting-bank) с ReadBalances и ReadTransactionsDetail.
+    """
+    account = await _get_readable_account(
+        db, account_id, current_client, x_consent_id, x_requesting_bank,
+        ["ReadBalances", "ReadTransactionsDetail"]
+    )
+
+    from_date = _parse_datetime(from_booking_date_time, "from_booking_date_time")
+    to_date = _parse_datetime(to_booking_date_time, "to_booking_date_time")
+    try:
+        statement = await LedgerService.statement(db, account, from_date, to_date)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+    return {
+        "data": {
+            "statement": {
+                "accountId": f"acc-{account.id}",
+                "fromBookingDateTime": from_date.isoformat() + "Z" if from_date else None,
+                "toBookingDateTime": (to_date or datetime.utcnow()).isoformat() + "Z",
+                "openingBalance": {"amount": str(statement["opening_balance"]), "currency": account.currency},
+                "closingBalance": {"amount": str(statement["closing_balance"]), "currency": account.currency},
+                "totalCredits": {"amount": str(statement["total_credits"]), "currency": account.currency},
+                "totalDebits": {"amount": str(statement["total_debits"]), "currency": account.currency},
+                "entriesCount": statement["entries_count"]
+            }
+        },
+        "links": {
+            "self": f"/accounts/{account_id}/statement",
+            "transactions": f"/accounts/{account_id}/transactions"
+        }
+    }
+
+
+def _encode_cursor(tx: Transaction) -> str:
+    """Непрозрачный курсор: позиция последней транзакции страницы"""
+    raw = json.dumps({"d": tx.transaction_date.isoformat(), "i": tx.id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+        return datetime.fromisoformat(data["d"]), int(data["i"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(400, "Invalid cursor")
+
+
 @router.get("/{account_id}/transactions", summary="Получить транзакции")
 async def get_transactions(
     account_id: str,
+    response: Response,
     from_booking_date_time: Optional[str] = None,
     to_booking_date_time: Optional[str] = None,
+    cursor: Optional[str] = None,
+    page_size: Optional[int] = None,
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match"),
     x_consent_id: Optional[str] = Header(None, alias="x-consent-id"),
     current_client: Optional[dict] = Depends(get_current_client),
     db: AsyncSession = Depends(get_db)
 ):
-    """Получение списка транзакций по счету"""
+    """
+    Получение списка транзакций по счету (от новых к старым)
+
+    - **from_booking_date_time**, **to_booking_date_time**: период (ISO 8601, включительно)
+    - **cursor**: значение из `links.next` предыдущей страницы
+    - **page_size**: размер страницы (по умолчанию TRANSACTIONS_PAGE_SIZE)
+
+    Поддерживает `If-None-Match`: 304 без чтения транзакций, если по счету
+    не было проводок.
+    """
     
     acc_id = int(account_id.replace("acc-", ""))
+    page_size = max(1, min(page_size or config.TRANSACTIONS_PAGE_SIZE, config.TRANSACTIONS_MAX_PAGE_SIZE))
+
+    # Версия счета - одна выборка по первичному ключу
+    version = (await db.execute(
+        select(Account.ledger_sequence).where(Account.id == acc_id)
+    )).scalar_one_or_none()
+    not_modified = _conditional(response, if_none_match, _etag(
+        "transactions", acc_id, version, from_booking_date_time, to_booking_date_time, cursor, page_size
+    ))
+    if not_modified:
+        return not_modified
     
     query = select(Transaction).where(Transaction.account_id == acc_id)
     
     # Фильтры по датам (опционально)
-    if from_booking_date_time:
-        # TODO: parse date
-        pass
+    from_date = _parse_datetime(from_booking_date_time, "from_booking_date_time")
+    to_date = _parse_datetime(to_booking_date_time, "to_booking_date_time")
+    if from_date:
+        query = query.where(Transaction.transaction_date >= from_date)
+    if to_date:
+        query = query.where(Transaction.transaction_date <= to_date)
+
+    # Keyset: продолжаем после последней строки предыдущей страницы (без OFFSET)
+    if cursor:
+        cursor_date, cursor_id = _decode_cursor(cursor)
+        query = query.where(
+            tuple_(Transaction.transaction_date, Transaction.id) < tuple_(cursor_date, cursor_id)
+        )
     
-    result = await db.execute(query.order_by(Transaction.transaction_date.desc()).limit(50))
+    result = await db.execute(
+        query.order_by(Transaction.transaction_date.desc(), Transaction.id.desc()).limit(page_size + 1)
+    )
     transactions = result.scalars().all()
+    has_more = len(transactions) > page_size
+    transactions = transactions[:page_size]
+
+    links = {"self": f"/accounts/{account_id}/transactions"}
+    if has_more:
+        params = {"cursor": _encode_cursor(transactions[-1]), "page_size": page_size}
+        if from_booking_date_time:
+            params["from_booking_date_time"] = from_booking_date_time
+        if to_booking_date_time:
+            params["to_booking_date_time"] = to_booking_date_time
+        links["next"] = f"/accounts/{account_id}/transactions?{urlencode(params)}"
     
     return {
         "data": {
@@ -259,12 +559,55 @@ async def get_transactions(
                 for tx in transactions
             ]
         },
-        "links": {
-            "self": f"/accounts/{account_id}/transactions"
+        "links": links,
+        "meta": {
+            "pageSize": page_size
         }
     }
 
 
+@router.get("/{account_id}/transactions/export", summary="Выгрузить историю транзакций")
+async def export_transactions(
+    account_id: str,
+    format: str = "csv",
+    from_booking_date_time: Optional[str] = None,
+    to_booking_date_time: Optional[str] = None,
+    x_consent_id: Optional[str] = Header(None, alias="x-consent-id"),
+    x_requesting_bank: Optional[str] = Header(None, alias="x-requesting-bank"),
+    current_client: Optional[dict] = Depends(get_optional_client),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Полная история счета потоком: CSV, NDJSON или OFX 2.2
+
+    - **format**: csv / ndjson / ofx
+    - **from_booking_date_time**, **to_booking_date_time**: период (ISO 8601, включительно)
+
+    Доступно владельцу счета или другому банку по согласию
+    (x-consent-id, x-requesting-bank) с ReadTransactionsDetail.
+
+    Строки читаются серверным курсором и отдаются по мере чтения,
+    поэтому выгрузка любой длины не держится в памяти целиком.
+    """
+    if format not in ("csv", "ndjson", "ofx"):
+        raise HTTPException(400, "format must be one of: csv, ndjson, ofx")
+
+    account = await _get_readable_account(
+        db, account_id, current_client, x_consent_id, x_requesting_bank, ["ReadTransactionsDetail"]
+    )
+
+    from_date = _parse_datetime(from_booking_date_time, "from_booking_date_time")
+    to_date = _parse_datetime(to_booking_date_time, "to_booking_date_time")
+
+    return StreamingResponse(
+        StatementExportService.stream(account, format, from_date, to_date),
+        media_type=StatementExportService.media_type(format),
+        headers={
+            "Content-Disposition": f'attachment; filename="{StatementExportService.filename(account, format)}"'
+        }
+    )
+
+
 class CreateAccountRequest(BaseModel):
     """Запрос на создание нового счета"""
     account_type: str
@@ -338,6 +681,7 @@ async def create_account(
     db.add(new_account)
     await db.commit()
     await db.refresh(new_account)
+    account_digest.account_opened(new_account.account_number)
     
     # Если начальный баланс > 0, создать транзакцию
     if request.initial_balance > 0:
@@ -404,9 +748,16 @@ async def update_account_status(
         raise HTTPException(400, f"Invalid status. Must be one of: {', '.join(valid_statuses)}")
     
     # Обновить статус
+    previous_status = account.status
     account.status = request.status
     await db.commit()
     
+    if previous_status != request.status:
+        if request.status == "active":
+            account_digest.account_opened(account.account_number)
+        elif previous_status == "active":
+            account_digest.account_closed(account.account_number)
+    
     return {
         "data": {
             "accountId": f"acc-{account.id}",
@@ -453,8 +804,6 @@ async def close_account_with_balance(
     if client.person_id != current_client["client_id"]:
         raise HTTPException(403, "Access denied")
     
-    balance = account.balance
-    
     if request.action == "transfer":
         # Перевести остаток на другой счет
         if not request.destination_account_id:
@@ -469,9 +818,14 @@ async def close_account_with_balance(
         if not dest_account:
             raise HTTPException(404, "Destination account not found")
         
-        # Перевести средства
-        dest_account.balance += balance
-        account.balance = Decimal("0")
+        if dest_account.id == account.id:
+            raise HTTPException(400, "Cannot transfer to the same account")
+        
+        # Перевести средства: остаток берется под блокировкой, чтобы не потерять
+        # параллельные зачисления
+        locked = await PostingService.lock_balances(db, [account.id, dest_account.id])
+        balance = locked[account.id]
+        await PostingService.post(db, [(account.id, -balance), (dest_account.id, balance)])
         
         # Создать транзакции
         debit_tx = Transaction(
@@ -496,15 +850,11 @@ async def close_account_with_balance(
         
     elif request.action == "donate":
         # Подарить банку (увеличить capital)
-        from config import config
-        
-        capital_result = await db.execute(
-            select(BankCapital).where(BankCapital.bank_code == config.BANK_CODE)
-        )
-        capital = capital_result.scalar_one_or_none()
+        locked = await PostingService.lock_balances(db, [account.id])
+        balance = locked[account.id]
+        await PostingService.post(db, [(account.id, -balance)])
         
-        if capital:
-            capital.capital += balance
+        capital_ledger.record(db, capital_change=balance, reason=f"Donation on closing {account.account_number}")
         
         # Создать транзакцию списания
         donate_tx = Transaction(
@@ -516,16 +866,18 @@ async def close_account_with_balance(
             description="Дарение средств банку при закрытии счета"
         )
         db.add(donate_tx)
-        
-        account.balance = Decimal("0")
     
     else:
         raise HTTPException(400, f"Invalid action: {request.action}")
     
     # Закрыть счет
+    was_active = account.status == "active"
     account.status = "closed"
     await db.commit()
     
+    if was_active:
+        account_digest.account_closed(account.account_number)
+    
     return {
         "data": {
             "accountId": f"acc-{account.id}",
@@ -582,9 +934,14 @@ async def delete_account(
     logger.info(f"Удаление счета ID={acc_id} для client_id={current_client['client_id']}")
     
     # Удаляем счет из БД
+    was_active = account.status == "active"
+    account_number = account.account_number
     await db.delete(account)
     await db.commit()
     
+    if was_active:
+        account_digest.account_closed(account_number)
+    
     return None
 
 
@@ -651,6 +1008,7 @@ async def create_account_simple(
     db.add(new_account)
     await db.commit()
     await db.refresh(new_account)
+    account_digest.account_opened(new_account.account_number)
     
     # Если начальный баланс > 0, создать транзакцию
     if request.balance > 0:
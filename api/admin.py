@@ -11,7 +11,8 @@ from decimal import Decimal
 from datetime import datetime
 
 from database import get_db
-from models import BankCapital, InterbankTransfer, Payment, Account, BankSettings, KeyRateHistory, Team, ConsentRequest, Client, Consent
+from services.capital_service import capital_ledger
+from models import InterbankTransfer, Payment, Account, BankSettings, KeyRateHistory, Team, ConsentRequest, Client, Consent
 
 router = APIRouter(prefix="/admin", tags=["Internal: Admin"], include_in_schema=False)
 
@@ -23,10 +24,10 @@ async def get_capital(
     """
     Получить капитал банка
     
-    Для админ панели
+    Для админ панели. Значения включают еще не свернутые изменения
+    (bank_capital + bank_capital_deltas).
     """
-    result = await db.execute(select(BankCapital))
-    capitals = result.scalars().all()
+    capitals = (await capital_ledger.snapshots(db)).values()
     
     return {
         "banks": [
@@ -37,7 +38,8 @@ async def get_capital(
                 "change": float(cap.capital - cap.initial_capital),
                 "total_deposits": float(cap.total_deposits),
                 "total_loans": float(cap.total_loans),
-                "updated_at": cap.updated_at.isoformat()
+                "pending_deltas": cap.pending_deltas,
+                "updated_at": cap.updated_at.isoformat() if cap.updated_at else None
             }
             for cap in capitals
         ]
@@ -119,9 +121,8 @@ async def get_stats(
     """
     Общая статистика банка
     """
-    # Капитал
-    capital_result = await db.execute(select(BankCapital).limit(1))
-    capital = capital_result.scalar_one_or_none()
+    # Капитал (с учетом несвернутых изменений)
+    capital = await capital_ledger.effective(db)
     
     # Подсчет платежей
     payments_count_result = await db.execute(
@@ -12,6 +12,8 @@ from config import config
 from database import get_db
 from models import Client, Team, Account
 from services.auth_service import create_access_token, hash_password, verify_password, get_current_client
+from services.account_digest_service import account_digest
+from services.multibank_prefetch import multibank_prefetch
 
 
 router = APIRouter(prefix="/auth")
@@ -103,6 +105,7 @@ async def login(
                 )
                 db.add(account)
                 await db.commit()
+                account_digest.account_opened(account_number)
                 
                 # Перезагружаем клиента
                 result = await db.execute(
@@ -128,6 +131,9 @@ async def login(
     
     print(f"✅ Authentication successful for {request.username}")
     
+    # Прогреть данные подключенных банков к первому дашборду
+    multibank_prefetch.touch(client.id)
+    
     # Создать JWT токен
     access_token = create_access_token(
         data={
@@ -1,11 +1,12 @@
 """
 Banker API - Кабинет банкира
 """
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func
 from pydantic import BaseModel
 from decimal import Decimal
+from typing import Literal
 from datetime import datetime
 import uuid
 
@@ -23,27 +24,6 @@ class ProductUpdate(BaseModel):
     is_active: bool = None
 
 
-@router.get("/clients")
-async def get_all_clients(db: AsyncSession = Depends(get_db)):
-    """Получить всех клиентов (для банкира)"""
-    result = await db.execute(select(Client).order_by(Client.created_at.desc()))
-    clients = result.scalars().all()
-    
-    return [
-        {
-            "id": c.id,
-            "person_id": c.person_id,
-            "client_type": c.client_type,
-            "full_name": c.full_name,
-            "segment": c.segment,
-            "birth_year": c.birth_year,
-            "monthly_income": float(c.monthly_income) if c.monthly_income else None,
-            "created_at": c.created_at.isoformat() if c.created_at else None
-        }
-        for c in clients
-    ]
-
-
 @router.get("/products")
 async def get_all_products(db: AsyncSession = Depends(get_db)):
     """Получить все продукты (для банкира)"""
@@ -259,49 +239,97 @@ async def reject_consent(
 
 # === Client Management ===
 
+# Допустимые значения sort для списка клиентов
+CLIENT_SORTS = ("created_at", "full_name", "accounts_count", "total_balance", "agreements_count")
+
+
 @router.get("/clients")
-async def get_clients(db: AsyncSession = Depends(get_db)):
+async def get_clients(
+    response: Response,
+    sort: Literal[CLIENT_SORTS] = "created_at",
+    order: Literal["asc", "desc"] = "desc",
+    offset: int = 0,
+    limit: int = 100,
+    db: AsyncSession = Depends(get_db)
+):
     """
     Получить список всех клиентов банка с агрегированными данными
+
+    Счета и договоры считаются одним запросом: агрегаты по accounts и
+    product_agreements (GROUP BY client_id) присоединяются LEFT JOIN.
+
+    - **sort**: created_at / full_name / accounts_count / total_balance / agreements_count
+    - **order**: asc / desc
+    - **offset**, **limit**: пагинация (limit до 1000)
+
+    Ответ - JSON список клиентов (как раньше); общее число клиентов -
+    в заголовке `X-Total-Count`.
     """
-    result = await db.execute(select(Client))
-    clients = result.scalars().all()
-    
-    clients_data = []
-    for client in clients:
-        # Get client accounts count and total balance
-        accounts_result = await db.execute(
-            select(func.count(Account.id), func.sum(Account.balance))
-            .where(Account.client_id == client.id)
-            .where(Account.status == "active")
+    limit = max(1, min(limit, 1000))
+    offset = max(0, offset)
+
+    accounts = (
+        select(
+            Account.client_id,
+            func.count(Account.id).label("accounts_count"),
+            func.sum(Account.balance).label("total_balance")
         )
-        accounts_count, total_balance = accounts_result.first()
-        
-        # Get product agreements count
-        agreements_result = await db.execute(
-            select(func.count(ProductAgreement.id))
-            .where(ProductAgreement.client_id == client.id)
-            .where(ProductAgreement.status == "active")
+        .where(Account.status == "active")
+        .group_by(Account.client_id)
+        .subquery()
+    )
+    agreements = (
+        select(
+            ProductAgreement.client_id,
+            func.count(ProductAgreement.id).label("agreements_count")
         )
-        agreements_count = agreements_result.scalar()
-        
-        clients_data.append({
+        .where(ProductAgreement.status == "active")
+        .group_by(ProductAgreement.client_id)
+        .subquery()
+    )
+    accounts_count = func.coalesce(accounts.c.accounts_count, 0)
+    total_balance = func.coalesce(accounts.c.total_balance, 0)
+    agreements_count = func.coalesce(agreements.c.agreements_count, 0)
+
+    sort_column = {
+        "created_at": Client.created_at,
+        "full_name": Client.full_name,
+        "accounts_count": accounts_count,
+        "total_balance": total_balance,
+        "agreements_count": agreements_count
+    }[sort]
+    ordering = sort_column.asc() if order == "asc" else sort_column.desc()
+
+    total = (await db.execute(select(func.count(Client.id)))).scalar()
+    result = await db.execute(
+        select(Client, accounts_count, total_balance, agreements_count)
+        .outerjoin(accounts, accounts.c.client_id == Client.id)
+        .outerjoin(agreements, agreements.c.client_id == Client.id)
+        .order_by(ordering, Client.id)
+        .offset(offset)
+        .limit(limit)
+    )
+
+    clients_data = [
+        {
+            "id": client.id,
             "client_id": client.person_id,
+            "person_id": client.person_id,
             "full_name": client.full_name,
             "client_type": client.client_type,
             "segment": client.segment,
-            "accounts_count": accounts_count or 0,
-            "total_balance": float(total_balance) if total_balance else 0,
-            "agreements_count": agreements_count or 0,
-            "created_at": client.created_at.isoformat()
-        })
-    
-    return {
-        "data": clients_data,
-        "meta": {
-            "total": len(clients_data)
+            "birth_year": client.birth_year,
+            "monthly_income": float(client.monthly_income) if client.monthly_income else None,
+            "accounts_count": client_accounts,
+            "total_balance": float(client_balance) if client_balance else 0,
+            "agreements_count": client_agreements,
+            "created_at": client.created_at.isoformat() if client.created_at else None
         }
-    }
+        for client, client_accounts, client_balance, client_agreements in result.all()
+    ]
+    
+    response.headers["X-Total-Count"] = str(total)
+    return clients_data
 
 
 @router.get("/clients/{client_id}")
@@ -0,0 +1,85 @@
+"""
+Events API - поток событий клиента (Server-Sent Events)
+Статусы платежей, изменения балансов и новые уведомления без опроса.
+"""
+import asyncio
+import json
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+
+from config import config
+from database import AsyncSessionLocal
+from models import Client
+from services.auth_service import verify_token
+from services.event_bus import event_bus
+
+
+router = APIRouter(prefix="/events", tags=["Internal: Events"], include_in_schema=False)
+
+
+def _format_sse(item: dict) -> str:
+    return f"id: {item['id']}\nevent: {item['event']}\ndata: {json.dumps(item['data'], ensure_ascii=False)}\n\n"
+
+
+@router.get("/stream", summary="Поток событий клиента (SSE)")
+async def event_stream(
+    request: Request,
+    access_token: Optional[str] = Query(None, description="JWT клиента (EventSource не передает заголовки)")
+):
+    """
+    Server-Sent Events: `payment.status`, `balance.changed`, `notification.created`
+
+    Токен передается в `Authorization: Bearer` или в `?access_token=`.
+    Если клиент не успевает читать и буфер подключения переполняется, старые
+    события отбрасываются и приходит `resync` - состояние нужно перечитать.
+    """
+    token = access_token
+    authorization = request.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        token = authorization[7:]
+    if not token:
+        raise HTTPException(401, "Unauthorized")
+
+    payload = await verify_token(token)
+    if payload.get("type") != "client":
+        raise HTTPException(401, "Unauthorized")
+
+    # Своя сессия: ответ стрим, сессия из get_db закрылась бы раньше него
+    async with AsyncSessionLocal() as db:
+        client_id = (await db.execute(
+            select(Client.id).where(Client.person_id == payload.get("sub"))
+        )).scalar_one_or_none()
+    if client_id is None:
+        raise HTTPException(401, "Client not found")
+
+    subscription = event_bus.subscribe(client_id)
+
+    async def stream():
+        try:
+            yield "retry: 3000\n: connected\n\n"
+            while True:
+                try:
+                    item = await asyncio.wait_for(
+                        subscription.queue.get(), timeout=config.EVENT_STREAM_HEARTBEAT_SECONDS
+                    )
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": heartbeat\n\n"
+                    continue
+
+                if subscription.overflowed:
+                    subscription.overflowed = False
+                    yield "event: resync\ndata: {}\n\n"
+                yield _format_sse(item)
+        finally:
+            event_bus.unsubscribe(subscription)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -2,18 +2,25 @@
 Interbank API - Прием межбанковских переводов
 Используется для коммуникации между банками
 """
-from fastapi import APIRouter, Depends, HTTPException, Header
+from fastapi import APIRouter, Depends, HTTPException, Header, Response
+from fastapi.responses import JSONResponse
+from jose import JWTError
 from pydantic import BaseModel, Field
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from typing import Optional
+from sqlalchemy import select, insert
+from sqlalchemy.exc import IntegrityError
+from typing import List, Optional
 from datetime import datetime
 from decimal import Decimal
 import uuid
 
 from database import get_db
 from models import Account, Payment, Transaction, InterbankTransfer, BankCapital
-from services.payment_service import PaymentService
+from services.payment_service import PaymentService, batch_digest
+from services.auth_service import verify_rs256_token
+from services.account_digest_service import account_digest
+from services.idempotency_service import IdempotencyService
+from services.posting_service import PostingService
 from config import config
 
 
@@ -46,6 +53,7 @@ class InterbankTransferResponse(BaseModel):
 async def receive_interbank_transfer(
     request: InterbankTransferRequest,
     x_bank_auth_token: Optional[str] = Header(None, alias="x-bank-auth-token"),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     db: AsyncSession = Depends(get_db)
 ):
     """
@@ -75,71 +83,281 @@ async def receive_interbank_transfer(
       "description": "Межбанковский перевод"
     }
     ```
+    
+    ### Идемпотентность:
+    - Ключ - заголовок `Idempotency-Key`, а если его нет - `transfer_id`
+    - Повтор возвращает сохраненный ответ без повторного зачисления
+    - Перевод с уже зачисленным `transfer_id` (в том числе пакетом) - 200
+      без повторного зачисления
     """
     
     # TODO: Проверить x_bank_auth_token (в продакшене)
     # В MVP пропускаем для упрощения
     
+    return await IdempotencyService.execute(
+        db=db,
+        scope="interbank-receive",
+        caller=request.from_bank,
+        key=idempotency_key or request.transfer_id,
+        payload=request,
+        handler=lambda: _receive_interbank_transfer(request, db),
+        status_code=201
+    )
+
+
+async def _already_processed(request: InterbankTransferRequest, db: AsyncSession) -> Optional[JSONResponse]:
+    """200 с данными зачисления, если перевод с этим transfer_id уже зачислен"""
+    result = await db.execute(
+        select(InterbankTransfer).where(InterbankTransfer.transfer_id == request.transfer_id)
+    )
+    existing = result.scalar_one_or_none()
+    if not existing:
+        return None
+    return JSONResponse(status_code=200, content=InterbankTransferResponse(
+        success=True,
+        transfer_id=request.transfer_id,
+        message=f"Transfer already processed. Credited to account {request.to_account_number}",
+        credited_at=(existing.completed_at or existing.created_at).isoformat() + "Z"
+    ).model_dump())
+
+
+async def _receive_interbank_transfer(
+    request: InterbankTransferRequest,
+    db: AsyncSession
+):
+    """Зачисление входящего перевода (без учета Idempotency-Key)"""
     try:
         amount = Decimal(request.amount)
+    except ArithmeticError:
+        raise HTTPException(400, f"Invalid amount: {request.amount}")
+    
+    # 0. Повторная доставка того же перевода (outbox банка-отправителя
+    # повторяет отправку при таймаутах) - зачислять второй раз нельзя
+    already = await _already_processed(request, db)
+    if already:
+        return already
+    
+    try:
+        # Зачисление - в savepoint: если тот же перевод параллельно зачислил
+        # пакет (netting), уникальный transfer_id откатит только его
+        async with db.begin_nested():
+            return await _credit_interbank_transfer(request, amount, db)
+    except IntegrityError:
+        already = await _already_processed(request, db)
+        if already:
+            return already
+        raise
+
+
+async def _credit_interbank_transfer(
+    request: InterbankTransferRequest,
+    amount: Decimal,
+    db: AsyncSession
+) -> InterbankTransferResponse:
+    """Зачислить перевод: счет, транзакция, капитал, запись InterbankTransfer"""
+    # 1. Найти счет получателя
+    result = await db.execute(
+        select(Account).where(Account.account_number == request.to_account_number)
+    )
+    to_account = result.scalar_one_or_none()
+    
+    if not to_account:
+        raise HTTPException(404, f"Account {request.to_account_number} not found in {config.BANK_CODE}")
+    
+    # 2. Зачислить деньги на счет
+    await PostingService.credit(db, to_account.id, amount)
+    
+    # 3. Создать транзакцию (Credit - зачисление)
+    transaction = Transaction(
+        account_id=to_account.id,
+        transaction_id=f"tx-{uuid.uuid4().hex[:12]}",
+        amount=amount,
+        direction="credit",
+        counterparty=request.from_bank,
+        description=f"Входящий перевод из {request.from_bank}: {request.description}",
+        transaction_date=datetime.utcnow()
+    )
+    db.add(transaction)
+    
+    # 4. Обновить капитал банка-получателя (+amount)
+    await PaymentService.update_bank_capital(
+        db=db,
+        amount_change=amount,
+        reason=f"Incoming transfer from {request.from_bank}: {request.transfer_id}"
+    )
+    
+    # 5. Сохранить запись InterbankTransfer
+    interbank_transfer = InterbankTransfer(
+        transfer_id=request.transfer_id,
+        payment_id=None,  # На стороне получателя нет payment
+        from_bank=request.from_bank,
+        to_bank=config.BANK_CODE,
+        amount=amount,
+        status="completed",
+        completed_at=datetime.utcnow()
+    )
+    db.add(interbank_transfer)
+    
+    await db.flush()
+    await db.refresh(to_account)
+    
+    return InterbankTransferResponse(
+        success=True,
+        transfer_id=request.transfer_id,
+        message=f"Transfer completed successfully. Credited to account {request.to_account_number}",
+        credited_at=datetime.utcnow().isoformat() + "Z"
+    )
+
+
+class InterbankBatchTransfer(BaseModel):
+    """Перевод внутри пакета netting"""
+    transfer_id: str
+    to_account_number: str
+    amount: str
+    currency: str = "RUB"
+    description: Optional[str] = ""
+
+
+class InterbankBatchRequest(BaseModel):
+    """Пакет входящих межбанковских переводов"""
+    batch_id: str = Field(..., description="ID пакета в банке-отправителе")
+    from_bank: str = Field(..., description="Код банка-отправителя")
+    transfers: List[InterbankBatchTransfer] = Field(..., min_length=1)
+
+
+@router.post("/receive-batch", status_code=201)
+async def receive_interbank_batch(
+    request: InterbankBatchRequest,
+    x_batch_signature: Optional[str] = Header(None, alias="x-batch-signature"),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    ## 📦 Прием пакета межбанковских переводов (netting)
+    
+    Банк-отправитель копит переводы за короткое окно и присылает их одним
+    пакетом. Все зачисления выполняются в одной транзакции, капитал банка
+    изменяется одной суммой.
+    
+    ### Безопасность:
+    - Header `x-batch-signature` - RS256 JWT банка-отправителя, проверяется
+      только его открытым ключом (`sub` = from_bank, `batch_id`,
+      `digest` = sha256 списка переводов); HS256 не принимается
+    
+    ### Результат по каждому переводу:
+    - `completed` - зачислен
+    - `duplicate` - уже был зачислен раньше (повторная доставка)
+    - `rejected` - счет получателя не найден или неверная сумма
+    """
+    if not x_batch_signature:
+        raise HTTPException(401, "Missing x-batch-signature")
+    if request.from_bank not in config.interbank_peers():
+        raise HTTPException(403, f"Unknown bank: {request.from_bank}")
+    try:
+        claims = await verify_rs256_token(x_batch_signature, request.from_bank)
+    except JWTError:
+        raise HTTPException(401, "Invalid batch signature")
+    transfers = [transfer.model_dump() for transfer in request.transfers]
+    if (
+        claims.get("type") != "interbank-batch"
+        or claims.get("sub") != request.from_bank
+        or claims.get("batch_id") != request.batch_id
+        or claims.get("digest") != batch_digest(transfers)
+    ):
+        raise HTTPException(401, "Invalid batch signature")
+    
+    return await IdempotencyService.execute(
+        db=db,
+        scope="interbank-receive-batch",
+        caller=request.from_bank,
+        key=idempotency_key or request.batch_id,
+        payload=request,
+        handler=lambda: _receive_interbank_batch(request, db),
+        status_code=201
+    )
+
+
+async def _receive_interbank_batch(request: InterbankBatchRequest, db: AsyncSession) -> dict:
+    """Зачисление пакета переводов (без учета Idempotency-Key)"""
+    transfer_ids = [transfer.transfer_id for transfer in request.transfers]
+    numbers = {transfer.to_account_number for transfer in request.transfers}
+    
+    # Уже зачисленные переводы (например, отправленные раньше по одному)
+    result = await db.execute(
+        select(InterbankTransfer.transfer_id).where(InterbankTransfer.transfer_id.in_(transfer_ids))
+    )
+    already = set(result.scalars().all())
+    
+    result = await db.execute(
+        select(Account.id, Account.account_number).where(Account.account_number.in_(numbers))
+    )
+    accounts = {number: account_id for account_id, number in result.all()}
+    
+    now = datetime.utcnow()
+    results, credits, transactions, transfer_rows = [], {}, [], []
+    seen = set()
+    total = Decimal("0")
+    for transfer in request.transfers:
+        if transfer.transfer_id in already or transfer.transfer_id in seen:
+            results.append({"transfer_id": transfer.transfer_id, "status": "duplicate"})
+            continue
+        seen.add(transfer.transfer_id)
         
-        # 1. Найти счет получателя
-        result = await db.execute(
-            select(Account).where(Account.account_number == request.to_account_number)
-        )
-        to_account = result.scalar_one_or_none()
-        
-        if not to_account:
-            raise HTTPException(404, f"Account {request.to_account_number} not found in {config.BANK_CODE}")
-        
-        # 2. Зачислить деньги на счет
-        to_account.balance += amount
-        
-        # 3. Создать транзакцию (Credit - зачисление)
-        transaction = Transaction(
-            account_id=to_account.id,
-            transaction_type="Credit",
-            amount=amount,
-            balance_after=to_account.balance,
-            description=f"Входящий перевод из {request.from_bank}: {request.description}",
-            transaction_date=datetime.utcnow()
-        )
-        db.add(transaction)
+        account_id = accounts.get(transfer.to_account_number)
+        try:
+            amount = Decimal(transfer.amount)
+        except Exception:
+            amount = None
+        if not account_id or amount is None or not amount.is_finite() or amount <= 0:
+            error = (
+                f"Account {transfer.to_account_number} not found in {config.BANK_CODE}"
+                if not account_id else "Invalid amount"
+            )
+            results.append({"transfer_id": transfer.transfer_id, "status": "rejected", "error": error})
+            continue
         
-        # 4. Обновить капитал банка-получателя (+amount)
+        credits[account_id] = credits.get(account_id, Decimal("0")) + amount
+        total += amount
+        transactions.append({
+            "account_id": account_id,
+            "transaction_id": f"tx-{uuid.uuid4().hex[:12]}",
+            "amount": amount,
+            "direction": "credit",
+            "counterparty": request.from_bank,
+            "description": f"Входящий перевод из {request.from_bank}: {transfer.description or ''}",
+            "transaction_date": now
+        })
+        transfer_rows.append({
+            "transfer_id": transfer.transfer_id,
+            "payment_id": None,
+            "from_bank": request.from_bank,
+            "to_bank": config.BANK_CODE,
+            "amount": amount,
+            "status": "completed",
+            "created_at": now,
+            "completed_at": now
+        })
+        results.append({"transfer_id": transfer.transfer_id, "status": "completed"})
+    
+    if credits:
+        await PostingService.credit_many(db, credits)
+        await db.execute(insert(Transaction), transactions)
+        await db.execute(insert(InterbankTransfer), transfer_rows)
+        # Одно изменение капитала на весь пакет
         await PaymentService.update_bank_capital(
             db=db,
-            amount_change=amount,
-            reason=f"Incoming transfer from {request.from_bank}: {request.transfer_id}"
-        )
-        
-        # 5. Сохранить запись InterbankTransfer
-        interbank_transfer = InterbankTransfer(
-            transfer_id=request.transfer_id,
-            payment_id=None,  # На стороне получателя нет payment
-            from_bank=request.from_bank,
-            to_bank=config.BANK_CODE,
-            amount=amount,
-            status="completed",
-            completed_at=datetime.utcnow()
+            amount_change=total,
+            reason=f"Incoming netting batch from {request.from_bank}: {request.batch_id} ({len(transfer_rows)} transfers)"
         )
-        db.add(interbank_transfer)
-        
-        await db.commit()
-        await db.refresh(to_account)
-        
-        return InterbankTransferResponse(
-            success=True,
-            transfer_id=request.transfer_id,
-            message=f"Transfer completed successfully. Credited to account {request.to_account_number}",
-            credited_at=datetime.utcnow().isoformat() + "Z"
-        )
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        await db.rollback()
-        raise HTTPException(400, f"Failed to process transfer: {str(e)}")
+    await db.flush()
+    
+    return {
+        "batch_id": request.batch_id,
+        "credited_count": len(transfer_rows),
+        "credited_amount": str(total),
+        "credited_at": now.isoformat() + "Z",
+        "results": results
+    }
 
 
 @router.get("/check-account/{account_number}")
@@ -174,6 +392,38 @@ async def check_account_exists(
         raise HTTPException(404, f"Account {account_number} not found")
 
 
+@router.get("/account-digest")
+async def get_account_digest(
+    known_version: Optional[str] = None,
+    x_bank_auth_token: Optional[str] = Header(None, alias="x-bank-auth-token")
+):
+    """
+    ## 🧮 Bloom-фильтр номеров счетов банка
+    
+    Используется другими банками для маршрутизации переводов без опроса
+    `/interbank/check-account` каждого банка.
+    
+    ### Параметры:
+    - `known_version` - версия фильтра, уже известная вызывающему банку
+    
+    ### Возвращает:
+    - 200 OK - фильтр (`bits` — битовый массив, сжатый zlib, в base64)
+    - 304 Not Modified - если `known_version` совпадает с текущей версией
+    - 503 - если фильтр еще не построен
+    """
+    # TODO: Проверить x_bank_auth_token (в продакшене)
+    
+    payload = account_digest.publish()
+    
+    if payload is None:
+        raise HTTPException(503, "Account digest is not ready")
+    
+    if known_version and known_version == payload["version"]:
+        return Response(status_code=304)
+    
+    return payload
+
+
 @router.get("/transfers", response_model=list)
 async def list_interbank_transfers(
     db: AsyncSession = Depends(get_db),
@@ -2,12 +2,30 @@
 Multibank Proxy API - Проксирование запросов к другим банкам
 Реализует правильный OpenBanking flow через consent (согласия)
 """
-from fastapi import APIRouter, HTTPException, Header
-from pydantic import BaseModel
-from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Header, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, Field
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Literal, Optional
+from datetime import datetime
+from decimal import Decimal
 import httpx
+import json
 import logging
 from config import config
+from database import get_db
+from models import BankConnection
+from services.auth_service import get_current_client
+from services.bank_connection_service import BankConnectionError, BankConnectionService
+from services.bank_guard import BankUnavailableError, bank_guards
+from services.bank_token_cache import BankTokenError, bank_token_cache
+from services.consent_job_service import TERMINAL_STATUSES, consent_jobs
+from services.http_client_pool import http_pool
+from services.multibank_prefetch import multibank_prefetch
+from services.multibank_service import RESOURCES, MultibankService, RemoteBankError
+from services.remote_cache import STALE
+from services.remote_mirror import ERROR, remote_mirror
 
 logger = logging.getLogger(__name__)
 
@@ -16,26 +34,28 @@ router = APIRouter(prefix="/multibank", tags=["Internal: Multibank"], include_in
 # Креды команды из конфига
 # TEAM_CLIENT_ID - это ID команды (например, "team251"), используется для межбанковских запросов
 # Не путать с client_id пользователя (например, "team251-1")
-# Эти креды используются для получения банковского токена от песочниц банков
+# Эти креды используются для получения банковского токена от песочниц банков (BankTokenCache)
 TEAM_CLIENT_ID = config.TEAM_CLIENT_ID or "team251"
-TEAM_CLIENT_SECRET = config.TEAM_CLIENT_SECRET or "iOin4bZP3rRl44r7TNy5ZigMUjcQIem1"
 
 logger.info(f"Multibank API: TEAM_CLIENT_ID={TEAM_CLIENT_ID}, TEAM_CLIENT_SECRET={'*' * 10}")
 
 
 class BankTokenRequest(BaseModel):
     bank_url: str
+    force_refresh: bool = False  # Получить новый токен, минуя кэш
 
 
+# bank_token в запросах ниже необязателен: без него берется кэшированный токен банка
+
 class ConsentRequest(BaseModel):
     bank_url: str
-    bank_token: str
+    bank_token: Optional[str] = None
     client_id: str  # ID клиента в целевом банке
 
 
 class AccountsWithConsentRequest(BaseModel):
     bank_url: str
-    bank_token: str
+    bank_token: Optional[str] = None
     consent_id: str
     client_id: str
 
@@ -43,15 +63,53 @@ class AccountsWithConsentRequest(BaseModel):
 class TransactionsWithConsentRequest(BaseModel):
     account_id: str
     bank_url: str
-    bank_token: str
+    bank_token: Optional[str] = None
     consent_id: str
 
 
 class CardsWithConsentRequest(BaseModel):
     bank_url: str
-    bank_token: str
+    bank_token: Optional[str] = None
+    consent_id: str
+    client_id: str
+
+
+class MirrorAccount(BaseModel):
+    bank_url: str
+    account_id: str
+    consent_id: str
+    bank_token: Optional[str] = None
+
+
+class MirrorQueryRequest(BaseModel):
+    accounts: List[MirrorAccount]
+    from_booking_date_time: Optional[datetime] = None
+    to_booking_date_time: Optional[datetime] = None
+    search: Optional[str] = Field(None, max_length=100, description="Текст в описании транзакции")
+    min_amount: Optional[Decimal] = Field(None, ge=0)
+    max_amount: Optional[Decimal] = Field(None, ge=0)
+    credit_debit: Optional[Literal["Credit", "Debit"]] = None
+    limit: Optional[int] = Field(None, ge=1, le=config.TRANSACTIONS_MAX_PAGE_SIZE)
+
+
+class DashboardBank(BaseModel):
+    bank_url: str
     consent_id: str
     client_id: str
+    bank_token: Optional[str] = None
+
+
+class DashboardRequest(BaseModel):
+    banks: List[DashboardBank]
+    include: List[str] = Field(default_factory=lambda: list(RESOURCES))
+    deadline_seconds: Optional[float] = Field(None, gt=0, le=60, description="Дедлайн одного банка")
+
+
+class ConnectionRequest(BaseModel):
+    bank_url: str
+    client_id: str  # ID клиента в целевом банке
+    consent_id: Optional[str] = None  # Уже подписанное согласие - новое не запрашивается
+    bank_token: Optional[str] = None
 
 
 class LoginRequest(BaseModel):
@@ -66,6 +124,28 @@ class ProxyRequest(BaseModel):
     token: str
 
 
+async def _bank_token(bank_url: str, provided: Optional[str]) -> str:
+    """Токен из запроса или кэшированный токен банка"""
+    if provided:
+        return provided
+    try:
+        return await bank_token_cache.token(bank_url)
+    except BankTokenError as e:
+        raise HTTPException(e.status_code, e.detail)
+    except BankUnavailableError as e:
+        raise HTTPException(503, str(e))
+    except httpx.TimeoutException:
+        raise HTTPException(504, "Bank server timeout")
+    except httpx.RequestError as e:
+        raise HTTPException(502, f"Connection error: {str(e)}")
+
+
+def _forget_token_on_401(bank_url: str, token: str, status_code: int):
+    """Банк отклонил токен - следующий запрос получит новый"""
+    if status_code == 401:
+        bank_token_cache.invalidate(bank_url, token)
+
+
 @router.post("/bank-token")
 async def get_bank_token(request: BankTokenRequest):
     """
@@ -73,34 +153,94 @@ async def get_bank_token(request: BankTokenRequest):
     
     Использует креды команды (client_id и client_secret) для доступа к песочницам банков
     Для команды team251: client_id=team251, client_secret из конфига
+
+    Токен кэшируется по bank_url до истечения (expires_in в ответе - оставшееся
+    время); одновременные запросы к одному банку получают один и тот же токен.
+    """
+    try:
+        return await bank_token_cache.get(request.bank_url, force_refresh=request.force_refresh)
+    except BankTokenError as e:
+        raise HTTPException(e.status_code, e.detail)
+    except BankUnavailableError as e:
+        raise HTTPException(503, str(e))
+    except httpx.TimeoutException:
+        raise HTTPException(504, "Bank server timeout")
+    except httpx.RequestError as e:
+        raise HTTPException(502, f"Connection error: {str(e)}")
+
+
+async def _request_consent(
+    bank_url: str,
+    bank_token: str,
+    client_id: str,
+    connection_id: Optional[int] = None
+) -> dict:
+    """
+    Запросить согласие у банка; если его нужно подписать (SBank) - создать
+    задание ожидания (итог запишется в подключение connection_id, если задано)
     """
     try:
-        logger.info(f"Запрос банковского токена от {request.bank_url} используя TEAM_CLIENT_ID={TEAM_CLIENT_ID}")
+        client = http_pool.client_for(bank_url)
+        # Запрос на создание consent (формат согласно API банков)
+        consent_data = {
+            "client_id": client_id,
+            "permissions": [
+                "ReadAccountsBasic", 
+                "ReadAccountsDetail", 
+                "ReadBalances", 
+                "ReadTransactionsDetail",
+                "ReadCards"  # Добавляем разрешение на чтение карт
+            ],
+            "expiration_date": "2025-12-31T23:59:59.000Z"
+        }
+        
+        response = await client.post(
+            f"{bank_url}/account-consents/request",
+            json=consent_data,
+            headers={
+                "Authorization": f"Bearer {bank_token}",
+                "Content-Type": "application/json",
+                "x-requesting-bank": TEAM_CLIENT_ID  # ВАЖНО: указываем requesting_bank!
+            }
+        )
         
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(
-                f"{request.bank_url}/auth/bank-token",
-                params={
-                    "client_id": TEAM_CLIENT_ID,
-                    "client_secret": TEAM_CLIENT_SECRET
-                },
-                headers={"accept": "application/json"}
+        if response.status_code not in [200, 201]:
+            _forget_token_on_401(bank_url, bank_token, response.status_code)
+            raise HTTPException(
+                response.status_code,
+                f"Failed to request consent: {response.text}"
+            )
+        
+        consent_response = response.json()
+        
+        # Проверяем, является ли это SBank
+        is_sbank = "sbank" in bank_url.lower() or "smart" in bank_url.lower()
+        
+        # Если это SBank и согласие требует подписания - ждем в фоне, не держа запрос
+        if is_sbank:
+            request_id = (
+                consent_response.get("Data", {}).get("ConsentRequestId") or
+                consent_response.get("request_id") or
+                consent_response.get("ConsentRequestId")
             )
             
-            logger.info(f"Ответ от {request.bank_url}/auth/bank-token: статус {response.status_code}")
-            
-            if response.status_code != 200:
-                error_text = response.text
-                logger.error(f"Ошибка получения банковского токена от {request.bank_url}: {error_text}")
-                raise HTTPException(
-                    response.status_code, 
-                    f"Failed to get bank token: {error_text}"
-                )
-            
-            token_data = response.json()
-            logger.info(f"✅ Банковский токен успешно получен от {request.bank_url}")
-            return token_data
+            # Если есть request_id, значит требуется подписание
+            if request_id and not consent_response.get("Data", {}).get("ConsentId"):
+                job = consent_jobs.create(bank_url, bank_token, request_id, consent_response, connection_id=connection_id)
+                return {
+                    **consent_response,
+                    "job_id": job.job_id,
+                    "status": job.status,
+                    "links": {
+                        "job": f"/multibank/consent-jobs/{job.job_id}",
+                        "events": f"/multibank/consent-jobs/{job.job_id}/events"
+                    }
+                }
+        
+        return consent_response
             
+    except BankUnavailableError as e:
+        raise HTTPException(503, str(e))
     except httpx.TimeoutException:
         raise HTTPException(504, "Bank server timeout")
     except httpx.RequestError as e:
@@ -113,244 +253,605 @@ async def request_consent(request: ConsentRequest):
     ШАГ 2: Запросить согласие на доступ к счетам клиента
     
     Требуется банковский токен из шага 1
-    Для SBank: отправляем ОДИН запрос и ждем подписания до 20 секунд
+    Для SBank, если согласие нужно подписать, сразу возвращается job_id:
+    результат - через GET /multibank/consent-jobs/{job_id}?wait=N (long-poll)
+    или GET /multibank/consent-jobs/{job_id}/events (SSE)
+    """
+    bank_token = await _bank_token(request.bank_url, request.bank_token)
+    return await _request_consent(request.bank_url, bank_token, request.client_id)
+
+
+def _get_consent_job(job_id: str):
+    job = consent_jobs.get(job_id)
+    if not job:
+        raise HTTPException(404, "Consent job not found")
+    return job
+
+
+@router.get("/consent-jobs/{job_id}")
+async def get_consent_job(job_id: str, wait: float = 0):
+    """
+    Статус ожидания подписания согласия
+
+    - **wait**: long-poll - ждать смены статуса до N секунд (не больше
+      CONSENT_JOB_MAX_WAIT_SECONDS); ответ приходит сразу после подписания
+    """
+    job = _get_consent_job(job_id)
+    if wait > 0:
+        await consent_jobs.wait(job, min(wait, config.CONSENT_JOB_MAX_WAIT_SECONDS))
+    return job.to_dict()
+
+
+@router.get("/consent-jobs/{job_id}/events")
+async def consent_job_events(job_id: str, request: Request):
+    """SSE: событие `status` сейчас и при завершении задания (authorized / rejected / expired)"""
+    job = _get_consent_job(job_id)
+
+    async def stream():
+        yield f"event: status\ndata: {json.dumps(job.to_dict(), ensure_ascii=False)}\n\n"
+        while job.status not in TERMINAL_STATUSES:
+            await consent_jobs.wait(job, config.EVENT_STREAM_HEARTBEAT_SECONDS)
+            if job.status in TERMINAL_STATUSES:
+                yield f"event: status\ndata: {json.dumps(job.to_dict(), ensure_ascii=False)}\n\n"
+                break
+            if await request.is_disconnected():
+                break
+            yield ": heartbeat\n\n"
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def _remote_error(e: RemoteBankError, what: str) -> HTTPException:
+    # Таймаут и ошибка соединения - как раньше (504 / 502), ответ банка - с текстом
+    if e.status_code in (502, 503, 504):
+        return HTTPException(e.status_code, e.detail)
+    return HTTPException(e.status_code, f"{what}: {e.detail}")
+
+
+async def _passthrough(
+    bank_url: str,
+    path: str,
+    bank_token: str,
+    what: str,
+    consent_id: Optional[str] = None,
+    params: Optional[dict] = None,
+    timeout: Optional[float] = None,
+    interbank: bool = True
+) -> StreamingResponse:
+    """
+    Тело ответа банка потоком (aiter_bytes -> StreamingResponse)
+
+    Без разбора JSON, повторной сериализации и копии ответа в памяти;
+    статус проверяется до начала потока, поэтому ошибки банка - обычные
+    HTTPException.
     """
-    import asyncio
-    import time
-    
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            # Запрос на создание consent (формат согласно API банков)
-            consent_data = {
-                "client_id": request.client_id,
-                "permissions": [
-                    "ReadAccountsBasic", 
-                    "ReadAccountsDetail", 
-                    "ReadBalances", 
-                    "ReadTransactionsDetail",
-                    "ReadCards"  # Добавляем разрешение на чтение карт
-                ],
-                "expiration_date": "2025-12-31T23:59:59.000Z"
-            }
-            
-            response = await client.post(
-                f"{request.bank_url}/account-consents/request",
-                json=consent_data,
-                headers={
-                    "Authorization": f"Bearer {request.bank_token}",
-                    "Content-Type": "application/json",
-                    "x-requesting-bank": TEAM_CLIENT_ID  # ВАЖНО: указываем requesting_bank!
-                }
-            )
-            
-            if response.status_code not in [200, 201]:
-                raise HTTPException(
-                    response.status_code,
-                    f"Failed to request consent: {response.text}"
-                )
-            
-            consent_response = response.json()
-            
-            # Проверяем, является ли это SBank
-            is_sbank = "sbank" in request.bank_url.lower() or "smart" in request.bank_url.lower()
-            
-            # Если это SBank и согласие требует подписания
-            if is_sbank:
-                request_id = (
-                    consent_response.get("Data", {}).get("ConsentRequestId") or
-                    consent_response.get("request_id") or
-                    consent_response.get("ConsentRequestId")
-                )
-                
-                # Если есть request_id, значит требуется подписание
-                if request_id and not consent_response.get("Data", {}).get("ConsentId"):
-                    logger.info(f"SBank: требуется подписание согласия request_id={request_id}, ждем до 20 секунд...")
-                    
-                    # Ждем подписания до 20 секунд (ОДИН запрос, без polling каждые 4 секунды)
-                    start_time = time.time()
-                    max_wait_time = 20  # 20 секунд
-                    check_interval = 2  # Проверяем каждые 2 секунды
-                    
-                    while time.time() - start_time < max_wait_time:
-                        await asyncio.sleep(check_interval)
-                        
-                        # Проверяем статус согласия
-                        try:
-                            status_response = await client.get(
-                                f"{request.bank_url}/account-consents/{request_id}",
-                                headers={
-                                    "Authorization": f"Bearer {request.bank_token}",
-                                    "x-requesting-bank": TEAM_CLIENT_ID
-                                }
-                            )
-                            
-                            if status_response.status_code == 200:
-                                status_data = status_response.json()
-                                consent_id = (
-                                    status_data.get("Data", {}).get("ConsentId") or
-                                    status_data.get("consent_id") or
-                                    status_data.get("ConsentId")
-                                )
-                                
-                                if consent_id:
-                                    logger.info(f"SBank: согласие подписано, consent_id={consent_id}")
-                                    # Обновляем ответ с consent_id
-                                    if "Data" not in consent_response:
-                                        consent_response["Data"] = {}
-                                    consent_response["Data"]["ConsentId"] = consent_id
-                                    break
-                        except Exception as e:
-                            logger.warning(f"SBank: ошибка проверки статуса согласия: {e}")
-                            continue
-                    
-                    # Если не подписано за 20 секунд - возвращаем без consent_id
-                    if not consent_response.get("Data", {}).get("ConsentId"):
-                        logger.warning(f"SBank: согласие не подписано в течение {max_wait_time} секунд")
-                        # Возвращаем ответ без consent_id - фронтенд не будет показывать счета
-            
-            return consent_response
-            
-    except httpx.TimeoutException:
-        raise HTTPException(504, "Bank server timeout")
-    except httpx.RequestError as e:
-        raise HTTPException(502, f"Connection error: {str(e)}")
+        upstream = await MultibankService.open_stream(
+            bank_url, path, bank_token, consent_id, params=params, timeout=timeout, interbank=interbank
+        )
+    except RemoteBankError as e:
+        logger.error(f"{what} ({bank_url}{path}): {e.detail}")
+        raise _remote_error(e, what)
+
+    async def body():
+        try:
+            async for chunk in upstream.aiter_bytes():
+                yield chunk
+        finally:
+            await upstream.aclose()
+
+    return StreamingResponse(
+        body(),
+        headers=MultibankService.passthrough_headers(upstream),
+        # Клиент отключился до начала потока - соединение все равно вернется в пул
+        background=BackgroundTask(upstream.aclose)
+    )
 
 
 @router.post("/accounts-with-consent")
-async def get_accounts_with_consent(request: AccountsWithConsentRequest):
+async def get_accounts_with_consent(
+    request: AccountsWithConsentRequest,
+    response: Response,
+    passthrough: bool = False,
+    cache_control: Optional[str] = Header(None, alias="Cache-Control"),
+    x_cache_bypass: Optional[str] = Header(None, alias="X-Cache-Bypass")
+):
     """
     ШАГ 3: Получить счета клиента используя consent
     
-    Требуется банковский токен и consent_id из предыдущих шагов
+    Требуется банковский токен и consent_id из предыдущих шагов.
+    Ответ кэшируется (X-Cache: HIT / STALE / MISS / BYPASS); свежие данные -
+    `Cache-Control: no-cache` или `X-Cache-Bypass: 1`.
+    `passthrough=true` - ответ банка потоком, без разбора и кэша.
     """
+    bank_token = await _bank_token(request.bank_url, request.bank_token)
+    if passthrough:
+        return await _passthrough(
+            request.bank_url, "/accounts", bank_token, "Failed to get accounts",
+            consent_id=request.consent_id, params={"client_id": request.client_id}
+        )
     try:
-        logger.info(f"Запрос счетов из банка {request.bank_url} для client_id={request.client_id} с consent_id={request.consent_id}")
-        
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            url = f"{request.bank_url}/accounts"
-            headers = {
-                "accept": "application/json",
-                "Authorization": f"Bearer {request.bank_token}",
-                "x-consent-id": request.consent_id,
-                "x-requesting-bank": TEAM_CLIENT_ID
-            }
-            params = {"client_id": request.client_id}
-            
-            logger.info(f"Отправка запроса GET {url} с параметрами: {params}, headers: x-consent-id={request.consent_id}, x-requesting-bank={TEAM_CLIENT_ID}")
-            
-            response = await client.get(url, headers=headers, params=params)
-            
-            logger.info(f"Ответ от {request.bank_url}: статус {response.status_code}")
-            
-            if response.status_code != 200:
-                error_text = response.text
-                logger.error(f"Ошибка получения счетов из {request.bank_url}: {error_text}")
-                raise HTTPException(
-                    response.status_code,
-                    f"Failed to get accounts: {error_text}"
-                )
-            
-            accounts_data = response.json()
-            account_count = len(accounts_data.get("data", {}).get("account", []))
-            logger.info(f"Получено {account_count} счетов из {request.bank_url} для client_id={request.client_id}")
-            
-            return accounts_data
-            
-    except httpx.TimeoutException:
-        raise HTTPException(504, "Bank server timeout")
-    except httpx.RequestError as e:
-        raise HTTPException(502, f"Connection error: {str(e)}")
+        accounts_data, cache_state = await MultibankService.read(
+            request.bank_url, "/accounts", bank_token, request.consent_id, request.client_id,
+            params={"client_id": request.client_id},
+            bypass=MultibankService.wants_bypass(cache_control, x_cache_bypass)
+        )
+    except RemoteBankError as e:
+        logger.error(f"Ошибка получения счетов из {request.bank_url}: {e.detail}")
+        raise _remote_error(e, "Failed to get accounts")
+
+    response.headers["X-Cache"] = cache_state
+    if logger.isEnabledFor(logging.DEBUG):
+        account_count = len(accounts_data.get("data", {}).get("account", []))
+        logger.debug(f"Получено {account_count} счетов из {request.bank_url} для client_id={request.client_id} ({cache_state})")
+    return accounts_data
 
 
 @router.post("/cards-with-consent")
-async def get_cards_with_consent(request: CardsWithConsentRequest):
+async def get_cards_with_consent(
+    request: CardsWithConsentRequest,
+    response: Response,
+    passthrough: bool = False,
+    cache_control: Optional[str] = Header(None, alias="Cache-Control"),
+    x_cache_bypass: Optional[str] = Header(None, alias="X-Cache-Bypass")
+):
     """
     Получить карты клиента используя consent
     
-    Требуется банковский токен и consent_id с разрешением ReadCards
+    Требуется банковский токен и consent_id с разрешением ReadCards.
+    При ошибке банка возвращается пустой список.
+    `passthrough=true` - ответ банка потоком в его формате (без приведения
+    к {"data": {"card": [...]}}).
     """
     try:
-        logger.info(f"Запрос карт из банка {request.bank_url} для client_id={request.client_id} с consent_id={request.consent_id}")
-        
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            url = f"{request.bank_url}/cards"
-            headers = {
-                "accept": "application/json",
-                "Authorization": f"Bearer {request.bank_token}",
-                "x-consent-id": request.consent_id,
-                "x-requesting-bank": TEAM_CLIENT_ID
-            }
-            params = {"client_id": request.client_id}
-            
-            logger.info(f"Отправка запроса GET {url} с параметрами: {params}, headers: x-consent-id={request.consent_id}, x-requesting-bank={TEAM_CLIENT_ID}")
-            
-            response = await client.get(url, headers=headers, params=params)
-            
-            logger.info(f"Ответ карт от {request.bank_url}: статус {response.status_code}")
-            
-            if response.status_code != 200:
-                error_text = response.text
-                logger.error(f"Ошибка получения карт из {request.bank_url}: {error_text}")
-                # Не выбрасываем ошибку, просто возвращаем пустой список
-                return {"data": {"card": []}}
-            
-            cards_data = response.json()
-            # Проверяем формат ответа
-            if isinstance(cards_data, list):
-                cards_data = {"data": {"card": cards_data}}
-            elif "data" not in cards_data:
-                cards_data = {"data": {"card": [cards_data] if cards_data else []}}
-            
-            card_count = len(cards_data.get("data", {}).get("card", []))
-            logger.info(f"Получено {card_count} карт из {request.bank_url} для client_id={request.client_id}")
-            
-            return cards_data
-            
-    except httpx.TimeoutException:
-        logger.warning(f"Timeout при получении карт из {request.bank_url}")
-        return {"data": {"card": []}}
-    except httpx.RequestError as e:
-        logger.warning(f"Ошибка подключения при получении карт из {request.bank_url}: {str(e)}")
+        bank_token = await _bank_token(request.bank_url, request.bank_token)
+        if passthrough:
+            return await _passthrough(
+                request.bank_url, "/cards", bank_token, "Failed to get cards",
+                consent_id=request.consent_id, params={"client_id": request.client_id}
+            )
+        cards_data, cache_state = await MultibankService.read(
+            request.bank_url, "/cards", bank_token, request.consent_id, request.client_id,
+            params={"client_id": request.client_id},
+            bypass=MultibankService.wants_bypass(cache_control, x_cache_bypass)
+        )
+    except (RemoteBankError, HTTPException) as e:
+        # Не выбрасываем ошибку, просто возвращаем пустой список
+        logger.warning(f"Ошибка получения карт из {request.bank_url}: {getattr(e, 'detail', e)}")
         return {"data": {"card": []}}
 
+    response.headers["X-Cache"] = cache_state
+    if isinstance(cards_data, dict) and "data" in cards_data:
+        return cards_data
+    return {"data": {"card": MultibankService._cards(cards_data)}}
+
 
 @router.post("/transactions-with-consent")
-async def get_transactions_with_consent(request: TransactionsWithConsentRequest):
+async def get_transactions_with_consent(
+    request: TransactionsWithConsentRequest,
+    response: Response,
+    cache_control: Optional[str] = Header(None, alias="Cache-Control"),
+    x_cache_bypass: Optional[str] = Header(None, alias="X-Cache-Bypass"),
+    db: AsyncSession = Depends(get_db)
+):
     """
     Получить транзакции счета используя consent
+
+    История читается из локальной копии (remote_transactions), у банка
+    запрашиваются только новые транзакции. X-Cache: HIT - банк не
+    запрашивался, MISS / BYPASS - дельта загружена, STALE - банк недоступен,
+    отдана локальная копия.
     """
+    bank_token = await _bank_token(request.bank_url, request.bank_token)
+    error = None
     try:
-        logger.info(f"Запрос транзакций для account_id={request.account_id} из банка {request.bank_url}")
-        
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            transactions_url = f"{request.bank_url}/accounts/{request.account_id}/transactions"
-            response = await client.get(
-                transactions_url,
-                headers={
-                    "accept": "application/json",
-                    "Authorization": f"Bearer {request.bank_token}",
-                    "x-consent-id": request.consent_id,
-                    "x-requesting-bank": TEAM_CLIENT_ID
-                }
-            )
-            
-            logger.info(f"Ответ транзакций от {request.bank_url} для account_id={request.account_id}: статус {response.status_code}")
-            
-            if response.status_code != 200:
-                error_text = response.text
-                logger.error(f"Ошибка получения транзакций для account_id={request.account_id} из {request.bank_url}: {error_text}")
-                raise HTTPException(response.status_code, f"Failed to fetch transactions: {error_text}")
-            
-            transactions_data = response.json()
-            transaction_count = len(transactions_data.get("data", {}).get("transaction", []))
-            logger.info(f"Получено {transaction_count} транзакций для account_id={request.account_id} из {request.bank_url}")
-            
-            return transactions_data
-            
+        sync_state = await remote_mirror.sync(
+            request.bank_url, request.account_id, bank_token, request.consent_id,
+            force=MultibankService.wants_bypass(cache_control, x_cache_bypass)
+        )
+    except RemoteBankError as e:
+        logger.error(f"Ошибка получения транзакций для account_id={request.account_id} из {request.bank_url}: {e.detail}")
+        # Копию отдаем, только если это согласие уже подтверждалось банком для счета
+        if not remote_mirror.verified(request.bank_url, request.account_id, request.consent_id):
+            raise _remote_error(e, "Failed to fetch transactions")
+        sync_state, error = STALE, e
+
+    transactions = await remote_mirror.transactions(
+        db, remote_mirror.keys([request.model_dump()]), limit=config.TRANSACTIONS_MAX_PAGE_SIZE
+    )
+    if error is not None and not transactions:
+        raise _remote_error(error, "Failed to fetch transactions")
+
+    response.headers["X-Cache"] = sync_state
+    logger.info(f"Получено {len(transactions)} транзакций для account_id={request.account_id} из {request.bank_url} ({sync_state})")
+    return {"data": {"transaction": transactions}}
+
+
+async def _mirror_query(request: "MirrorQueryRequest", force: bool):
+    """Синхронизировать счета запроса; (счета для выборки, статусы синхронизации)"""
+    if not request.accounts:
+        raise HTTPException(400, "accounts must not be empty")
+    if len(request.accounts) > config.REMOTE_MIRROR_MAX_ACCOUNTS:
+        raise HTTPException(400, f"Too many accounts (max {config.REMOTE_MIRROR_MAX_ACCOUNTS})")
+
+    accounts = []
+    for account in request.accounts:
+        accounts.append({**account.model_dump(), "bank_token": await _bank_token(account.bank_url, account.bank_token)})
+    statuses = await remote_mirror.sync_many(accounts, force=force)
+
+    allowed = [account for account, status in zip(accounts, statuses) if status["state"] != ERROR]
+    return remote_mirror.keys(allowed), statuses
+
+
+def _mirror_filters(request: "MirrorQueryRequest") -> dict:
+    return {
+        "from_date": request.from_booking_date_time,
+        "to_date": request.to_booking_date_time,
+        "search": request.search,
+        "min_amount": request.min_amount,
+        "max_amount": request.max_amount,
+        "credit_debit": request.credit_debit
+    }
+
+
+@router.post("/transactions/search")
+async def search_transactions(
+    request: MirrorQueryRequest,
+    cache_control: Optional[str] = Header(None, alias="Cache-Control"),
+    x_cache_bypass: Optional[str] = Header(None, alias="X-Cache-Bypass"),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Поиск по транзакциям нескольких счетов в других банках
+
+    Счета сначала догружаются из банков (только дельта), затем выборка
+    идет по локальной копии: период, текст в описании, сумма, направление.
+    """
+    keys, statuses = await _mirror_query(request, MultibankService.wants_bypass(cache_control, x_cache_bypass))
+    transactions = await remote_mirror.transactions(
+        db, keys, limit=request.limit or config.TRANSACTIONS_PAGE_SIZE, **_mirror_filters(request)
+    ) if keys else []
+    return {"data": {"transaction": transactions}, "meta": {"sync": statuses}}
+
+
+@router.post("/transactions/analytics")
+async def transactions_analytics(
+    request: MirrorQueryRequest,
+    cache_control: Optional[str] = Header(None, alias="Cache-Control"),
+    x_cache_bypass: Optional[str] = Header(None, alias="X-Cache-Bypass"),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Поступления и расходы по месяцам по счетам в других банках
+
+    Считается в БД одним GROUP BY по локальной копии (фильтры - как у поиска).
+    """
+    keys, statuses = await _mirror_query(request, MultibankService.wants_bypass(cache_control, x_cache_bypass))
+    months = await remote_mirror.analytics(db, keys, **_mirror_filters(request)) if keys else []
+    return {"data": {"months": months}, "meta": {"sync": statuses}}
+
+
+@router.post("/dashboard")
+async def get_dashboard(
+    request: DashboardRequest,
+    cache_control: Optional[str] = Header(None, alias="Cache-Control"),
+    x_cache_bypass: Optional[str] = Header(None, alias="X-Cache-Bypass")
+):
+    """
+    Счета, балансы, карты и транзакции клиента из нескольких банков одним вызовом
+
+    Все банки и все запросы внутри банка выполняются параллельно, поэтому время
+    ответа - самый медленный банк, а не сумма. Банк, не уложившийся в дедлайн
+    или ответивший ошибкой, возвращается со статусом `timeout` / `error` /
+    `partial` и списком ошибок; остальные банки отдаются как обычно.
+    """
+    if not request.banks:
+        raise HTTPException(400, "banks must not be empty")
+    if len(request.banks) > config.MULTIBANK_MAX_BANKS:
+        raise HTTPException(400, f"Too many banks (max {config.MULTIBANK_MAX_BANKS})")
+    unknown = set(request.include) - set(RESOURCES)
+    if unknown:
+        raise HTTPException(400, f"Unsupported include: {', '.join(sorted(unknown))}")
+
+    return await MultibankService.aggregate(
+        [bank.model_dump() for bank in request.banks],
+        include=set(request.include),
+        deadline_seconds=request.deadline_seconds,
+        bypass=MultibankService.wants_bypass(cache_control, x_cache_bypass)
+    )
+
+
+@router.get("/metrics")
+async def get_multibank_metrics():
+    """
+    Состояние защиты удаленных банков
+
+    По каждому банку: состояние circuit breaker (closed / open / half_open),
+    занятые слоты bulkhead, доли ошибок и медленных ответов, перцентили
+    задержки, число дублированных (hedged) запросов. prefetch - счетчики
+    фонового прогрева подключений активных клиентов.
+    """
+    return {"banks": bank_guards.snapshot(), "prefetch": dict(multibank_prefetch.stats)}
+
+
+# === Подключения к банкам ===
+# Банк, client_id, согласие и токен хранятся на сервере (bank_connections),
+# запросы ссылаются на connection_id
+
+
+async def _connection(
+    db: AsyncSession,
+    current_client: Optional[dict],
+    connection_id: Optional[int] = None,
+    authorized: bool = True
+):
+    """Клиент (и его подключение connection_id) или HTTPException"""
+    if not current_client:
+        raise HTTPException(401, "Unauthorized")
+    try:
+        client = await BankConnectionService.owner(db, current_client["client_id"])
+        multibank_prefetch.touch(client.id)
+        if connection_id is None:
+            return client
+        if authorized:
+            return await BankConnectionService.authorized(db, client, connection_id)
+        return await BankConnectionService.get(db, client, connection_id)
+    except BankConnectionError as e:
+        raise HTTPException(e.status_code, e.detail)
+
+
+async def _connection_read(db: AsyncSession, connection: BankConnection, read, synced: bool = True):
+    """
+    read(bank_token) с токеном подключения
+
+    Новый токен сохраняется до запроса к банку (транзакция не держится на
+    время запроса); 401 банка сбрасывает сохраненный токен.
+    """
+    try:
+        bank_token = await BankConnectionService.token(connection)
+    except BankTokenError as e:
+        raise HTTPException(e.status_code, e.detail)
+    except BankUnavailableError as e:
+        raise HTTPException(503, str(e))
     except httpx.TimeoutException:
         raise HTTPException(504, "Bank server timeout")
     except httpx.RequestError as e:
         raise HTTPException(502, f"Connection error: {str(e)}")
+    await db.commit()
+
+    try:
+        result = await read(bank_token)
+    except HTTPException as e:
+        if e.status_code == 401:
+            BankConnectionService.forget_token(connection)
+            await db.commit()
+        raise
+    if synced:
+        connection.last_synced_at = datetime.utcnow()
+    return result
+
+
+@router.post("/connections")
+async def create_connection(
+    request: ConnectionRequest,
+    current_client: Optional[dict] = Depends(get_current_client),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Подключить банк: сохранить банк и client_id в нем и запросить согласие
+
+    Если consent_id передан, согласие не запрашивается. Если согласие нужно
+    подписать (SBank), подключение остается в статусе pending, в ответе -
+    ссылка на задание ожидания; итог задания запишется в подключение.
+    """
+    client = await _connection(db, current_client)
+    try:
+        connection = await BankConnectionService.upsert(
+            db, client, request.bank_url, request.client_id,
+            consent_id=request.consent_id, bank_token=request.bank_token
+        )
+    except BankConnectionError as e:
+        raise HTTPException(e.status_code, e.detail)
+
+    if connection.consent_status != "authorized":
+        consent_response = await _connection_read(
+            db, connection,
+            lambda bank_token: _request_consent(connection.bank_url, bank_token, request.client_id, connection.id),
+            synced=False
+        )
+        consent_id = consent_response.get("Data", {}).get("ConsentId") or consent_response.get("consent_id")
+        if consent_id:
+            connection.consent_id = consent_id
+            connection.consent_status = "authorized"
+            connection.consent_job_id = None
+        elif consent_response.get("job_id"):
+            connection.consent_status = consent_response["status"]
+            connection.consent_job_id = consent_response["job_id"]
+        await db.flush()
+
+    return {"data": BankConnectionService.to_dict(connection)}
+
+
+@router.get("/connections")
+async def list_connections(
+    current_client: Optional[dict] = Depends(get_current_client),
+    db: AsyncSession = Depends(get_db)
+):
+    """Подключенные банки текущего клиента"""
+    client = await _connection(db, current_client)
+    connections = await BankConnectionService.for_client(db, client)
+    return {"data": {"connections": [BankConnectionService.to_dict(c) for c in connections]}}
+
+
+@router.get("/connections/dashboard")
+async def get_connections_dashboard(
+    include: Optional[List[str]] = Query(None, description="По умолчанию - все ресурсы"),
+    deadline_seconds: Optional[float] = Query(None, gt=0, le=60),
+    cache_control: Optional[str] = Header(None, alias="Cache-Control"),
+    x_cache_bypass: Optional[str] = Header(None, alias="X-Cache-Bypass"),
+    current_client: Optional[dict] = Depends(get_current_client),
+    db: AsyncSession = Depends(get_db)
+):
+    """Как POST /multibank/dashboard по всем подключениям с подписанным согласием"""
+    include = include or list(RESOURCES)
+    unknown = set(include) - set(RESOURCES)
+    if unknown:
+        raise HTTPException(400, f"Unsupported include: {', '.join(sorted(unknown))}")
+    client = await _connection(db, current_client)
+    connections = [
+        c for c in await BankConnectionService.for_client(db, client)
+        if c.consent_status == "authorized" and c.consent_id
+    ][:config.MULTIBANK_MAX_BANKS]
+    if not connections:
+        raise HTTPException(409, "No authorized connections")
+
+    # Без сохраненного токена банк возьмет его из bank_token_cache
+    result = await MultibankService.aggregate(
+        [
+            {
+                "bank_url": c.bank_url,
+                "consent_id": c.consent_id,
+                "client_id": c.remote_client_id,
+                "bank_token": BankConnectionService.stored_token(c)
+            }
+            for c in connections
+        ],
+        include=set(include),
+        deadline_seconds=deadline_seconds,
+        bypass=MultibankService.wants_bypass(cache_control, x_cache_bypass)
+    )
+    now = datetime.utcnow()
+    for connection in connections:
+        connection.last_synced_at = now
+    return result
+
+
+@router.get("/connections/{connection_id}")
+async def get_connection(
+    connection_id: int,
+    current_client: Optional[dict] = Depends(get_current_client),
+    db: AsyncSession = Depends(get_db)
+):
+    connection = await _connection(db, current_client, connection_id, authorized=False)
+    return {"data": BankConnectionService.to_dict(connection)}
+
+
+@router.delete("/connections/{connection_id}")
+async def delete_connection(
+    connection_id: int,
+    current_client: Optional[dict] = Depends(get_current_client),
+    db: AsyncSession = Depends(get_db)
+):
+    """Отключить банк (сохраненные согласие и токен удаляются)"""
+    connection = await _connection(db, current_client, connection_id, authorized=False)
+    await db.delete(connection)
+    return {"data": {"connection_id": connection_id, "deleted": True}}
+
+
+@router.get("/connections/{connection_id}/accounts")
+async def get_connection_accounts(
+    connection_id: int,
+    response: Response,
+    passthrough: bool = False,
+    cache_control: Optional[str] = Header(None, alias="Cache-Control"),
+    x_cache_bypass: Optional[str] = Header(None, alias="X-Cache-Bypass"),
+    current_client: Optional[dict] = Depends(get_current_client),
+    db: AsyncSession = Depends(get_db)
+):
+    """Счета клиента в подключенном банке (как accounts-with-consent)"""
+    connection = await _connection(db, current_client, connection_id)
+    return await _connection_read(db, connection, lambda bank_token: get_accounts_with_consent(
+        AccountsWithConsentRequest(
+            bank_url=connection.bank_url, bank_token=bank_token,
+            consent_id=connection.consent_id, client_id=connection.remote_client_id
+        ),
+        response, passthrough=passthrough, cache_control=cache_control, x_cache_bypass=x_cache_bypass
+    ))
+
+
+@router.get("/connections/{connection_id}/cards")
+async def get_connection_cards(
+    connection_id: int,
+    response: Response,
+    passthrough: bool = False,
+    cache_control: Optional[str] = Header(None, alias="Cache-Control"),
+    x_cache_bypass: Optional[str] = Header(None, alias="X-Cache-Bypass"),
+    current_client: Optional[dict] = Depends(get_current_client),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Карты клиента в подключенном банке (как cards-with-consent)
+
+    Ошибка банка - пустой список, кроме 401: токен подключения сбрасывается.
+    """
+    connection = await _connection(db, current_client, connection_id)
+    params = {"client_id": connection.remote_client_id}
+
+    async def read(bank_token: str):
+        if passthrough:
+            return await _passthrough(
+                connection.bank_url, "/cards", bank_token, "Failed to get cards",
+                consent_id=connection.consent_id, params=params
+            )
+        try:
+            cards_data, cache_state = await MultibankService.read(
+                connection.bank_url, "/cards", bank_token, connection.consent_id, connection.remote_client_id,
+                params=params,
+                bypass=MultibankService.wants_bypass(cache_control, x_cache_bypass)
+            )
+        except RemoteBankError as e:
+            if e.status_code == 401:
+                raise _remote_error(e, "Failed to get cards")
+            logger.warning(f"Ошибка получения карт из {connection.bank_url}: {e.detail}")
+            return {"data": {"card": []}}
+        response.headers["X-Cache"] = cache_state
+        return {"data": {"card": MultibankService._cards(cards_data)}}
+
+    return await _connection_read(db, connection, read)
+
+
+@router.get("/connections/{connection_id}/accounts/{account_id}/balances")
+async def get_connection_balances(
+    connection_id: int,
+    account_id: str,
+    response: Response,
+    passthrough: bool = False,
+    cache_control: Optional[str] = Header(None, alias="Cache-Control"),
+    x_cache_bypass: Optional[str] = Header(None, alias="X-Cache-Bypass"),
+    current_client: Optional[dict] = Depends(get_current_client),
+    db: AsyncSession = Depends(get_db)
+):
+    """Баланс счета в подключенном банке (как balances-with-consent)"""
+    connection = await _connection(db, current_client, connection_id)
+    return await _connection_read(db, connection, lambda bank_token: get_balance_with_consent(
+        account_id, connection.bank_url, connection.consent_id, response,
+        bank_token=bank_token, passthrough=passthrough, cache_control=cache_control, x_cache_bypass=x_cache_bypass
+    ))
+
+
+@router.get("/connections/{connection_id}/accounts/{account_id}/transactions")
+async def get_connection_transactions(
+    connection_id: int,
+    account_id: str,
+    response: Response,
+    cache_control: Optional[str] = Header(None, alias="Cache-Control"),
+    x_cache_bypass: Optional[str] = Header(None, alias="X-Cache-Bypass"),
+    current_client: Optional[dict] = Depends(get_current_client),
+    db: AsyncSession = Depends(get_db)
+):
+    """Транзакции счета в подключенном банке (как transactions-with-consent)"""
+    connection = await _connection(db, current_client, connection_id)
+    return await _connection_read(db, connection, lambda bank_token: get_transactions_with_consent(
+        TransactionsWithConsentRequest(
+            account_id=account_id, bank_url=connection.bank_url,
+            bank_token=bank_token, consent_id=connection.consent_id
+        ),
+        response, cache_control=cache_control, x_cache_bypass=x_cache_bypass, db=db
+    ))
 
 
 @router.post("/login")
@@ -361,19 +862,19 @@ async def proxy_login(request: LoginRequest):
     Используйте новый flow: bank-token -> request-consent -> accounts-with-consent
     """
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(
-                f"{request.bank_url}/auth/login",
-                json={
-                    "username": request.username,
-                    "password": request.password
-                }
-            )
-            
-            if response.status_code != 200:
-                raise HTTPException(response.status_code, "Authentication failed")
-            
-            return response.json()
+        client = http_pool.client_for(request.bank_url)
+        response = await client.post(
+            f"{request.bank_url}/auth/login",
+            json={
+                "username": request.username,
+                "password": request.password
+            }
+        )
+        
+        if response.status_code != 200:
+            raise HTTPException(response.status_code, "Authentication failed")
+        
+        return response.json()
             
     except httpx.TimeoutException:
         raise HTTPException(504, "Bank server timeout")
@@ -385,69 +886,48 @@ async def proxy_login(request: LoginRequest):
 async def proxy_accounts(request: ProxyRequest):
     """
     Проксирует запрос получения счетов к другому банку
+
+    Ответ банка отдается потоком, без разбора JSON.
     """
-    try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(
-                f"{request.bank_url}{request.endpoint}",
-                headers={
-                    "Authorization": f"Bearer {request.token}"
-                }
-            )
-            
-            if response.status_code != 200:
-                raise HTTPException(response.status_code, "Failed to fetch accounts")
-            
-            return response.json()
-            
-    except httpx.TimeoutException:
-        raise HTTPException(504, "Bank server timeout")
-    except httpx.RequestError as e:
-        raise HTTPException(502, f"Connection error: {str(e)}")
+    return await _passthrough(
+        request.bank_url, request.endpoint, request.token, "Failed to fetch accounts", interbank=False
+    )
 
 
 @router.post("/balances-with-consent")
 async def get_balance_with_consent(
     account_id: str,
     bank_url: str,
-    bank_token: str,
-    consent_id: str
+    consent_id: str,
+    response: Response,
+    bank_token: Optional[str] = None,
+    passthrough: bool = False,
+    cache_control: Optional[str] = Header(None, alias="Cache-Control"),
+    x_cache_bypass: Optional[str] = Header(None, alias="X-Cache-Bypass")
 ):
     """
     Получить баланс счета используя consent (правильный OpenBanking flow)
+
+    `passthrough=true` - ответ банка потоком, без разбора и кэша.
     """
+    bank_token = await _bank_token(bank_url, bank_token)
+    if passthrough:
+        return await _passthrough(
+            bank_url, f"/accounts/{account_id}/balances", bank_token, "Failed to fetch balance",
+            consent_id=consent_id, timeout=10.0
+        )
     try:
-        logger.info(f"Запрос баланса для account_id={account_id} из банка {bank_url}")
-        
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            balance_url = f"{bank_url}/accounts/{account_id}/balances"
-            response = await client.get(
-                balance_url,
-                headers={
-                    "accept": "application/json",
-                    "Authorization": f"Bearer {bank_token}",
-                    "x-consent-id": consent_id,
-                    "x-requesting-bank": TEAM_CLIENT_ID
-                }
-            )
-            
-            logger.info(f"Ответ баланса от {bank_url} для account_id={account_id}: статус {response.status_code}")
-            
-            if response.status_code != 200:
-                error_text = response.text
-                logger.error(f"Ошибка получения баланса для account_id={account_id} из {bank_url}: {error_text}")
-                raise HTTPException(response.status_code, f"Failed to fetch balance: {error_text}")
-            
-            balance_data = response.json()
-            balance_amount = balance_data.get("data", {}).get("balance", [{}])[0].get("amount", {}).get("amount", "0")
-            logger.info(f"Баланс для account_id={account_id} из {bank_url}: {balance_amount}")
-            
-            return balance_data
-            
-    except httpx.TimeoutException:
-        raise HTTPException(504, "Bank server timeout")
-    except httpx.RequestError as e:
-        raise HTTPException(502, f"Connection error: {str(e)}")
+        balance_data, cache_state = await MultibankService.read(
+            bank_url, f"/accounts/{account_id}/balances", bank_token, consent_id,
+            timeout=10.0,
+            bypass=MultibankService.wants_bypass(cache_control, x_cache_bypass)
+        )
+    except RemoteBankError as e:
+        logger.error(f"Ошибка получения баланса для account_id={account_id} из {bank_url}: {e.detail}")
+        raise _remote_error(e, "Failed to fetch balance")
+
+    response.headers["X-Cache"] = cache_state
+    return balance_data
 
 
 @router.get("/accounts/{account_id}/balances")
@@ -461,21 +941,7 @@ async def proxy_balance(
     
     Используйте balances-with-consent для правильного OpenBanking flow
     """
-    try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.get(
-                f"{bank_url}/accounts/{account_id}/balances",
-                headers={
-                    "Authorization": f"Bearer {token}"
-                }
-            )
-            
-            if response.status_code != 200:
-                raise HTTPException(response.status_code, "Failed to fetch balance")
-            
-            return response.json()
-            
-    except httpx.TimeoutException:
-        raise HTTPException(504, "Bank server timeout")
-    except httpx.RequestError as e:
-        raise HTTPException(502, f"Connection error: {str(e)}")
+    return await _passthrough(
+        bank_url, f"/accounts/{account_id}/balances", token, "Failed to fetch balance",
+        timeout=10.0, interbank=False
+    )
@@ -0,0 +1,262 @@
+"""
+Payment Batches API - пакетные платежи (зарплатные ведомости)
+Пакет принимается сразу (202), проводится в фоне; прогресс и результаты
+по строкам доступны через GET.
+"""
+import hashlib
+
+from fastapi import APIRouter, Depends, HTTPException, Header, UploadFile, File, Form
+from pydantic import BaseModel, Field
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, func
+from typing import List, Optional
+
+from database import after_commit, get_db
+from models import Account, Client, PaymentBatch, PaymentBatchItem
+from services.auth_service import get_current_client
+from services.idempotency_service import IdempotencyService
+from services.payment_batch_service import PaymentBatchService, batch_processor
+
+
+router = APIRouter(prefix="/payment-batches", tags=["4 Переводы"])
+
+
+# === Pydantic Models ===
+
+class BatchItemRequest(BaseModel):
+    """Строка пакета"""
+    creditor_account: str = Field(..., description="Номер счета получателя")
+    amount: str = Field(..., description="Сумма в формате строки")
+    description: Optional[str] = None
+    reference: Optional[str] = Field(None, description="Идентификатор строки у клиента")
+
+
+class BatchRequest(BaseModel):
+    """Пакет платежей"""
+    debtor_account: str = Field(..., description="Номер счета-отправителя")
+    items: List[BatchItemRequest]
+
+
+# === Helpers ===
+
+async def _get_client_and_account(db: AsyncSession, current_client: dict, debtor_account: str):
+    """Клиент и его счет-отправитель"""
+    result = await db.execute(
+        select(Client).where(Client.person_id == current_client["client_id"])
+    )
+    client = result.scalar_one_or_none()
+    if not client:
+        raise HTTPException(401, "Client not found")
+
+    result = await db.execute(
+        select(Account).where(
+            Account.account_number == debtor_account,
+            Account.client_id == client.id
+        )
+    )
+    account = result.scalar_one_or_none()
+    if not account:
+        raise HTTPException(404, "Debtor account not found or not yours")
+    if account.status != "active":
+        raise HTTPException(400, f"Debtor account is not active. Status: {account.status}")
+    return client, account
+
+
+def _format_batch(batch: PaymentBatch) -> dict:
+    return {
+        "data": {
+            "batch_id": batch.batch_id,
+            "status": batch.status,
+            "source": batch.source,
+            "debtor_account_id": f"acc-{batch.account_id}",
+            "total_count": batch.total_count,
+            "total_amount": float(batch.total_amount or 0),
+            "processed_count": batch.processed_count,
+            "completed_count": batch.completed_count,
+            "queued_count": batch.queued_count,
+            "rejected_count": batch.rejected_count,
+            "progress": round(batch.processed_count / batch.total_count, 4) if batch.total_count else 1.0,
+            "error": batch.error,
+            "created_at": batch.created_at.isoformat() + "Z" if batch.created_at else None,
+            "started_at": batch.started_at.isoformat() + "Z" if batch.started_at else None,
+            "completed_at": batch.completed_at.isoformat() + "Z" if batch.completed_at else None
+        },
+        "links": {
+            "self": f"/payment-batches/{batch.batch_id}",
+            "items": f"/payment-batches/{batch.batch_id}/items"
+        },
+        "meta": {}
+    }
+
+
+async def _accept_batch(
+    db: AsyncSession,
+    current_client: dict,
+    debtor_account: str,
+    raw_items: List[dict],
+    source: str
+) -> dict:
+    client, account = await _get_client_and_account(db, current_client, debtor_account)
+    try:
+        batch = await PaymentBatchService.create_batch(db, client.id, account, raw_items, source)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    await db.flush()
+
+    # Коммит - в IdempotencyService.execute; обработка - после него
+    after_commit(db, lambda: batch_processor.submit(batch.batch_id))
+    return _format_batch(batch)
+
+
+# === Endpoints ===
+
+@router.post("", status_code=202, summary="Создать пакет платежей (JSON)")
+async def create_batch(
+    request: BatchRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    current_client: dict = Depends(get_current_client),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Пакет платежей с одного счета (до PAYMENT_BATCH_MAX_ITEMS строк)
+
+    Строки с ошибками валидации сразу отклоняются, остальные проводятся в фоне:
+    внутрибанковские зачисляются, межбанковские ставятся в очередь отправки.
+    Поддерживает заголовок `Idempotency-Key`.
+    """
+    if not current_client:
+        raise HTTPException(401, "Unauthorized")
+
+    return await IdempotencyService.execute(
+        db=db,
+        scope="payment-batches",
+        caller=current_client["client_id"],
+        key=idempotency_key,
+        payload=request,
+        handler=lambda: _accept_batch(
+            db, current_client, request.debtor_account,
+            [item.model_dump() for item in request.items], "json"
+        ),
+        status_code=202
+    )
+
+
+@router.post("/upload", status_code=202, summary="Создать пакет платежей (CSV)")
+async def upload_batch(
+    debtor_account: str = Form(..., description="Номер счета-отправителя"),
+    file: UploadFile = File(..., description="CSV: creditor_account,amount[,description][,reference]"),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    current_client: dict = Depends(get_current_client),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Пакет платежей из CSV файла
+
+    Первая строка - заголовок. Разделитель `,` или `;`, кодировка UTF-8.
+    Поддерживает заголовок `Idempotency-Key` (отпечаток - счет и sha256 файла).
+    """
+    if not current_client:
+        raise HTTPException(401, "Unauthorized")
+
+    content = await file.read()
+    try:
+        raw_items = PaymentBatchService.parse_csv(content)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(400, f"Invalid CSV: {str(e)}")
+
+    return await IdempotencyService.execute(
+        db=db,
+        scope="payment-batches",
+        caller=current_client["client_id"],
+        key=idempotency_key,
+        payload={"debtor_account": debtor_account, "file_sha256": hashlib.sha256(content).hexdigest()},
+        handler=lambda: _accept_batch(db, current_client, debtor_account, raw_items, "csv"),
+        status_code=202
+    )
+
+
+async def _get_own_batch(db: AsyncSession, current_client: dict, batch_id: str) -> PaymentBatch:
+    result = await db.execute(
+        select(PaymentBatch)
+        .join(Client, PaymentBatch.client_id == Client.id)
+        .where(PaymentBatch.batch_id == batch_id, Client.person_id == current_client["client_id"])
+    )
+    batch = result.scalar_one_or_none()
+    if not batch:
+        raise HTTPException(404, "Batch not found")
+    return batch
+
+
+@router.get("/{batch_id}", summary="Статус пакета платежей")
+async def get_batch(
+    batch_id: str,
+    current_client: dict = Depends(get_current_client),
+    db: AsyncSession = Depends(get_db)
+):
+    """Прогресс обработки пакета"""
+    if not current_client:
+        raise HTTPException(401, "Unauthorized")
+
+    return _format_batch(await _get_own_batch(db, current_client, batch_id))
+
+
+@router.get("/{batch_id}/items", summary="Результаты по строкам пакета")
+async def get_batch_items(
+    batch_id: str,
+    status: Optional[str] = None,
+    offset: int = 0,
+    limit: int = 100,
+    current_client: dict = Depends(get_current_client),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Строки пакета с результатом обработки
+
+    - **status**: pending / completed / queued / rejected
+    - **offset**, **limit**: пагинация по номеру строки (limit до 1000)
+    """
+    if not current_client:
+        raise HTTPException(401, "Unauthorized")
+
+    await _get_own_batch(db, current_client, batch_id)
+    limit = max(1, min(limit, 1000))
+
+    query = select(PaymentBatchItem).where(PaymentBatchItem.batch_id == batch_id)
+    count_query = select(func.count(PaymentBatchItem.id)).where(PaymentBatchItem.batch_id == batch_id)
+    if status:
+        query = query.where(PaymentBatchItem.status == status)
+        count_query = count_query.where(PaymentBatchItem.status == status)
+
+    total = (await db.execute(count_query)).scalar()
+    result = await db.execute(
+        query.order_by(PaymentBatchItem.line_number).offset(max(0, offset)).limit(limit)
+    )
+    items = result.scalars().all()
+
+    return {
+        "data": {
+            "items": [
+                {
+                    "line_number": item.line_number,
+                    "creditor_account": item.creditor_account,
+                    "amount": float(item.amount) if item.amount is not None else None,
+                    "description": item.description,
+                    "reference": item.reference,
+                    "status": item.status,
+                    "payment_id": item.payment_id,
+                    "destination_bank": item.destination_bank,
+                    "error": item.error,
+                    "processed_at": item.processed_at.isoformat() + "Z" if item.processed_at else None
+                }
+                for item in items
+            ]
+        },
+        "links": {
+            "self": f"/payment-batches/{batch_id}/items"
+        },
+        "meta": {
+            "total": total,
+            "offset": offset,
+            "limit": limit
+        }
+    }
@@ -16,6 +16,8 @@ from database import get_db
 from models import Payment, Account, PaymentConsent, Transaction, Client
 from services.auth_service import get_current_client
 from services.payment_service import PaymentService
+from services.posting_service import PostingService, InsufficientFundsError
+from services.idempotency_service import IdempotencyService
 
 
 router = APIRouter(prefix="/payments", tags=["4 Переводы"])
@@ -76,15 +78,36 @@ async def create_payment(
     x_fapi_customer_ip_address: Optional[str] = Header(None, alias="x-fapi-customer-ip-address"),
     x_payment_consent_id: Optional[str] = Header(None, alias="x-payment-consent-id"),
     x_requesting_bank: Optional[str] = Header(None, alias="x-requesting-bank"),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     current_client: dict = Depends(get_current_client),
     db: AsyncSession = Depends(get_db)
 ):
     """
     Создать платеж (инициация). Делегирует в PaymentService.
+    
+    Повтор запроса с тем же заголовком `Idempotency-Key` возвращает
+    сохраненный ответ (заголовок `Idempotent-Replayed: true`) без повторного списания.
     """
     if not current_client:
         raise HTTPException(401, "Unauthorized")
 
+    return await IdempotencyService.execute(
+        db=db,
+        scope="payments",
+        caller=current_client["client_id"],
+        key=idempotency_key,
+        payload={"body": request, "payment_consent_id": x_payment_consent_id},
+        handler=lambda: _create_payment(request, x_payment_consent_id, db),
+        status_code=201
+    )
+
+
+async def _create_payment(
+    request: PaymentRequest,
+    x_payment_consent_id: Optional[str],
+    db: AsyncSession
+) -> PaymentResponse:
+    """Создание платежа (без учета Idempotency-Key)"""
     initiation = request.data.get("initiation")
     if not initiation:
         raise HTTPException(400, "Missing initiation data")
@@ -115,7 +138,7 @@ async def create_payment(
                 consent.status = "used"
                 consent.used_at = datetime.utcnow()
                 consent.status_update_date_time = datetime.utcnow()
-                await db.commit()
+                await db.flush()
 
         payment_data = PaymentData(
             paymentId=payment.payment_id,
@@ -193,6 +216,7 @@ class SimpleTransferResponse(BaseModel):
 @router.post("/transfer/internal", response_model=SimpleTransferResponse, status_code=201, summary="Перевод между своими счетами")
 async def transfer_internal(
     request: SimpleTransferRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     current_client: dict = Depends(get_current_client),
     db: AsyncSession = Depends(get_db)
 ):
@@ -203,11 +227,30 @@ async def transfer_internal(
     - Оба счета должны принадлежать текущему клиенту
     - Достаточно средств на счете-отправителе
     - Сумма > 0
+    
+    Поддерживает заголовок `Idempotency-Key`.
     """
     
     if not current_client:
         raise HTTPException(401, "Unauthorized")
     
+    return await IdempotencyService.execute(
+        db=db,
+        scope="transfer-internal",
+        caller=current_client["client_id"],
+        key=idempotency_key,
+        payload=request,
+        handler=lambda: _transfer_internal(request, current_client, db),
+        status_code=201
+    )
+
+
+async def _transfer_internal(
+    request: SimpleTransferRequest,
+    current_client: dict,
+    db: AsyncSession
+) -> SimpleTransferResponse:
+    """Перевод между своими счетами (без учета Idempotency-Key)"""
     import logging
     logger = logging.getLogger(__name__)
 
@@ -294,15 +337,14 @@ async def transfer_internal(
         if amount <= 0:
             raise HTTPException(400, "Amount must be greater than 0")
 
-        if from_account.balance < amount:
-            raise HTTPException(400, "Insufficient funds")
-
         # Выполняем перевод
         transfer_id = f"transfer-{uuid.uuid4().hex[:12]}"
 
-        # Обновляем балансы
-        from_account.balance = from_account.balance - amount
-        to_account.balance = to_account.balance + amount
+        # Обновляем балансы (условный UPDATE, без гонки чтение-запись)
+        try:
+            await PostingService.transfer(db, from_account.id, to_account.id, amount)
+        except InsufficientFundsError:
+            raise HTTPException(400, "Insufficient funds")
 
         # Создаем транзакции
         debit_tx = Transaction(
@@ -341,7 +383,7 @@ async def transfer_internal(
         )
         db.add(payment)
 
-        await db.commit()
+        await db.flush()
 
         logger.info(f"Internal transfer: {from_account.account_number} -> {to_account.account_number}, amount={amount}")
 
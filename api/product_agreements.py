@@ -11,8 +11,11 @@ from datetime import datetime, timedelta
 import uuid
 
 from database import get_db
-from models import ProductAgreement, Product, Client, Account, BankCapital, Transaction
+from models import ProductAgreement, Product, Client, Account, Transaction
 from services.auth_service import get_current_client
+from services.account_digest_service import account_digest
+from services.posting_service import PostingService, InsufficientFundsError
+from services.capital_service import capital_ledger
 
 router = APIRouter(prefix="/product-agreements", tags=["7 Договоры с продуктами"])
 
@@ -173,11 +176,11 @@ async def create_agreement(
             if not source_account:
                 raise HTTPException(404, "Source account not found")
             
-            if source_account.balance < Decimal(str(request.amount)):
-                raise HTTPException(400, f"Insufficient funds. Available: {source_account.balance}, Required: {request.amount}")
-            
-            # Списать со source account
-            source_account.balance -= Decimal(str(request.amount))
+            # Списать со source account (проверка баланса - в том же UPDATE)
+            try:
+                await PostingService.debit(db, source_account.id, Decimal(str(request.amount)))
+            except InsufficientFundsError as e:
+                raise HTTPException(400, f"Insufficient funds. Available: {e.available}, Required: {request.amount}")
             
             # Создать транзакцию списания
             debit_tx = Transaction(
@@ -213,12 +216,8 @@ async def create_agreement(
         db.add(credit_tx)
         
     elif product.product_type == "loan":
-        # Кредит: проверить капитал банка
-        from config import config
-        capital_result = await db.execute(
-            select(BankCapital).where(BankCapital.bank_code == config.BANK_CODE)
-        )
-        capital = capital_result.scalar_one_or_none()
+        # Кредит: проверить капитал банка (с учетом несвернутых изменений)
+        capital = await capital_ledger.effective(db)
         
         if capital and capital.capital < Decimal(str(request.amount)):
             raise HTTPException(400, "Insufficient bank capital for loan")
@@ -238,9 +237,12 @@ async def create_agreement(
         account_id = loan_account.id
         
         # Уменьшить капитал банка
-        if capital:
-            capital.capital -= Decimal(str(request.amount))
-            capital.total_loans += Decimal(str(request.amount))
+        capital_ledger.record(
+            db,
+            capital_change=-Decimal(str(request.amount)),
+            loans_change=Decimal(str(request.amount)),
+            reason=f"Loan issued: {account_number}"
+        )
         
     elif product.product_type == "card":
         # Карта: ТРЕБУЕТСЯ пополнение из существующего счета (если amount > 0)
@@ -262,11 +264,11 @@ async def create_agreement(
             if not source_account:
                 raise HTTPException(404, "Source account not found")
             
-            if source_account.balance < Decimal(str(request.amount)):
-                raise HTTPException(400, f"Insufficient funds. Available: {source_account.balance}, Required: {request.amount}")
-            
-            # Списать со source account
-            source_account.balance -= Decimal(str(request.amount))
+            # Списать со source account (проверка баланса - в том же UPDATE)
+            try:
+                await PostingService.debit(db, source_account.id, Decimal(str(request.amount)))
+            except InsufficientFundsError as e:
+                raise HTTPException(400, f"Insufficient funds. Available: {e.available}, Required: {request.amount}")
             
             # Создать транзакцию списания
             debit_tx = Transaction(
@@ -329,6 +331,7 @@ async def create_agreement(
         account = account_result.scalar_one_or_none()
         if account:
             account_number = account.account_number
+            account_digest.account_opened(account_number)
     
     return {
         "data": {
@@ -484,14 +487,15 @@ async def close_agreement(
         if not repayment_account:
             raise HTTPException(404, "Repayment account not found")
         
-        debt = loan_account.balance
-        
-        if repayment_account.balance < debt:
-            raise HTTPException(400, f"Insufficient funds for repayment. Available: {repayment_account.balance}, Required: {debt}")
+        # Зафиксировать оба счета, чтобы сумма долга не изменилась до списания
+        locked = await PostingService.lock_balances(db, [repayment_account.id, loan_account.id])
+        debt = locked[loan_account.id]
         
-        # Погасить кредит
-        repayment_account.balance -= debt
-        loan_account.balance = Decimal("0")
+        # Погасить кредит: списать долг с обоих счетов
+        try:
+            await PostingService.post(db, [(repayment_account.id, -debt), (loan_account.id, -debt)])
+        except InsufficientFundsError as e:
+            raise HTTPException(400, f"Insufficient funds for repayment. Available: {e.available}, Required: {debt}")
         
         # Создать транзакции
         debit_tx = Transaction(
@@ -515,24 +519,28 @@ async def close_agreement(
         db.add(credit_tx)
         
         # Увеличить капитал банка (вернуть выданный кредит)
-        from config import config
-        capital_result = await db.execute(
-            select(BankCapital).where(BankCapital.bank_code == config.BANK_CODE)
+        capital_ledger.record(
+            db,
+            capital_change=debt,
+            loans_change=-debt,
+            reason=f"Loan repaid: {loan_account.account_number}"
         )
-        capital = capital_result.scalar_one_or_none()
-        if capital:
-            capital.capital += debt
-            capital.total_loans -= debt
     
     # Закрыть договор
     agreement.status = "closed"
     
     # Закрыть связанный счет
+    closed_account_number = None
     if loan_account:
+        if loan_account.status == "active":
+            closed_account_number = loan_account.account_number
         loan_account.status = "closed"
     
     await db.commit()
     
+    if closed_account_number:
+        account_digest.account_closed(closed_account_number)
+    
     return {
         "data": {
             "agreement_id": agreement.agreement_id,
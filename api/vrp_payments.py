@@ -2,7 +2,7 @@
 VRP Payments API - Периодические платежи с переменными реквизитами
 OpenBanking Russia VRP API v1.3.1
 """
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Header
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from pydantic import BaseModel
@@ -14,6 +14,8 @@ import uuid
 from database import get_db
 from models import VRPPayment, VRPConsent, Account, Transaction
 from services.auth_service import get_current_client
+from services.idempotency_service import IdempotencyService
+from services.posting_service import PostingService, InsufficientFundsError
 
 router = APIRouter(
     prefix="/domestic-vrp-payments",
@@ -40,6 +42,7 @@ class VRPPaymentRequest(BaseModel):
 @router.post("", status_code=201)
 async def create_vrp_payment(
     request: VRPPaymentRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     current_client: dict = Depends(get_current_client),
     db: AsyncSession = Depends(get_db)
 ):
@@ -50,10 +53,24 @@ async def create_vrp_payment(
     POST /domestic-vrp-payments
     
     Инициирует платеж на основе ранее созданного VRP согласия с проверкой лимитов.
+    Поддерживает заголовок `Idempotency-Key`.
     """
     if not current_client:
         raise HTTPException(401, "Unauthorized")
     
+    return await IdempotencyService.execute(
+        db=db,
+        scope="vrp-payments",
+        caller=current_client["client_id"],
+        key=idempotency_key,
+        payload=request,
+        handler=lambda: _create_vrp_payment(request, db),
+        status_code=201
+    )
+
+
+async def _create_vrp_payment(request: VRPPaymentRequest, db: AsyncSession) -> dict:
+    """Создание VRP платежа (без учета Idempotency-Key)"""
     # Найти VRP согласие
     consent_result = await db.execute(
         select(VRPConsent, Account).join(
@@ -86,18 +103,17 @@ async def create_vrp_payment(
             f"Amount {amount} exceeds max individual amount {consent.max_individual_amount}"
         )
     
-    # Проверить баланс
-    if account.balance < amount:
-        raise HTTPException(
-            400,
-            f"Insufficient funds. Available: {account.balance}, Required: {amount}"
-        )
-    
     # Создать платеж
     payment_id = f"vrp-pay-{uuid.uuid4().hex[:12]}"
     
-    # Списать со счета
-    account.balance -= amount
+    # Списать со счета (проверка баланса - в том же UPDATE)
+    try:
+        await PostingService.debit(db, account.id, amount)
+    except InsufficientFundsError as e:
+        raise HTTPException(
+            400,
+            f"Insufficient funds. Available: {e.available}, Required: {amount}"
+        )
     
     # Создать транзакцию
     transaction = Transaction(
@@ -137,7 +153,7 @@ async def create_vrp_payment(
     )
     
     db.add(vrp_payment)
-    await db.commit()
+    await db.flush()
     await db.refresh(vrp_payment)
     
     return {
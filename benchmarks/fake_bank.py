@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Локальный «банк» песочницы для нагрузочных тестов multibank proxy
+
+ASGI приложение с теми же эндпоинтами, что вызывает api/multibank_proxy.py:
+- POST /auth/bank-token
+- POST /account-consents/request, GET /account-consents/{request_id}
+- GET /accounts, /accounts/{id}/balances, /accounts/{id}/transactions, /cards
+
+Задержка, доля ошибок и размер ответов настраиваются (FakeBankConfig),
+поэтому нагрузку на прокси можно проверять без обращения к реальным банкам.
+
+Отдельный запуск:
+    python benchmarks/fake_bank.py --port 9001 --latency lognormal:30:0.5 --error-rate 0.05
+
+Профили задержки (мс): fixed:20, uniform:10:50, lognormal:<медиана>:<sigma>.
+"""
+import argparse
+import asyncio
+import random
+import socket
+import threading
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Optional
+
+import uvicorn
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import JSONResponse
+
+
+@dataclass
+class FakeBankConfig:
+    """Поведение банка"""
+    name: str = "fakebank"
+    latency: str = "fixed:0"  # Распределение задержки ответа, мс
+    error_rate: float = 0.0  # Доля ответов 500 / 503
+    slow_rate: float = 0.0  # Доля очень медленных ответов (зависания)
+    slow_ms: float = 2000.0
+    accounts_per_client: int = 3
+    transactions_per_account: int = 100
+    transactions_page_size: int = 50
+    cards_per_client: int = 2
+    padding_bytes: int = 0  # Добавочный текст в каждом элементе (размер ответа)
+    consent_signing_polls: int = 0  # Сколько проверок статуса согласие «не подписано» (как SBank)
+    seed: int = 42
+    stats: Counter = field(default_factory=Counter)
+
+    def delay(self) -> float:
+        """Задержка следующего ответа, секунды"""
+        kind, *params = self.latency.split(":")
+        values = [float(p) for p in params]
+        if kind == "fixed":
+            ms = values[0] if values else 0.0
+        elif kind == "uniform":
+            ms = random.uniform(values[0], values[1])
+        elif kind == "lognormal":
+            median, sigma = values[0], (values[1] if len(values) > 1 else 0.5)
+            ms = random.lognormvariate(0, sigma) * median
+        else:
+            raise ValueError(f"Unknown latency distribution: {self.latency}")
+        if self.slow_rate and random.random() < self.slow_rate:
+            ms = self.slow_ms
+        return ms / 1000
+
+
+def build_fake_bank(config: FakeBankConfig) -> FastAPI:
+    """ASGI приложение банка по FakeBankConfig"""
+    app = FastAPI(title=config.name)
+    rng = random.Random(config.seed)
+    padding = "x" * config.padding_bytes
+    consents = {}
+
+    def account_ids(client_id: str):
+        return [f"{config.name}-{client_id}-{i}" for i in range(config.accounts_per_client)]
+
+    # Транзакции генерируются один раз: от новых к старым, как у банков песочницы
+    started = datetime(2025, 1, 1)
+    history = [
+        {
+            "transactionId": f"tx-{i}",
+            "amount": {"amount": f"{rng.randint(100, 500000) / 100:.2f}", "currency": "RUB"},
+            "creditDebitIndicator": "Credit" if rng.random() < 0.3 else "Debit",
+            "status": "Booked",
+            "bookingDateTime": (started + timedelta(hours=6 * i)).isoformat() + "Z",
+            "transactionInformation": rng.choice(["Кофе", "Супермаркет", "Перевод", "Зарплата", "Такси"]),
+            "note": padding
+        }
+        for i in range(config.transactions_per_account)
+    ][::-1]
+
+    @app.middleware("http")
+    async def behave(request: Request, call_next):
+        # Счетчик по эндпоинту: accounts, accounts/balances, account-consents, ...
+        parts = request.url.path.strip("/").split("/")
+        config.stats["/".join(parts[::2]) if len(parts) > 2 else parts[0]] += 1
+        await asyncio.sleep(config.delay())
+        if config.error_rate and random.random() < config.error_rate:
+            config.stats["errors"] += 1
+            return JSONResponse({"detail": "Injected failure"}, status_code=random.choice((500, 503)))
+        return await call_next(request)
+
+    def require_token(authorization: Optional[str]):
+        if not authorization or not authorization.startswith("Bearer "):
+            raise HTTPException(401, "Missing bearer token")
+
+    @app.post("/auth/bank-token")
+    async def bank_token(client_id: str, client_secret: str):
+        return {"access_token": f"{config.name}-{uuid.uuid4().hex}", "token_type": "bearer", "expires_in": 86400}
+
+    @app.post("/account-consents/request")
+    async def request_consent(body: dict, authorization: Optional[str] = Header(None)):
+        require_token(authorization)
+        request_id = f"req-{uuid.uuid4().hex[:12]}"
+        if config.consent_signing_polls:
+            consents[request_id] = config.consent_signing_polls
+            return {"Data": {"ConsentRequestId": request_id, "Status": "AwaitingAuthorisation"}}
+        return {"Data": {"ConsentId": f"consent-{request_id}", "Status": "Authorised"}}
+
+    @app.get("/account-consents/{request_id}")
+    async def consent_status(request_id: str, authorization: Optional[str] = Header(None)):
+        require_token(authorization)
+        if request_id not in consents:
+            raise HTTPException(404, "Consent request not found")
+        consents[request_id] -= 1
+        if consents[request_id] > 0:
+            return {"Data": {"ConsentRequestId": request_id, "Status": "AwaitingAuthorisation"}}
+        return {"Data": {"ConsentId": f"consent-{request_id}", "Status": "Authorised"}}
+
+    @app.get("/accounts")
+    async def accounts(client_id: str = "client", authorization: Optional[str] = Header(None)):
+        require_token(authorization)
+        return {
+            "data": {
+                "account": [
+                    {
+                        "accountId": account_id,
+                        "status": "Enabled",
+                        "currency": "RUB",
+                        "nickname": padding,
+                        "account": [{"schemeName": "RU.CBR.PAN", "identification": f"40817810{i:012d}"}]
+                    }
+                    for i, account_id in enumerate(account_ids(client_id))
+                ]
+            }
+        }
+
+    @app.get("/accounts/{account_id}/balances")
+    async def balances(account_id: str, authorization: Optional[str] = Header(None)):
+        require_token(authorization)
+        return {
+            "data": {
+                "balance": [
+                    {
+                        "accountId": account_id,
+                        "type": "InterimAvailable",
+                        "amount": {"amount": f"{rng.randint(0, 10 ** 7) / 100:.2f}", "currency": "RUB"},
+                        "creditDebitIndicator": "Credit",
+                        "dateTime": datetime.utcnow().isoformat() + "Z"
+                    }
+                ]
+            }
+        }
+
+    @app.get("/accounts/{account_id}/transactions")
+    async def transactions(
+        account_id: str,
+        from_booking_date_time: Optional[str] = None,
+        offset: int = 0,
+        authorization: Optional[str] = Header(None)
+    ):
+        require_token(authorization)
+        items = history
+        if from_booking_date_time:
+            items = [tx for tx in items if tx["bookingDateTime"] >= from_booking_date_time]
+        page = items[offset:offset + config.transactions_page_size]
+        links = {"self": f"/accounts/{account_id}/transactions"}
+        if offset + config.transactions_page_size < len(items):
+            query = f"offset={offset + config.transactions_page_size}"
+            if from_booking_date_time:
+                query += f"&from_booking_date_time={from_booking_date_time}"
+            links["next"] = f"/accounts/{account_id}/transactions?{query}"
+        return {"data": {"transaction": [{**tx, "accountId": account_id} for tx in page]}, "links": links}
+
+    @app.get("/cards")
+    async def cards(client_id: str = "client", authorization: Optional[str] = Header(None)):
+        require_token(authorization)
+        return {
+            "data": {
+                "card": [
+                    {"cardId": f"{config.name}-card-{i}", "maskedPan": f"2200********{i:04d}", "status": "Active", "note": padding}
+                    for i in range(config.cards_per_client)
+                ]
+            }
+        }
+
+    return app
+
+
+def start_server(app: FastAPI) -> str:
+    """Запустить uvicorn в отдельном потоке, вернуть базовый URL"""
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake sandbox bank")
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--name", default="fakebank")
+    parser.add_argument("--latency", default="fixed:0", help="fixed:MS | uniform:MIN:MAX | lognormal:MEDIAN:SIGMA")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--slow-rate", type=float, default=0.0)
+    parser.add_argument("--slow-ms", type=float, default=2000.0)
+    parser.add_argument("--accounts", type=int, default=3)
+    parser.add_argument("--transactions", type=int, default=100)
+    parser.add_argument("--padding", type=int, default=0, help="Байт добавочного текста в каждом элементе")
+    parser.add_argument("--consent-polls", type=int, default=0)
+    args = parser.parse_args()
+
+    uvicorn.run(build_fake_bank(FakeBankConfig(
+        name=args.name,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        slow_rate=args.slow_rate,
+        slow_ms=args.slow_ms,
+        accounts_per_client=args.accounts,
+        transactions_per_account=args.transactions,
+        padding_bytes=args.padding,
+        consent_signing_polls=args.consent_polls
+    )), host="127.0.0.1", port=args.port, log_level="warning")
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк общего пула HTTP клиентов для multibank proxy
+
+Поднимает локальный «банк» (uvicorn на 127.0.0.1) и сравнивает:
+- before: новый httpx.AsyncClient на каждый запрос (как было в multibank_proxy)
+- after: обработчик /multibank/accounts-with-consent с общим http_pool
+
+Запуск из корня репозитория:
+    python benchmarks/http_pool_bench.py [--requests 500] [--concurrency 50]
+"""
+import argparse
+import asyncio
+import socket
+import statistics
+import sys
+import threading
+import time
+from pathlib import Path
+
+# Добавляем корневую директорию в PYTHONPATH
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Response
+
+from api.multibank_proxy import AccountsWithConsentRequest, TEAM_CLIENT_ID, get_accounts_with_consent
+from services.http_client_pool import http_pool
+
+
+def build_fake_bank(accounts_per_client: int) -> FastAPI:
+    """Минимальный банк: только GET /accounts"""
+    app = FastAPI()
+    payload = {
+        "data": {
+            "account": [
+                {
+                    "accountId": f"acc-{i}",
+                    "status": "Enabled",
+                    "currency": "RUB",
+                    "account": [{"schemeName": "RU.CBR.PAN", "identification": f"40817810{i:012d}"}]
+                }
+                for i in range(accounts_per_client)
+            ]
+        }
+    }
+
+    @app.get("/accounts")
+    async def accounts():
+        return payload
+
+    return app
+
+
+def start_server(app: FastAPI) -> str:
+    """Запустить uvicorn в отдельном потоке, вернуть базовый URL"""
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+
+async def fetch_before(bank_url: str):
+    """Старый путь: клиент открывается и закрывается на каждый запрос"""
+    async with httpx.AsyncClient(timeout=30.0) as client:
+        response = await client.get(
+            f"{bank_url}/accounts",
+            headers={
+                "accept": "application/json",
+                "Authorization": "Bearer bench",
+                "x-consent-id": "consent-bench",
+                "x-requesting-bank": TEAM_CLIENT_ID
+            },
+            params={"client_id": "team251-1"}
+        )
+        return response.json()
+
+
+async def fetch_after(bank_url: str):
+    """Новый путь: обработчик прокси с общим пулом (мимо кэша чтений)"""
+    return await get_accounts_with_consent(
+        AccountsWithConsentRequest(
+            bank_url=bank_url,
+            bank_token="bench",
+            consent_id="consent-bench",
+            client_id="team251-1"
+        ),
+        Response(),
+        cache_control="no-cache",
+        x_cache_bypass=None
+    )
+
+
+async def measure(name: str, fetch, bank_url: str, requests: int, concurrency: int):
+    # Прогрев
+    for _ in range(10):
+        await fetch(bank_url)
+
+    # Последовательная латентность
+    latencies = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        await fetch(bank_url)
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+
+    # Пропускная способность при параллельной нагрузке
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            await fetch(bank_url)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - started
+
+    print(
+        f"{name:<8} p50={statistics.median(latencies):6.2f} ms  "
+        f"p95={latencies[int(len(latencies) * 0.95) - 1]:6.2f} ms  "
+        f"throughput={requests / elapsed:8.1f} req/s (concurrency={concurrency})"
+    )
+
+
+async def main(args):
+    bank_url = start_server(build_fake_bank(args.accounts))
+    print(f"🏦 Fake bank: {bank_url}, {args.requests} requests, {args.accounts} accounts per response")
+    await measure("before", fetch_before, bank_url, args.requests, args.concurrency)
+    await measure("after", fetch_after, bank_url, args.requests, args.concurrency)
+    await http_pool.aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HTTP client pool benchmark")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--accounts", type=int, default=5)
+    asyncio.run(main(parser.parse_args()))
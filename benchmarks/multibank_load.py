@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест multibank proxy против трех локальных банков
+
+Поднимает три fake_bank (быстрый, средний и нестабильный) и роутер
+api/multibank_proxy.py в uvicorn, затем гоняет сценарии по HTTP с
+заданной параллельностью и печатает пропускную способность, перцентили
+задержки, коды ответов и состояние защиты банков (GET /multibank/metrics).
+
+Сценарии:
+- accounts: POST /multibank/accounts-with-consent (случайный банк)
+- passthrough: то же с ?passthrough=true (без разбора JSON)
+- balances: POST /multibank/balances-with-consent
+- dashboard: POST /multibank/dashboard по всем трем банкам
+
+Запуск из корня репозитория:
+    python benchmarks/multibank_load.py [--requests 2000] [--concurrency 50] [--scenario all] [--cache]
+
+По умолчанию кэш чтений (REMOTE_CACHE_ENABLED) выключен, чтобы каждый
+запрос доходил до банка; --cache включает его.
+"""
+import argparse
+import asyncio
+import logging
+import random
+import statistics
+import sys
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+# Добавляем корневую директорию в PYTHONPATH
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import httpx
+from fastapi import FastAPI
+
+from benchmarks.fake_bank import FakeBankConfig, build_fake_bank, start_server
+from config import config
+
+BANK_PROFILES = [
+    FakeBankConfig(name="fast", latency="lognormal:10:0.3"),
+    FakeBankConfig(name="medium", latency="lognormal:40:0.5", error_rate=0.02),
+    FakeBankConfig(name="flaky", latency="lognormal:80:0.8", error_rate=0.1, slow_rate=0.03, slow_ms=3000),
+]
+
+SCENARIOS = ("accounts", "passthrough", "balances", "dashboard")
+
+
+def build_proxy() -> FastAPI:
+    """Только роутер multibank proxy (без БД и фоновых задач основного приложения)"""
+    from api.multibank_proxy import router
+    from services.http_client_pool import http_pool
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        yield
+        await http_pool.aclose()
+
+    app = FastAPI(lifespan=lifespan)
+    app.include_router(router)
+    return app
+
+
+def scenario_request(name: str, banks: list, client_id: str):
+    """(method, path, params, json) одного запроса сценария"""
+    bank_url = random.choice(banks)
+    body = {"bank_url": bank_url, "consent_id": "consent-load", "client_id": client_id}
+    if name == "accounts":
+        return "POST", "/multibank/accounts-with-consent", None, body
+    if name == "passthrough":
+        return "POST", "/multibank/accounts-with-consent", {"passthrough": "true"}, body
+    if name == "balances":
+        return "POST", "/multibank/balances-with-consent", {
+            "account_id": f"acc-{random.randint(0, 2)}", "bank_url": bank_url, "consent_id": "consent-load"
+        }, None
+    return "POST", "/multibank/dashboard", None, {
+        "banks": [{"bank_url": url, "consent_id": "consent-load", "client_id": client_id} for url in banks],
+        "include": ["accounts", "balances"]
+    }
+
+
+async def run_scenario(client: httpx.AsyncClient, name: str, banks: list, args) -> dict:
+    latencies = []
+    statuses = Counter()
+    queue = asyncio.Queue()
+    for i in range(args.requests):
+        queue.put_nowait(i)
+
+    async def worker():
+        while True:
+            try:
+                i = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            method, path, params, body = scenario_request(name, banks, f"team251-{i % 10 + 1}")
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, params=params, json=body)
+                statuses[response.status_code] += 1
+                if name == "dashboard" and response.status_code == 200:
+                    for bank in response.json()["data"]["banks"]:
+                        statuses[f"bank:{bank['status']}"] += 1
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+
+    def percentile(p: float) -> float:
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))]
+
+    return {
+        "scenario": name,
+        "throughput": len(latencies) / elapsed,
+        "p50": statistics.median(latencies),
+        "p95": percentile(95),
+        "p99": percentile(99),
+        "max": latencies[-1],
+        "statuses": dict(statuses)
+    }
+
+
+async def main(args):
+    config.REMOTE_CACHE_ENABLED = args.cache
+    if not args.verbose:
+        # Ошибки банков ожидаемы (error_rate) - не засоряем отчет логами прокси
+        logging.disable(logging.ERROR)
+    random.seed(args.seed)
+
+    banks = [start_server(build_fake_bank(profile)) for profile in BANK_PROFILES]
+    proxy_url = start_server(build_proxy())
+    for profile, url in zip(BANK_PROFILES, banks):
+        print(f"🏦 {profile.name:<7} {url}  latency={profile.latency} errors={profile.error_rate:.0%} slow={profile.slow_rate:.0%}")
+    print(f"🔀 proxy   {proxy_url}  cache={'on' if args.cache else 'off'}, {args.requests} requests x concurrency {args.concurrency}")
+    print()
+
+    scenarios = SCENARIOS if args.scenario == "all" else (args.scenario,)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=proxy_url, timeout=60.0, limits=limits) as client:
+        # Прогрев: банковские токены и соединения пула
+        for name in scenarios:
+            for _ in range(5):
+                method, path, params, body = scenario_request(name, banks, "team251-1")
+                await client.request(method, path, params=params, json=body)
+
+        for name in scenarios:
+            result = await run_scenario(client, name, banks, args)
+            print(
+                f"{result['scenario']:<12} {result['throughput']:8.1f} req/s  "
+                f"p50={result['p50']:7.1f} ms  p95={result['p95']:7.1f} ms  "
+                f"p99={result['p99']:7.1f} ms  max={result['max']:7.1f} ms"
+            )
+            print(f"{'':<12} {result['statuses']}")
+
+        print()
+        metrics = (await client.get("/multibank/metrics")).json()
+        for bank in metrics["banks"]:
+            latency = bank["latency_ms"]
+            print(
+                f"🛡️  {bank['bank_url']}  state={bank['state']}  requests={bank['requests']}  "
+                f"failures={bank['failures']}  rejected={bank['rejected_open'] + bank['rejected_bulkhead']}  "
+                f"hedges={bank['hedges']}/{bank['hedge_wins']} won  p95={latency['p95']} ms"
+            )
+
+    for profile in BANK_PROFILES:
+        print(f"📊 {profile.name:<7} {dict(profile.stats)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Multibank proxy load test against local fake banks")
+    parser.add_argument("--requests", type=int, default=2000, help="Запросов на сценарий")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--scenario", choices=("all",) + SCENARIOS, default="all")
+    parser.add_argument("--cache", action="store_true", help="Включить кэш чтений remote_cache")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true", help="Логи прокси и защиты банков")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк пакетных платежей
+
+Сравнивает:
+- before: по одному PaymentService.initiate_payment на платеж (как POST /payments)
+- after: пакет через PaymentBatchService (порции, executemany, массовые INSERT)
+
+Все получатели - счета этого же банка (межбанковские строки только ставятся
+в outbox и на время обработки пакета не влияют).
+
+Запуск из корня репозитория:
+    python benchmarks/payment_batch_bench.py [--payments 10000] [--baseline 500]
+
+По умолчанию используется временная SQLite база; для PostgreSQL задайте
+DATABASE_URL (таблицы должны существовать, данные бенчмарка не удаляются).
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import uuid
+from decimal import Decimal
+from pathlib import Path
+
+# Временная база и отключенный опрос других банков - до импорта config
+if not os.environ.get("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{Path(tempfile.mkdtemp()) / 'batch_bench.db'}"
+os.environ.setdefault("INTERBANK_PEERS", "")
+
+# Добавляем корневую директорию в PYTHONPATH
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sqlalchemy import insert, select
+
+from config import config
+from database import AsyncSessionLocal, engine
+from models import (
+    Account, Base, BankCapitalDelta, Client, InterbankOutbox, InterbankTransfer,
+    LedgerEntry, Payment, PaymentBatch, PaymentBatchItem, Transaction
+)
+from services.payment_batch_service import PaymentBatchService, batch_processor
+from services.payment_service import PaymentService
+
+TABLES = [
+    Client.__table__, Account.__table__, Transaction.__table__, Payment.__table__,
+    PaymentBatch.__table__, PaymentBatchItem.__table__, InterbankTransfer.__table__,
+    InterbankOutbox.__table__, BankCapitalDelta.__table__, LedgerEntry.__table__
+]
+
+
+async def setup(creditors: int):
+    """Клиент, счет-отправитель и счета получателей"""
+    engine.echo = False
+    if config.DATABASE_URL.startswith("sqlite"):
+        async with engine.begin() as conn:
+            await conn.run_sync(lambda c: Base.metadata.create_all(c, tables=TABLES))
+
+    prefix = uuid.uuid4().hex[:6]
+    async with AsyncSessionLocal() as db:
+        client = Client(person_id=f"bench-{prefix}", client_type="individual", full_name="Bench")
+        db.add(client)
+        await db.flush()
+        debtor = Account(
+            client_id=client.id,
+            account_number=f"408{prefix}00000000000",
+            account_type="checking",
+            balance=Decimal("1000000000.00"),
+            status="active"
+        )
+        db.add(debtor)
+        await db.execute(insert(Account), [
+            {
+                "client_id": client.id,
+                "account_number": f"408{prefix}{i:011d}",
+                "account_type": "checking",
+                "balance": Decimal("0"),
+                "status": "active"
+            }
+            for i in range(1, creditors + 1)
+        ])
+        await db.commit()
+        return client.id, debtor, [f"408{prefix}{i:011d}" for i in range(1, creditors + 1)]
+
+
+async def run_before(debtor: Account, creditors: list, count: int) -> float:
+    started = time.perf_counter()
+    for i in range(count):
+        async with AsyncSessionLocal() as db:
+            await PaymentService.initiate_payment(
+                db=db,
+                from_account_number=debtor.account_number,
+                to_account_number=creditors[i % len(creditors)],
+                amount=Decimal("100.00"),
+                description="bench"
+            )
+            await db.commit()
+    return time.perf_counter() - started
+
+
+async def run_after(client_id: int, debtor: Account, creditors: list, count: int) -> float:
+    items = [
+        {"creditor_account": creditors[i % len(creditors)], "amount": "100.00", "description": "bench"}
+        for i in range(count)
+    ]
+    started = time.perf_counter()
+    async with AsyncSessionLocal() as db:
+        batch = await PaymentBatchService.create_batch(db, client_id, debtor, items)
+        await db.commit()
+        batch_id = batch.batch_id
+    await batch_processor._process(batch_id)
+    elapsed = time.perf_counter() - started
+
+    async with AsyncSessionLocal() as db:
+        batch = (await db.execute(select(PaymentBatch).where(PaymentBatch.batch_id == batch_id))).scalar_one()
+        print(f"         batch {batch.status}: {batch.completed_count} completed, {batch.rejected_count} rejected")
+    return elapsed
+
+
+async def main(args):
+    client_id, debtor, creditors = await setup(args.creditors)
+    print(f"🏦 {config.DATABASE_URL.split('@')[-1]}, {args.creditors} creditor accounts")
+
+    before = await run_before(debtor, creditors, args.baseline)
+    print(f"before  {args.baseline:6d} payments in {before:7.2f} s  -> {args.baseline / before:8.1f} payments/s "
+          f"(10k ≈ {10000 * before / args.baseline:6.1f} s)")
+
+    after = await run_after(client_id, debtor, creditors, args.payments)
+    print(f"after   {args.payments:6d} payments in {after:7.2f} s  -> {args.payments / after:8.1f} payments/s "
+          f"(chunk {config.PAYMENT_BATCH_CHUNK_SIZE})")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Payment batch benchmark")
+    parser.add_argument("--payments", type=int, default=10000, help="Строк в пакете")
+    parser.add_argument("--baseline", type=int, default=500, help="Платежей по одному для сравнения")
+    parser.add_argument("--creditors", type=int, default=1000)
+    asyncio.run(main(parser.parse_args()))
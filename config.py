@@ -42,7 +42,130 @@ class BankConfig(BaseSettings):
     
     # === REGISTRY (для федеративной архитектуры) ===
     REGISTRY_URL: str = "http://localhost:3000"
-    
+
+    # === INTERBANK (межбанковское взаимодействие) ===
+    # Коды банков-участников через запятую и шаблон их адресов (в Docker сети — имена сервисов)
+    INTERBANK_PEERS: str = "vbank,abank,sbank"
+    INTERBANK_URL_TEMPLATE: str = "http://{bank_code}:8000"
+
+    # Bloom-фильтры номеров счетов для маршрутизации переводов без опроса банков
+    ACCOUNT_DIGEST_ENABLED: bool = True
+    ACCOUNT_DIGEST_BITS_PER_ACCOUNT: int = 10  # ~1% ложных срабатываний при 7 хешах
+    ACCOUNT_DIGEST_HASH_COUNT: int = 7
+    ACCOUNT_DIGEST_MIN_BITS: int = 65536
+    ACCOUNT_DIGEST_REFRESH_SECONDS: int = 30  # Как часто забирать фильтры других банков
+    ACCOUNT_DIGEST_REBUILD_SECONDS: int = 600  # Полная пересборка своего фильтра из БД
+
+    # Общий пул исходящих HTTP клиентов (один клиент на удаленный банк)
+    HTTP_POOL_MAX_CONNECTIONS_PER_HOST: int = 50
+    HTTP_POOL_MAX_KEEPALIVE_PER_HOST: int = 20
+    HTTP_POOL_KEEPALIVE_EXPIRY: float = 30.0
+    HTTP_POOL_CONNECT_TIMEOUT: float = 5.0
+    HTTP_POOL_READ_TIMEOUT: float = 30.0
+    HTTP_POOL_HTTP2: bool = True  # Используется, если установлен пакет h2 и банк доступен по https
+    HTTP_POOL_MAX_CLIENTS: int = 64  # Банков в пуле (bank_url приходит из запросов), дальше - LRU
+
+    # Outbox исходящих межбанковских переводов и фоновая отправка
+    OUTBOX_DISPATCH_CONCURRENCY: int = 10  # Одновременных отправок
+    OUTBOX_BATCH_SIZE: int = 50  # Сколько записей забирать за один проход
+    OUTBOX_POLL_SECONDS: float = 2.0
+    OUTBOX_LEASE_SECONDS: int = 60  # Через сколько «зависшая» отправка будет повторена
+    OUTBOX_MAX_ATTEMPTS: int = 6  # Затем: отказ - возврат денег, неизвестный результат - needs_review
+    OUTBOX_BACKOFF_BASE_SECONDS: float = 2.0
+    OUTBOX_BACKOFF_MAX_SECONDS: float = 300.0
+
+    # Netting: переводы в один банк копятся окно и отправляются одним подписанным пакетом
+    INTERBANK_NETTING_ENABLED: bool = False
+    INTERBANK_NETTING_WINDOW_SECONDS: float = 1.0
+    INTERBANK_NETTING_MAX_BATCH: int = 1000  # Переводов в одном пакете
+
+    # Idempotency-Key для платежей и входящих межбанковских переводов
+    IDEMPOTENCY_TTL_HOURS: int = 24  # Сколько хранится сохраненный ответ
+    IDEMPOTENCY_PROCESSING_TIMEOUT_SECONDS: int = 60  # Незавершенный ключ старше - запрос не выполнен
+
+    # Изменения капитала пишутся в bank_capital_deltas и периодически сворачиваются в bank_capital
+    CAPITAL_FOLD_SECONDS: float = 5.0
+
+    # Пакетные платежи
+    PAYMENT_BATCH_MAX_ITEMS: int = 20000
+    PAYMENT_BATCH_CHUNK_SIZE: int = 500  # Строк на одну транзакцию БД
+    PAYMENT_BATCH_LOOKUP_CONCURRENCY: int = 20  # Параллельных запросов к банкам при поиске получателей
+
+    # История транзакций (GET /accounts/{id}/transactions)
+    TRANSACTIONS_PAGE_SIZE: int = 50
+    TRANSACTIONS_MAX_PAGE_SIZE: int = 500
+    TRANSACTIONS_EXPORT_YIELD_PER: int = 1000  # Строк, читаемых из серверного курсора за раз
+
+    # Multibank proxy: кэш банковских токенов других банков
+    BANK_TOKEN_REFRESH_MARGIN_SECONDS: int = 300  # Обновлять токен заранее, до истечения
+    BANK_TOKEN_DEFAULT_TTL_SECONDS: int = 3600  # Если банк не вернул expires_in
+    MULTIBANK_BANK_DEADLINE_SECONDS: float = 8.0  # Дедлайн одного банка в агрегирующем запросе
+    MULTIBANK_MAX_BANKS: int = 10
+
+    # Защита от медленных и падающих банков (services/bank_guard.py)
+    MULTIBANK_BULKHEAD_SIZE: int = 20  # Одновременных запросов к одному банку
+    MULTIBANK_BULKHEAD_WAIT_SECONDS: float = 2.0  # Ожидание свободного слота, затем ошибка
+    MULTIBANK_BREAKER_WINDOW: int = 50  # Последних вызовов в окне breaker
+    MULTIBANK_BREAKER_MIN_CALLS: int = 10  # Меньше вызовов в окне - breaker не срабатывает
+    MULTIBANK_BREAKER_FAILURE_RATE: float = 0.5
+    MULTIBANK_BREAKER_SLOW_CALL_SECONDS: float = 5.0
+    MULTIBANK_BREAKER_SLOW_RATE: float = 0.8
+    MULTIBANK_BREAKER_OPEN_SECONDS: float = 15.0  # Сколько банк открыт до пробных вызовов
+    MULTIBANK_BREAKER_HALF_OPEN_CALLS: int = 2
+    MULTIBANK_LATENCY_WINDOW: int = 200  # Задержек для перцентилей
+    MULTIBANK_HEDGE_ENABLED: bool = True  # Дублировать медленные GET
+    MULTIBANK_HEDGE_PERCENTILE: float = 95.0
+    MULTIBANK_HEDGE_MIN_DELAY: float = 0.05
+    MULTIBANK_HEDGE_MIN_SAMPLES: int = 20
+    MULTIBANK_HEDGE_BUDGET: float = 0.1  # Доля запросов, которые можно дублировать
+
+    # Ожидание подписания согласий (SBank) - фоновые задания
+    CONSENT_JOB_MIN_INTERVAL: float = 1.0  # Первая проверка статуса
+    CONSENT_JOB_MAX_INTERVAL: float = 10.0
+    CONSENT_JOB_BACKOFF: float = 1.5  # Интервал растет после каждой неудачной проверки
+    CONSENT_JOB_CHECK_TIMEOUT: float = 5.0
+    CONSENT_JOB_TTL_SECONDS: int = 300  # Не подписано за это время - expired
+    CONSENT_JOB_RETENTION_SECONDS: int = 600  # Сколько хранить завершенное задание
+    CONSENT_JOB_MAX_WAIT_SECONDS: float = 30.0  # Максимум для long-poll
+
+    # Кэш чтений из других банков (stale-while-revalidate)
+    REMOTE_CACHE_ENABLED: bool = True
+    REMOTE_CACHE_TTL_SECONDS: float = 15.0  # Сколько ответ считается свежим
+    REMOTE_CACHE_STALE_SECONDS: float = 120.0  # Сколько еще отдается устаревшая копия (с обновлением в фоне)
+    REMOTE_CACHE_MAX_ENTRIES: int = 5000
+
+    # Локальная копия транзакций других банков (services/remote_mirror.py)
+    REMOTE_MIRROR_SYNC_INTERVAL_SECONDS: float = 30.0  # Чаще счет с банком не синхронизируется
+    REMOTE_MIRROR_MAX_PAGES: int = 20  # Страниц links.next за одну синхронизацию
+    REMOTE_MIRROR_UPSERT_BATCH: int = 500
+    REMOTE_MIRROR_MAX_ACCOUNTS: int = 50  # Счетов в одном запросе поиска / аналитики
+
+    # Подключения клиентов к другим банкам (bank_connections)
+    BANK_CONNECTIONS_MAX_PER_CLIENT: int = 20
+
+    # Прогрев данных других банков для активных клиентов (services/multibank_prefetch.py)
+    MULTIBANK_PREFETCH_ENABLED: bool = True
+    MULTIBANK_PREFETCH_ACTIVE_MINUTES: int = 15  # Клиент активен столько после входа / запроса
+    MULTIBANK_PREFETCH_REFRESH_SECONDS: float = 60.0  # Подключение прогревается не чаще (< REMOTE_CACHE_STALE_SECONDS)
+    MULTIBANK_PREFETCH_INTERVAL_SECONDS: float = 10.0  # Период прохода
+    MULTIBANK_PREFETCH_BANK_RATE: float = 5.0  # Запросов прогрева в секунду к одному банку
+    MULTIBANK_PREFETCH_MAX_CONNECTIONS: int = 200  # Подключений за один проход
+    MULTIBANK_PREFETCH_MAX_ACCOUNTS: int = 10  # Счетов подключения
+    MULTIBANK_PREFETCH_TIMEOUT: float = 10.0
+
+    # Поток событий клиента (GET /events/stream)
+    EVENT_STREAM_BUFFER: int = 100  # Событий в очереди одного подключения
+    EVENT_STREAM_HEARTBEAT_SECONDS: float = 15.0
+
+    def interbank_peers(self) -> list:
+        """Коды других банков (без своего)"""
+        peers = [code.strip() for code in self.INTERBANK_PEERS.split(",") if code.strip()]
+        return [code for code in peers if code != self.BANK_CODE]
+
+    def interbank_url(self, bank_code: str) -> str:
+        """Базовый URL банка-участника"""
+        return self.INTERBANK_URL_TEMPLATE.format(bank_code=bank_code)
+
     @model_validator(mode='after')
     def build_database_url(self):
         """Если DATABASE_URL не задан, формируем его из POSTGRES_* переменных"""
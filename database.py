@@ -1,10 +1,10 @@
 """
 Database connection and session management
 """
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
-from typing import AsyncGenerator
+from typing import AsyncGenerator, Callable
 from config import config
 
 # Database URL from config
@@ -27,6 +27,24 @@ AsyncSessionLocal = async_sessionmaker(
 )
 
 
+# Колонки и индексы, добавленные в существующие таблицы: create_all создает
+# только новые таблицы (init.sql - только на пустом томе), поэтому они
+# добавляются при старте (идемпотентно)
+SCHEMA_UPGRADES = [
+    "ALTER TABLE accounts ADD COLUMN IF NOT EXISTS ledger_sequence INTEGER NOT NULL DEFAULT 0",
+    "CREATE INDEX IF NOT EXISTS idx_transactions_account_date ON transactions (account_id, transaction_date, id)",
+    "CREATE INDEX IF NOT EXISTS idx_interbank_outbox_due ON interbank_outbox (status, next_attempt_at)",
+]
+
+
+async def upgrade_schema(conn):
+    """Применить SCHEMA_UPGRADES (PostgreSQL)"""
+    if conn.dialect.name != "postgresql":
+        return
+    for statement in SCHEMA_UPGRADES:
+        await conn.execute(text(statement))
+
+
 async def get_db() -> AsyncGenerator[AsyncSession, None]:
     """
     Dependency для получения database session
@@ -41,3 +59,12 @@ async def get_db() -> AsyncGenerator[AsyncSession, None]:
         finally:
             await session.close()
 
+
+def after_commit(session: AsyncSession, callback: Callable[[], None]):
+    """
+    Вызвать callback после коммита сессии
+
+    Для побочных эффектов, которые должны видеть закоммиченные данные
+    (разбудить фоновую задачу), когда коммит выполняет вызывающий код.
+    """
+    event.listen(session.sync_session, "after_commit", lambda _: callback(), once=True)
@@ -13,26 +13,42 @@ from pathlib import Path
 try:
     # Попытка относительного импорта (для пакетного режима)
     from .config import config
-    from .database import engine
+    from .database import engine, upgrade_schema
     from .models import Base
     from .middleware import APILoggingMiddleware
+    from .services.account_digest_service import account_digest
+    from .services.http_client_pool import http_pool
+    from .services.interbank_dispatcher import interbank_dispatcher
+    from .services.capital_service import capital_ledger
+    from .services.payment_batch_service import batch_processor
+    from .services.consent_job_service import consent_jobs
+    from .services.multibank_prefetch import multibank_prefetch
     from .api import (
         accounts, auth, consents, payments, admin, products, well_known, 
         banker, product_agreements, product_agreement_consents,
         product_applications, customer_leads, product_offers, product_offer_consents,
-        vrp_consents, vrp_payments, interbank, payment_consents, multibank_proxy
+        vrp_consents, vrp_payments, interbank, payment_consents, multibank_proxy,
+        payment_batches, events
     )
 except ImportError:
     # Абсолютный импорт (для прямого запуска)
     from config import config
-    from database import engine
+    from database import engine, upgrade_schema
     from models import Base
     from middleware import APILoggingMiddleware
+    from services.account_digest_service import account_digest
+    from services.http_client_pool import http_pool
+    from services.interbank_dispatcher import interbank_dispatcher
+    from services.capital_service import capital_ledger
+    from services.payment_batch_service import batch_processor
+    from services.consent_job_service import consent_jobs
+    from services.multibank_prefetch import multibank_prefetch
     from api import (
         accounts, auth, consents, payments, admin, products, well_known, 
         banker, product_agreements, product_agreement_consents,
         product_applications, customer_leads, product_offers, product_offer_consents,
-        vrp_consents, vrp_payments, interbank, payment_consents, multibank_proxy
+        vrp_consents, vrp_payments, interbank, payment_consents, multibank_proxy,
+        payment_batches, events
     )
 
 
@@ -46,11 +62,27 @@ async def lifespan(app: FastAPI):
     # Create tables (в production использовать Alembic)
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await upgrade_schema(conn)
+    
+    # Фоновые задачи межбанковского взаимодействия
+    account_digest.start()
+    interbank_dispatcher.start()
+    capital_ledger.start()
+    batch_processor.start()
+    consent_jobs.start()
+    multibank_prefetch.start()
     
     yield
     
     # Shutdown
     print(f"🛑 Stopping {config.BANK_NAME}")
+    await multibank_prefetch.stop()
+    await consent_jobs.stop()
+    await batch_processor.stop()
+    await interbank_dispatcher.stop()
+    await capital_ledger.stop()
+    await account_digest.stop()
+    await http_pool.aclose()
     await engine.dispose()
 
 
@@ -118,6 +150,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Idempotent-Replayed", "X-Cache", "X-Total-Count"],
 )
 
 # Add API logging middleware
@@ -166,6 +199,8 @@ app.include_router(accounts.router)
 app.include_router(consents.router)
 app.include_router(payment_consents.router)
 app.include_router(payments.router)
+app.include_router(payment_batches.router)
+app.include_router(events.router)
 app.include_router(products.router)
 app.include_router(product_agreements.router)
 app.include_router(product_agreement_consents.router)
@@ -1,7 +1,7 @@
 """
 SQLAlchemy модели для банка
 """
-from sqlalchemy import Column, Integer, String, Numeric, DateTime, ForeignKey, Text, ARRAY, Boolean, UniqueConstraint
+from sqlalchemy import Column, Integer, String, Numeric, DateTime, ForeignKey, Text, ARRAY, Boolean, UniqueConstraint, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -51,6 +51,7 @@ class Account(Base):
     currency = Column(String(3), default="RUB")
     status = Column(String(20), default="active")
     opened_at = Column(DateTime, default=datetime.utcnow)
+    ledger_sequence = Column(Integer, nullable=False, default=0)  # Номер последней записи в ledger_entries
     
     # Relationships
     client = relationship("Client", back_populates="accounts")
@@ -60,6 +61,10 @@ class Account(Base):
 class Transaction(Base):
     """Транзакция по счету"""
     __tablename__ = "transactions"
+    __table_args__ = (
+        # История по счету: фильтр по дате и keyset-пагинация по (transaction_date, id)
+        Index("idx_transactions_account_date", "account_id", "transaction_date", "id"),
+    )
     
     id = Column(Integer, primary_key=True)
     account_id = Column(Integer, ForeignKey("accounts.id"), nullable=False)
@@ -75,6 +80,66 @@ class Transaction(Base):
     account = relationship("Account", back_populates="transactions")
 
 
+class LedgerEntry(Base):
+    """Проводка по счету с остатком после нее (append-only, пишет PostingService)"""
+    __tablename__ = "ledger_entries"
+    __table_args__ = (
+        UniqueConstraint("account_id", "sequence", name="uq_ledger_entries_account_sequence"),
+        Index("idx_ledger_entries_account_posted", "account_id", "posted_at", "sequence"),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    account_id = Column(Integer, ForeignKey("accounts.id"), nullable=False)
+    sequence = Column(Integer, nullable=False)  # Растет на 1 с каждой проводкой по счету
+    amount = Column(Numeric(15, 2), nullable=False)  # > 0 зачисление, < 0 списание
+    balance_after = Column(Numeric(15, 2), nullable=False)
+    posted_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+class RemoteTransaction(Base):
+    """Локальная копия транзакции счета в другом банке (пишет RemoteMirror)"""
+    __tablename__ = "remote_transactions"
+    __table_args__ = (
+        UniqueConstraint("bank_url", "account_id", "transaction_id", name="uq_remote_transactions_key"),
+        # История по счету и инкрементальная синхронизация (max booking_date_time)
+        Index("idx_remote_transactions_account_booking", "bank_url", "account_id", "booking_date_time"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    bank_url = Column(String(255), nullable=False)  # scheme://host[:port] банка
+    account_id = Column(String(100), nullable=False)  # accountId в банке
+    transaction_id = Column(String(100), nullable=False)
+    booking_date_time = Column(DateTime, nullable=False)
+    amount = Column(Numeric(15, 2), nullable=False)  # > 0 зачисление, < 0 списание
+    currency = Column(String(3), default="RUB")
+    description = Column(Text)
+    payload = Column(Text, nullable=False)  # JSON транзакции как ее отдал банк
+    synced_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+class BankConnection(Base):
+    """Подключение клиента к другому банку (multibank): согласие, токен банка, синхронизация"""
+    __tablename__ = "bank_connections"
+    __table_args__ = (
+        UniqueConstraint("client_id", "bank_url", "remote_client_id", name="uq_bank_connections_client_bank"),
+        # Фоновое обновление: подключенные банки, давно не синхронизированные
+        Index("idx_bank_connections_status_synced", "consent_status", "last_synced_at"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    client_id = Column(Integer, ForeignKey("clients.id"), nullable=False)
+    bank_url = Column(String(255), nullable=False)  # scheme://host[:port] банка
+    remote_client_id = Column(String(100), nullable=False)  # client_id клиента в другом банке
+    consent_id = Column(String(100))
+    consent_status = Column(String(20), nullable=False, default="pending")  # pending, authorized, rejected, revoked
+    consent_job_id = Column(String(50))  # ожидание подписания (services/consent_job_service.py)
+    bank_token_sealed = Column(Text)  # токен банка, зашифрован (BankConnectionService.seal)
+    bank_token_expires_at = Column(DateTime)
+    last_synced_at = Column(DateTime)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
 class BankSettings(Base):
     """Настройки банка"""
     __tablename__ = "bank_settings"
@@ -294,6 +359,47 @@ class Payment(Base):
     account = relationship("Account")
 
 
+class PaymentBatch(Base):
+    """Пакет платежей (зарплатная ведомость и т.п.)"""
+    __tablename__ = "payment_batches"
+    
+    id = Column(Integer, primary_key=True)
+    batch_id = Column(String(100), unique=True, nullable=False)
+    client_id = Column(Integer, ForeignKey("clients.id"), nullable=False)
+    account_id = Column(Integer, ForeignKey("accounts.id"), nullable=False)  # Счет-отправитель
+    status = Column(String(30), default="accepted")
+    # accepted / processing / completed / completed_with_errors / failed
+    source = Column(String(10), default="json")  # json / csv
+    total_count = Column(Integer, default=0)
+    total_amount = Column(Numeric(15, 2), default=0)
+    processed_count = Column(Integer, default=0)
+    completed_count = Column(Integer, default=0)  # Внутрибанковские, зачислены
+    queued_count = Column(Integer, default=0)  # Межбанковские, поставлены в outbox
+    rejected_count = Column(Integer, default=0)
+    error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    completed_at = Column(DateTime)
+
+
+class PaymentBatchItem(Base):
+    """Строка пакета платежей"""
+    __tablename__ = "payment_batch_items"
+    
+    id = Column(Integer, primary_key=True)
+    batch_id = Column(String(100), ForeignKey("payment_batches.batch_id"), nullable=False, index=True)
+    line_number = Column(Integer, nullable=False)
+    creditor_account = Column(String(255))
+    amount = Column(Numeric(15, 2))
+    description = Column(Text)
+    reference = Column(String(100))  # Идентификатор строки у клиента
+    status = Column(String(20), default="pending", index=True)  # pending / completed / queued / rejected
+    payment_id = Column(String(100))
+    destination_bank = Column(String(100))
+    error = Column(Text)
+    processed_at = Column(DateTime)
+
+
 class InterbankTransfer(Base):
     """Межбанковский перевод (для отслеживания капитала)"""
     __tablename__ = "interbank_transfers"
@@ -309,6 +415,49 @@ class InterbankTransfer(Base):
     completed_at = Column(DateTime)
 
 
+class InterbankOutbox(Base):
+    """Исходящие межбанковские переводы, ожидающие отправки (transactional outbox)"""
+    __tablename__ = "interbank_outbox"
+    __table_args__ = (
+        # Выборка диспетчером: строки в статусе, срок отправки которых наступил
+        Index("idx_interbank_outbox_due", "status", "next_attempt_at"),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    transfer_id = Column(String(100), ForeignKey("interbank_transfers.transfer_id"), unique=True, nullable=False)
+    payment_id = Column(String(100), ForeignKey("payments.payment_id"))
+    to_bank = Column(String(100), nullable=False)
+    to_account_number = Column(String(255), nullable=False)
+    amount = Column(Numeric(15, 2), nullable=False)
+    currency = Column(String(3), default="RUB")
+    description = Column(Text)
+    status = Column(String(20), default="pending")  # pending / sending / sent / failed / needs_review
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow)
+    last_error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class IdempotencyRecord(Base):
+    """Сохраненный результат запроса с заголовком Idempotency-Key"""
+    __tablename__ = "idempotency_records"
+    __table_args__ = (
+        UniqueConstraint("scope", "caller", "idempotency_key", name="uq_idempotency_scope_caller_key"),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    scope = Column(String(100), nullable=False)  # payments, transfer-internal, vrp-payments, interbank-receive
+    caller = Column(String(100), nullable=False)  # client_id или код банка-отправителя
+    idempotency_key = Column(String(255), nullable=False)
+    request_fingerprint = Column(String(64), nullable=False)  # sha256 тела запроса
+    status = Column(String(20), default="processing")  # processing / completed
+    response_code = Column(Integer)
+    response_body = Column(Text)  # JSON ответа
+    created_at = Column(DateTime, default=datetime.utcnow)
+    completed_at = Column(DateTime)
+
+
 class BankCapital(Base):
     """Капитал банка (для экономической модели)"""
     __tablename__ = "bank_capital"
@@ -322,6 +471,18 @@ class BankCapital(Base):
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 
+class BankCapitalDelta(Base):
+    """Изменение капитала банка, еще не свернутое в BankCapital (append-only)"""
+    __tablename__ = "bank_capital_deltas"
+    
+    id = Column(Integer, primary_key=True)
+    bank_code = Column(String(100), nullable=False, index=True)
+    capital_change = Column(Numeric(15, 2), nullable=False, default=0)
+    loans_change = Column(Numeric(15, 2), nullable=False, default=0)  # Изменение total_loans
+    reason = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
 class Product(Base):
     """Финансовый продукт банка"""
     __tablename__ = "products"
@@ -0,0 +1,275 @@
+"""
+Account Digest Service - Bloom-фильтры номеров счетов для межбанковской маршрутизации
+
+Каждый банк публикует компактный версионированный Bloom-фильтр своих счетов
+(GET /interbank/account-digest). PaymentService держит локальные копии фильтров
+других банков и опрашивает /interbank/check-account только те банки,
+фильтр которых говорит «возможно, счет здесь».
+"""
+import asyncio
+import base64
+import hashlib
+import logging
+import time
+import uuid
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select
+
+from config import config
+from database import AsyncSessionLocal
+from models import Account
+from services.http_client_pool import http_pool
+
+logger = logging.getLogger(__name__)
+
+
+class AccountBloomFilter:
+    """
+    Bloom-фильтр номеров счетов
+
+    Схема хеширования одинакова у всех банков: blake2b (128 бит) и двойное
+    хеширование h1 + i*h2, поэтому фильтр можно проверять на стороне получателя.
+    """
+
+    HASH_SCHEME = "blake2b-dh"
+
+    def __init__(self, size_bits: int, hash_count: int, bits: Optional[bytearray] = None):
+        self.size_bits = size_bits
+        self.hash_count = hash_count
+        self.bits = bits if bits is not None else bytearray((size_bits + 7) // 8)
+
+    @staticmethod
+    def positions(key: str, size_bits: int, hash_count: int) -> List[int]:
+        """Номера битов для ключа"""
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:], "big") | 1
+        return [(h1 + i * h2) % size_bits for i in range(hash_count)]
+
+    def __contains__(self, key: str) -> bool:
+        return all(
+            self.bits[pos >> 3] & (1 << (pos & 7))
+            for pos in self.positions(key, self.size_bits, self.hash_count)
+        )
+
+    @classmethod
+    def from_payload(cls, payload: dict) -> "AccountBloomFilter":
+        """Восстановить фильтр из ответа /interbank/account-digest"""
+        if payload.get("hash_scheme") != cls.HASH_SCHEME:
+            raise ValueError(f"Unsupported hash scheme: {payload.get('hash_scheme')}")
+        bits = bytearray(zlib.decompress(base64.b64decode(payload["bits"])))
+        size_bits = int(payload["size_bits"])
+        if len(bits) != (size_bits + 7) // 8:
+            raise ValueError("Digest size mismatch")
+        return cls(size_bits, int(payload["hash_count"]), bits)
+
+
+class LocalAccountDigest:
+    """
+    Counting Bloom-фильтр собственных счетов
+
+    Счетчики позволяют удалять номера при закрытии счета без полной пересборки.
+    Наружу публикуется обычный битовый фильтр (счетчик > 0).
+    """
+
+    def __init__(self, size_bits: int, hash_count: int):
+        self.size_bits = size_bits
+        self.hash_count = hash_count
+        self.counters = bytearray(size_bits)
+        self.count = 0
+        # Эпоха меняется при каждой пересборке, счетчик — при каждом изменении
+        self.epoch = uuid.uuid4().hex[:8]
+        self.revision = 0
+        self._payload: Optional[dict] = None
+
+    @property
+    def version(self) -> str:
+        return f"{self.epoch}-{self.revision}"
+
+    @property
+    def overloaded(self) -> bool:
+        """Счетов больше, чем рассчитан фильтр — пора пересобрать с большим размером"""
+        return self.count * config.ACCOUNT_DIGEST_BITS_PER_ACCOUNT > self.size_bits
+
+    def add(self, account_number: str):
+        for pos in AccountBloomFilter.positions(account_number, self.size_bits, self.hash_count):
+            if self.counters[pos] < 255:
+                self.counters[pos] += 1
+        self.count += 1
+        self._touch()
+
+    def remove(self, account_number: str):
+        positions = AccountBloomFilter.positions(account_number, self.size_bits, self.hash_count)
+        # Не трогаем счетчики, если номера в фильтре точно нет
+        if not all(self.counters[pos] for pos in positions):
+            return
+        for pos in positions:
+            # Насыщенный счетчик не уменьшаем: его истинное значение неизвестно
+            if self.counters[pos] < 255:
+                self.counters[pos] -= 1
+        self.count = max(0, self.count - 1)
+        self._touch()
+
+    def _touch(self):
+        self.revision += 1
+        self._payload = None
+
+    def to_payload(self) -> dict:
+        """Битовый фильтр для публикации (кешируется до следующего изменения)"""
+        if self._payload is None:
+            bits = bytearray((self.size_bits + 7) // 8)
+            for pos, counter in enumerate(self.counters):
+                if counter:
+                    bits[pos >> 3] |= 1 << (pos & 7)
+            self._payload = {
+                "bank_code": config.BANK_CODE,
+                "version": self.version,
+                "hash_scheme": AccountBloomFilter.HASH_SCHEME,
+                "size_bits": self.size_bits,
+                "hash_count": self.hash_count,
+                "account_count": self.count,
+                "bits": base64.b64encode(zlib.compress(bytes(bits))).decode("ascii"),
+            }
+        return self._payload
+
+
+class AccountDigestService:
+    """Публикация своего фильтра и кеш фильтров других банков"""
+
+    def __init__(self):
+        self.local: Optional[LocalAccountDigest] = None
+        # bank_code -> (фильтр, версия, время получения)
+        self.peers: Dict[str, Tuple[AccountBloomFilter, str, float]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._last_rebuild = 0.0
+
+    # === Свой фильтр ===
+
+    @staticmethod
+    def _size_for(account_count: int) -> int:
+        """Размер фильтра: степень двойки не меньше count * bits_per_account"""
+        size = config.ACCOUNT_DIGEST_MIN_BITS
+        while size < account_count * config.ACCOUNT_DIGEST_BITS_PER_ACCOUNT * 2:
+            size *= 2
+        return size
+
+    async def rebuild(self):
+        """Полная пересборка фильтра из БД (активные счета)"""
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(Account.account_number).where(Account.status == "active")
+            )
+            numbers = result.scalars().all()
+
+        digest = LocalAccountDigest(self._size_for(len(numbers)), config.ACCOUNT_DIGEST_HASH_COUNT)
+        for number in numbers:
+            digest.add(number)
+        self.local = digest
+        self._last_rebuild = time.monotonic()
+        logger.info(f"Account digest rebuilt: {digest.count} accounts, {digest.size_bits} bits, version {digest.version}")
+
+    def account_opened(self, account_number: str):
+        """Вызывается после commit при открытии (или повторной активации) счета"""
+        if self.local is not None:
+            self.local.add(account_number)
+
+    def account_closed(self, account_number: str):
+        """Вызывается после commit при закрытии или удалении счета"""
+        if self.local is not None:
+            self.local.remove(account_number)
+
+    def publish(self) -> Optional[dict]:
+        return self.local.to_payload() if self.local is not None else None
+
+    # === Фильтры других банков ===
+
+    async def refresh_peer(self, bank_code: str):
+        """Забрать фильтр банка, если его версия изменилась"""
+        known = self.peers.get(bank_code)
+        params = {"known_version": known[1]} if known else {}
+        try:
+            client = http_pool.client_for(config.interbank_url(bank_code))
+            response = await client.get(
+                f"{config.interbank_url(bank_code)}/interbank/account-digest",
+                params=params,
+                timeout=5.0,
+                headers={"x-bank-auth-token": config.BANK_CODE}
+            )
+            if response.status_code == 304 and known:
+                self.peers[bank_code] = (known[0], known[1], time.monotonic())
+            elif response.status_code == 200:
+                payload = response.json()
+                self.peers[bank_code] = (
+                    AccountBloomFilter.from_payload(payload),
+                    payload["version"],
+                    time.monotonic()
+                )
+                logger.debug(f"Account digest of {bank_code} updated to {payload['version']}")
+            else:
+                logger.debug(f"Account digest of {bank_code} unavailable: {response.status_code}")
+        except Exception as e:
+            logger.debug(f"Failed to refresh account digest of {bank_code}: {str(e)}")
+
+    def _fresh_filter(self, bank_code: str) -> Optional[AccountBloomFilter]:
+        """Фильтр банка, если он не устарел (иначе ему нельзя верить на «нет»)"""
+        known = self.peers.get(bank_code)
+        if not known:
+            return None
+        max_age = config.ACCOUNT_DIGEST_REFRESH_SECONDS * 3
+        if time.monotonic() - known[2] > max_age:
+            return None
+        return known[0]
+
+    def rank_banks(self, account_number: str, banks: Iterable[str]) -> Tuple[List[str], List[str]]:
+        """
+        Разделить банки на кандидатов и исключенных фильтром
+
+        Returns:
+            (банки для опроса: попадание в фильтр или фильтра нет,
+             банки, где счета точно нет по актуальному фильтру)
+        """
+        candidates, excluded = [], []
+        for bank_code in banks:
+            bloom = self._fresh_filter(bank_code) if config.ACCOUNT_DIGEST_ENABLED else None
+            if bloom is not None and account_number not in bloom:
+                excluded.append(bank_code)
+            else:
+                candidates.append(bank_code)
+        return candidates, excluded
+
+    # === Фоновое обновление ===
+
+    async def _run(self):
+        while True:
+            try:
+                if (
+                    self.local is None
+                    or self.local.overloaded
+                    or time.monotonic() - self._last_rebuild > config.ACCOUNT_DIGEST_REBUILD_SECONDS
+                ):
+                    await self.rebuild()
+                await asyncio.gather(*(self.refresh_peer(b) for b in config.interbank_peers()))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Account digest refresh failed: {str(e)}")
+            await asyncio.sleep(config.ACCOUNT_DIGEST_REFRESH_SECONDS)
+
+    def start(self):
+        if config.ACCOUNT_DIGEST_ENABLED and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# Singleton instance
+account_digest = AccountDigestService()
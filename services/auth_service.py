@@ -4,13 +4,14 @@
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
+from jose.exceptions import JOSEError
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pathlib import Path
-import httpx
 
 from config import config
+from services.http_client_pool import http_pool
 
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -19,6 +20,34 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
 
 
+class BankSigningKeyError(Exception):
+    """Нет приватного ключа банка: подпись RS256 невозможна"""
+
+
+def create_bank_signature(data: dict, expires_delta: timedelta) -> str:
+    """
+    JWT банка, подписанный только RS256 (приватный ключ BANK_CODE)
+
+    В отличие от create_access_token(use_rs256=True), без перехода на HS256:
+    общий SECRET_KEY не должен подтверждать межбанковские операции.
+
+    Raises:
+        BankSigningKeyError: ключа нет или он не читается
+    """
+    private_key_path = Path(__file__).parent.parent.parent.parent / "shared" / "keys" / f"{config.BANK_CODE}_private.pem"
+    try:
+        with open(private_key_path, 'r') as f:
+            private_key = f.read()
+    except OSError as e:
+        raise BankSigningKeyError(f"Private key of {config.BANK_CODE} not available: {e}")
+
+    to_encode = {**data, "exp": datetime.utcnow() + expires_delta}
+    try:
+        return jwt.encode(to_encode, private_key, algorithm="RS256", headers={"kid": f"{config.BANK_CODE}-2025"})
+    except JOSEError as e:
+        raise BankSigningKeyError(f"Private key of {config.BANK_CODE} is invalid: {e}")
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None, use_rs256: bool = False):
     """Создание JWT токена (HS256 или RS256)"""
     to_encode = data.copy()
@@ -102,24 +131,24 @@ async def verify_rs256_token(token: str, bank_code: str) -> dict:
             return payload
         
         # Альтернативно: загрузить JWKS через HTTP
-        async with httpx.AsyncClient() as client:
-            # Определить base URL банка
-            bank_ports = {"vbank": 8001, "abank": 8002, "sbank": 8003}
-            port = bank_ports.get(bank_code, 8001)
-            
-            jwks_url = f"http://localhost:{port}/.well-known/jwks.json"
-            response = await client.get(jwks_url, timeout=5.0)
-            
-            if response.status_code == 200:
-                jwks = response.json()
-                # Используем первый ключ из JWKS
-                if jwks.get("keys"):
-                    # Для упрощения используем первый ключ
-                    # В production нужно искать по kid
-                    key = jwks["keys"][0]
-                    # jwt.decode автоматически обработает JWKS
-                    payload = jwt.decode(token, key, algorithms=["RS256"])
-                    return payload
+        # Определить base URL банка
+        bank_ports = {"vbank": 8001, "abank": 8002, "sbank": 8003}
+        port = bank_ports.get(bank_code, 8001)
+        
+        jwks_url = f"http://localhost:{port}/.well-known/jwks.json"
+        client = http_pool.client_for(jwks_url)
+        response = await client.get(jwks_url, timeout=5.0)
+        
+        if response.status_code == 200:
+            jwks = response.json()
+            # Используем первый ключ из JWKS
+            if jwks.get("keys"):
+                # Для упрощения используем первый ключ
+                # В production нужно искать по kid
+                key = jwks["keys"][0]
+                # jwt.decode автоматически обработает JWKS
+                payload = jwt.decode(token, key, algorithms=["RS256"])
+                return payload
         
         raise JWTError("Failed to verify RS256 token")
         
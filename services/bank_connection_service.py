@@ -0,0 +1,191 @@
+"""
+Bank Connection Service - подключения клиентов к другим банкам
+
+Подключение хранит на сервере все, что раньше браузер передавал в каждом
+запросе /multibank/*: банк, client_id клиента в нем, согласие и токен
+банка. Эндпоинты /multibank/connections/{id}/... ссылаются только на id,
+а токен переиспользуется между запросами и перезапусками (хранится
+зашифрованным, ключ - из SECRET_KEY).
+"""
+import base64
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from cryptography.fernet import Fernet, InvalidToken
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import config
+from database import AsyncSessionLocal
+from models import BankConnection, Client
+from services.bank_token_cache import bank_token_cache
+from services.http_client_pool import http_pool
+
+logger = logging.getLogger(__name__)
+
+_fernet = Fernet(base64.urlsafe_b64encode(hashlib.sha256(config.SECRET_KEY.encode()).digest()))
+
+
+class BankConnectionError(Exception):
+    """Подключение не найдено или недоступно"""
+
+    def __init__(self, status_code: int, detail: str):
+        self.status_code = status_code
+        self.detail = detail
+        super().__init__(detail)
+
+
+class BankConnectionService:
+    """Сервис подключений к другим банкам"""
+
+    @staticmethod
+    def seal(token: str) -> str:
+        return _fernet.encrypt(token.encode()).decode()
+
+    @staticmethod
+    def unseal(sealed: Optional[str]) -> Optional[str]:
+        if not sealed:
+            return None
+        try:
+            return _fernet.decrypt(sealed.encode()).decode()
+        except InvalidToken:
+            # SECRET_KEY сменился - токен будет получен заново
+            return None
+
+    @staticmethod
+    async def owner(db: AsyncSession, person_id: str) -> Client:
+        client = (await db.execute(select(Client).where(Client.person_id == person_id))).scalar_one_or_none()
+        if client is None:
+            raise BankConnectionError(404, "Client not found")
+        return client
+
+    @staticmethod
+    async def for_client(db: AsyncSession, client: Client) -> List[BankConnection]:
+        result = await db.execute(
+            select(BankConnection).where(BankConnection.client_id == client.id).order_by(BankConnection.id)
+        )
+        return list(result.scalars().all())
+
+    @staticmethod
+    async def get(db: AsyncSession, client: Client, connection_id: int) -> BankConnection:
+        connection = (await db.execute(
+            select(BankConnection).where(BankConnection.id == connection_id, BankConnection.client_id == client.id)
+        )).scalar_one_or_none()
+        if connection is None:
+            raise BankConnectionError(404, "Connection not found")
+        return connection
+
+    @staticmethod
+    async def authorized(db: AsyncSession, client: Client, connection_id: int) -> BankConnection:
+        """Подключение с подписанным согласием (для чтения данных банка)"""
+        connection = await BankConnectionService.get(db, client, connection_id)
+        if connection.consent_status != "authorized" or not connection.consent_id:
+            raise BankConnectionError(409, f"Consent is {connection.consent_status}")
+        return connection
+
+    @staticmethod
+    async def upsert(
+        db: AsyncSession,
+        client: Client,
+        bank_url: str,
+        remote_client_id: str,
+        consent_id: Optional[str] = None,
+        bank_token: Optional[str] = None
+    ) -> BankConnection:
+        """Создать подключение или обновить существующее (банк + client_id в нем)"""
+        base_url = http_pool.base_url(bank_url)
+        connection = (await db.execute(
+            select(BankConnection).where(
+                BankConnection.client_id == client.id,
+                BankConnection.bank_url == base_url,
+                BankConnection.remote_client_id == remote_client_id
+            )
+        )).scalar_one_or_none()
+
+        if connection is None:
+            count = (await db.execute(
+                select(func.count(BankConnection.id)).where(BankConnection.client_id == client.id)
+            )).scalar()
+            if count >= config.BANK_CONNECTIONS_MAX_PER_CLIENT:
+                raise BankConnectionError(400, f"Too many connections (max {config.BANK_CONNECTIONS_MAX_PER_CLIENT})")
+            connection = BankConnection(client_id=client.id, bank_url=base_url, remote_client_id=remote_client_id)
+            db.add(connection)
+
+        if consent_id:
+            connection.consent_id = consent_id
+            connection.consent_status = "authorized"
+            connection.consent_job_id = None
+        if bank_token:
+            BankConnectionService.store_token(connection, bank_token, config.BANK_TOKEN_DEFAULT_TTL_SECONDS)
+        await db.flush()
+        return connection
+
+    @staticmethod
+    def store_token(connection: BankConnection, token: str, expires_in: float):
+        connection.bank_token_sealed = BankConnectionService.seal(token)
+        connection.bank_token_expires_at = datetime.utcnow() + timedelta(seconds=float(expires_in))
+
+    @staticmethod
+    def stored_token(connection: BankConnection) -> Optional[str]:
+        """Сохраненный токен, пока не близок к истечению"""
+        expires_at = connection.bank_token_expires_at
+        margin = timedelta(seconds=config.BANK_TOKEN_REFRESH_MARGIN_SECONDS)
+        if expires_at and expires_at - margin > datetime.utcnow():
+            return BankConnectionService.unseal(connection.bank_token_sealed)
+        return None
+
+    @staticmethod
+    async def token(connection: BankConnection) -> str:
+        """
+        Токен банка для подключения: сохраненный, пока не близок к истечению,
+        иначе из bank_token_cache (и сохраняется в подключении)
+
+        Raises:
+            BankTokenError, httpx.TimeoutException, httpx.RequestError: как bank_token_cache.get
+        """
+        token = BankConnectionService.stored_token(connection)
+        if token:
+            return token
+
+        token_data = await bank_token_cache.get(connection.bank_url)
+        BankConnectionService.store_token(connection, token_data["access_token"], token_data["expires_in"])
+        return token_data["access_token"]
+
+    @staticmethod
+    def forget_token(connection: BankConnection):
+        """Банк отклонил токен (401) - следующий запрос получит новый"""
+        connection.bank_token_sealed = None
+        connection.bank_token_expires_at = None
+
+    @staticmethod
+    async def attach_consent(connection_id: int, status: str, consent_id: Optional[str] = None):
+        """Итог ожидания подписания согласия (вызывается из consent_jobs, своя сессия)"""
+        async with AsyncSessionLocal() as db:
+            connection = await db.get(BankConnection, connection_id)
+            if connection is None:
+                return
+            connection.consent_status = status
+            connection.consent_job_id = None
+            if consent_id:
+                connection.consent_id = consent_id
+            await db.commit()
+        logger.info(f"Bank connection {connection_id}: consent {status}")
+
+    @staticmethod
+    def to_dict(connection: BankConnection) -> dict:
+        data = {
+            "connection_id": connection.id,
+            "bank_url": connection.bank_url,
+            "client_id": connection.remote_client_id,
+            "consent_id": connection.consent_id,
+            "consent_status": connection.consent_status,
+            "token_expires_at": connection.bank_token_expires_at.isoformat() + "Z" if connection.bank_token_expires_at else None,
+            "last_synced_at": connection.last_synced_at.isoformat() + "Z" if connection.last_synced_at else None,
+            "created_at": connection.created_at.isoformat() + "Z" if connection.created_at else None,
+            "links": {"self": f"/multibank/connections/{connection.id}"}
+        }
+        if connection.consent_job_id:
+            data["links"]["job"] = f"/multibank/consent-jobs/{connection.consent_job_id}"
+        return data
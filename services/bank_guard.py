@@ -0,0 +1,307 @@
+"""
+Bank Guard - изоляция медленных и падающих банков (bulkhead, circuit breaker, hedging)
+
+Защита встроена в транспорт клиентов http_pool, поэтому действует на все
+исходящие вызовы к банку:
+- bulkhead: не больше MULTIBANK_BULKHEAD_SIZE одновременных запросов к
+  одному банку; кто не дождался слота за MULTIBANK_BULKHEAD_WAIT_SECONDS -
+  получает BulkheadFullError, а не занимает воркер;
+- circuit breaker: по окну последних вызовов считаются доли ошибок (5xx,
+  таймауты, ошибки соединения) и медленных ответов; при превышении порога
+  банк "открывается" на MULTIBANK_BREAKER_OPEN_SECONDS и вызовы сразу
+  получают CircuitOpenError, затем несколько пробных вызовов (half_open)
+  решают, закрыть его или открыть снова;
+- hedging: если идемпотентный GET не ответил за перцентиль
+  MULTIBANK_HEDGE_PERCENTILE наблюдаемой задержки, параллельно уходит
+  второй такой же запрос, используется первый успешный ответ.
+
+Ошибки защиты - наследники httpx.RequestError: существующие обработчики
+ошибок соединения продолжают работать.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Dict, Optional
+
+import httpx
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+HEDGE_METHODS = ("GET", "HEAD")
+
+
+class BankUnavailableError(httpx.RequestError):
+    """Запрос к банку не отправлен защитой (банк считается недоступным)"""
+
+
+class CircuitOpenError(BankUnavailableError):
+    """Circuit breaker банка открыт"""
+
+
+class BulkheadFullError(BankUnavailableError):
+    """Все слоты банка заняты"""
+
+
+def _percentile(values, percentile: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(percentile / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class BankGuard:
+    """Состояние защиты одного банка (scheme://host[:port])"""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.state = CLOSED
+        self.opened_at: Optional[float] = None
+        self.in_flight = 0
+        self._bulkhead = asyncio.Semaphore(config.MULTIBANK_BULKHEAD_SIZE)
+        self._probes = 0
+        # (ошибка, медленный) по последним вызовам
+        self._outcomes: deque = deque(maxlen=config.MULTIBANK_BREAKER_WINDOW)
+        # Задержки успешных ответов - для перцентилей и hedging
+        self._latencies: deque = deque(maxlen=config.MULTIBANK_LATENCY_WINDOW)
+        self.stats = {
+            "requests": 0,
+            "failures": 0,
+            "rejected_open": 0,
+            "rejected_bulkhead": 0,
+            "hedges": 0,
+            "hedge_wins": 0,
+            "opened": 0
+        }
+
+    # === Circuit breaker ===
+
+    def _admit(self):
+        """Пропустить вызов или отклонить сразу (CircuitOpenError)"""
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < config.MULTIBANK_BREAKER_OPEN_SECONDS:
+                self.stats["rejected_open"] += 1
+                raise CircuitOpenError(f"Circuit open for {self.base_url}")
+            self.state = HALF_OPEN
+            self._probes = 0
+            logger.info(f"Circuit half-open for {self.base_url}")
+
+        if self.state == HALF_OPEN:
+            if self._probes >= config.MULTIBANK_BREAKER_HALF_OPEN_CALLS:
+                self.stats["rejected_open"] += 1
+                raise CircuitOpenError(f"Circuit half-open for {self.base_url}, probes in flight")
+            self._probes += 1
+
+    def _open(self, reason: str):
+        if self.state != OPEN:
+            self.stats["opened"] += 1
+            logger.warning(f"Circuit opened for {self.base_url}: {reason}")
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+
+    def _forget_probe(self):
+        # Пробный вызов не дошел до банка - слот пробы освобождается
+        if self.state == HALF_OPEN:
+            self._probes = max(0, self._probes - 1)
+
+    def _record(self, failed: bool, latency: float):
+        self.stats["requests"] += 1
+        if failed:
+            self.stats["failures"] += 1
+        else:
+            self._latencies.append(latency)
+
+        if self.state == HALF_OPEN:
+            self._probes = max(0, self._probes - 1)
+            if failed:
+                self._open("probe failed")
+            else:
+                self.state = CLOSED
+                self._outcomes.clear()
+                logger.info(f"Circuit closed for {self.base_url}")
+            return
+
+        slow = latency >= config.MULTIBANK_BREAKER_SLOW_CALL_SECONDS
+        self._outcomes.append((failed, slow))
+        if self.state != CLOSED or len(self._outcomes) < config.MULTIBANK_BREAKER_MIN_CALLS:
+            return
+
+        failure_rate, slow_rate = self.rates()
+        if failure_rate >= config.MULTIBANK_BREAKER_FAILURE_RATE:
+            self._open(f"failure rate {failure_rate:.0%}")
+        elif slow_rate >= config.MULTIBANK_BREAKER_SLOW_RATE:
+            self._open(f"slow call rate {slow_rate:.0%}")
+
+    def rates(self):
+        """(доля ошибок, доля медленных) в окне"""
+        total = len(self._outcomes)
+        if not total:
+            return 0.0, 0.0
+        return (
+            sum(1 for failed, _ in self._outcomes if failed) / total,
+            sum(1 for _, slow in self._outcomes if slow) / total
+        )
+
+    def latency(self, percentile: float) -> Optional[float]:
+        return _percentile(self._latencies, percentile)
+
+    # === Bulkhead ===
+
+    async def _acquire(self):
+        try:
+            await asyncio.wait_for(self._bulkhead.acquire(), timeout=config.MULTIBANK_BULKHEAD_WAIT_SECONDS)
+        except asyncio.TimeoutError:
+            self.stats["rejected_bulkhead"] += 1
+            raise BulkheadFullError(f"Too many concurrent requests to {self.base_url}")
+        self.in_flight += 1
+
+    def _release(self):
+        self.in_flight -= 1
+        self._bulkhead.release()
+
+    # === Вызовы ===
+
+    async def _attempt(self, transport: httpx.AsyncBaseTransport, request: httpx.Request) -> httpx.Response:
+        """Один запрос: слот bulkhead, учет результата в breaker"""
+        try:
+            await self._acquire()
+        except BaseException:
+            self._forget_probe()
+            raise
+        started = time.monotonic()
+        try:
+            response = await transport.handle_async_request(request)
+        except BaseException as e:
+            # Отмена (проигравший hedge, дедлайн вызывающего) - не ошибка банка
+            if isinstance(e, asyncio.CancelledError):
+                self._forget_probe()
+            else:
+                self._record(True, time.monotonic() - started)
+            raise
+        finally:
+            self._release()
+        self._record(response.status_code >= 500, time.monotonic() - started)
+        return response
+
+    def _hedge_delay(self, request: httpx.Request) -> Optional[float]:
+        if not config.MULTIBANK_HEDGE_ENABLED or request.method not in HEDGE_METHODS:
+            return None
+        if not request.extensions.get("hedge", True) or self.state != CLOSED:
+            return None
+        if len(self._latencies) < config.MULTIBANK_HEDGE_MIN_SAMPLES:
+            return None
+        if self.stats["hedges"] >= config.MULTIBANK_HEDGE_BUDGET * self.stats["requests"]:
+            return None
+        return max(config.MULTIBANK_HEDGE_MIN_DELAY, self.latency(config.MULTIBANK_HEDGE_PERCENTILE))
+
+    async def handle(self, transport: httpx.AsyncBaseTransport, request: httpx.Request) -> httpx.Response:
+        self._admit()
+        delay = self._hedge_delay(request)
+        if delay is None:
+            return await self._attempt(transport, request)
+
+        primary = asyncio.ensure_future(self._attempt(transport, request))
+        hedge = None
+        winner = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if not done and self.in_flight < config.MULTIBANK_BULKHEAD_SIZE:
+                # Первичный запрос дольше обычного - дублируем
+                self.stats["hedges"] += 1
+                hedge = asyncio.ensure_future(self._attempt(transport, request))
+                pending = {primary, hedge}
+                while pending and winner is None:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    winner = next((task for task in done if self._succeeded(task)), None)
+                if winner is hedge:
+                    self.stats["hedge_wins"] += 1
+            # Без дубля или обе попытки неудачны - результат первичной
+            winner = winner or primary
+            return await winner
+        finally:
+            await self._discard(task for task in (primary, hedge) if task is not None and task is not winner)
+
+    @staticmethod
+    def _succeeded(task: asyncio.Future) -> bool:
+        return task.exception() is None and task.result().status_code < 500
+
+    @staticmethod
+    async def _discard(tasks):
+        """Отменить проигравшую попытку или закрыть ее ответ"""
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled() and task.exception() is None:
+                await task.result().aclose()
+
+    def snapshot(self) -> dict:
+        failure_rate, slow_rate = self.rates()
+        return {
+            "bank_url": self.base_url,
+            "state": self.state,
+            "open_for_seconds": (
+                round(max(0.0, config.MULTIBANK_BREAKER_OPEN_SECONDS - (time.monotonic() - self.opened_at)), 1)
+                if self.state == OPEN else None
+            ),
+            "in_flight": self.in_flight,
+            "bulkhead_size": config.MULTIBANK_BULKHEAD_SIZE,
+            "window_calls": len(self._outcomes),
+            "failure_rate": round(failure_rate, 3),
+            "slow_rate": round(slow_rate, 3),
+            "latency_ms": {
+                name: (round(value * 1000, 1) if value is not None else None)
+                for name, value in (
+                    ("p50", self.latency(50)),
+                    ("p95", self.latency(95)),
+                    ("p99", self.latency(99))
+                )
+            },
+            **self.stats
+        }
+
+
+class GuardedTransport(httpx.AsyncBaseTransport):
+    """Транспорт httpx, пропускающий запросы через BankGuard"""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, guard: BankGuard):
+        self._transport = transport
+        self.guard = guard
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self.guard.handle(self._transport, request)
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+class BankGuardRegistry:
+    """BankGuard по базовому URL банка (переживает пересоздание клиентов пула)"""
+
+    def __init__(self):
+        self._guards: Dict[str, BankGuard] = {}
+
+    def get(self, base_url: str) -> BankGuard:
+        guard = self._guards.get(base_url)
+        if guard is None:
+            guard = BankGuard(base_url)
+            self._guards[base_url] = guard
+        return guard
+
+    def discard(self, base_url: str):
+        """Забыть банк (клиент вытеснен из пула)"""
+        self._guards.pop(base_url, None)
+
+    def wrap(self, base_url: str, transport: httpx.AsyncBaseTransport) -> GuardedTransport:
+        return GuardedTransport(transport, self.get(base_url))
+
+    def snapshot(self) -> list:
+        return [guard.snapshot() for guard in self._guards.values()]
+
+
+# Singleton instance
+bank_guards = BankGuardRegistry()
@@ -0,0 +1,106 @@
+"""
+Bank Token Cache - кэш банковских токенов для multibank proxy
+
+Токен песочницы банка (/auth/bank-token) живет сутки, поэтому хранится по
+bank_url и обновляется за BANK_TOKEN_REFRESH_MARGIN_SECONDS до истечения.
+Одновременные обновления для одного банка схлопываются в один удаленный
+запрос (single-flight): остальные вызовы ждут его результат.
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, Optional, Tuple
+
+from config import config
+from services.http_client_pool import http_pool
+
+logger = logging.getLogger(__name__)
+
+
+class BankTokenError(Exception):
+    """Банк не выдал токен (код и текст ответа удаленного банка)"""
+
+    def __init__(self, status_code: int, detail: str):
+        self.status_code = status_code
+        self.detail = detail
+        super().__init__(detail)
+
+
+class BankTokenCache:
+    """Токены других банков: bank_url -> (ответ /auth/bank-token, момент истечения)"""
+
+    def __init__(self):
+        self._tokens: Dict[str, Tuple[dict, float]] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    @staticmethod
+    def _key(bank_url: str) -> str:
+        return bank_url.rstrip("/").lower()
+
+    def _fresh(self, key: str) -> Optional[Tuple[dict, float]]:
+        entry = self._tokens.get(key)
+        if entry and entry[1] - time.monotonic() > config.BANK_TOKEN_REFRESH_MARGIN_SECONDS:
+            return entry
+        return None
+
+    async def get(self, bank_url: str, force_refresh: bool = False) -> dict:
+        """
+        Ответ /auth/bank-token для банка (expires_in - оставшееся время жизни)
+
+        Raises:
+            BankTokenError: банк ответил ошибкой
+            httpx.TimeoutException, httpx.RequestError: банк недоступен
+        """
+        key = self._key(bank_url)
+        entry = None if force_refresh else self._fresh(key)
+        if entry is None:
+            entry = await self._refresh(key, bank_url)
+
+        token_data, expires_at = entry
+        return {**token_data, "expires_in": max(0, int(expires_at - time.monotonic()))}
+
+    async def token(self, bank_url: str) -> str:
+        """Только access_token"""
+        return (await self.get(bank_url))["access_token"]
+
+    def invalidate(self, bank_url: str, token: Optional[str] = None):
+        """Забыть токен (например, банк ответил 401); token - только если это он"""
+        key = self._key(bank_url)
+        entry = self._tokens.get(key)
+        if entry and (token is None or entry[0].get("access_token") == token):
+            del self._tokens[key]
+
+    async def _refresh(self, key: str, bank_url: str) -> Tuple[dict, float]:
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._fetch(bank_url))
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # shield: отмена одного ожидающего не должна отменять общий запрос
+        entry = await asyncio.shield(future)
+        self._tokens[key] = entry
+        return entry
+
+    async def _fetch(self, bank_url: str) -> Tuple[dict, float]:
+        logger.info(f"Запрос банковского токена от {bank_url} используя TEAM_CLIENT_ID={config.TEAM_CLIENT_ID}")
+        client = http_pool.client_for(bank_url)
+        response = await client.post(
+            f"{bank_url.rstrip('/')}/auth/bank-token",
+            params={
+                "client_id": config.TEAM_CLIENT_ID,
+                "client_secret": config.TEAM_CLIENT_SECRET
+            },
+            headers={"accept": "application/json"}
+        )
+        if response.status_code != 200:
+            logger.error(f"Ошибка получения банковского токена от {bank_url}: {response.text}")
+            raise BankTokenError(response.status_code, f"Failed to get bank token: {response.text}")
+
+        token_data = response.json()
+        ttl = token_data.get("expires_in") or config.BANK_TOKEN_DEFAULT_TTL_SECONDS
+        logger.info(f"✅ Банковский токен получен от {bank_url} (expires_in={ttl})")
+        return token_data, time.monotonic() + float(ttl)
+
+
+# Singleton instance
+bank_token_cache = BankTokenCache()
@@ -0,0 +1,211 @@
+"""
+Capital Service - журнал изменений капитала банка
+
+Каждое изменение капитала (межбанковские переводы, кредиты, закрытие счетов)
+добавляется строкой в bank_capital_deltas в транзакции самой операции.
+INSERT-ы не конкурируют между собой, поэтому единственная строка bank_capital
+больше не сериализует платежи. Фоновая задача периодически сворачивает
+накопленные дельты в bank_capital; читатели получают base + pending.
+"""
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, Optional
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import config
+from database import AsyncSessionLocal
+from models import BankCapital, BankCapitalDelta
+
+logger = logging.getLogger(__name__)
+
+# Начальный капитал, если записи bank_capital еще нет
+DEFAULT_INITIAL_CAPITAL = Decimal("3500000.00")
+
+
+@dataclass
+class CapitalSnapshot:
+    """Капитал банка с учетом несвернутых дельт"""
+    bank_code: str
+    capital: Decimal
+    initial_capital: Decimal
+    total_deposits: Decimal
+    total_loans: Decimal
+    pending_deltas: int
+    updated_at: Optional[datetime]
+
+
+class CapitalLedger:
+    """Запись дельт капитала и их свертка в BankCapital"""
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def record(
+        db: AsyncSession,
+        capital_change: Decimal,
+        loans_change: Decimal = Decimal("0"),
+        reason: str = "",
+        bank_code: Optional[str] = None
+    ) -> BankCapitalDelta:
+        """Добавить изменение капитала в сессию (коммитит вызывающий код)"""
+        delta = BankCapitalDelta(
+            bank_code=bank_code or config.BANK_CODE,
+            capital_change=capital_change,
+            loans_change=loans_change,
+            reason=reason
+        )
+        db.add(delta)
+        return delta
+
+    @staticmethod
+    async def snapshots(db: AsyncSession) -> Dict[str, CapitalSnapshot]:
+        """
+        Капитал всех банков: base из bank_capital + сумма несвернутых дельт
+
+        Base и дельты читаются одним запросом (LEFT JOIN), чтобы свертка,
+        закоммиченная между двумя чтениями, не учлась дважды.
+        """
+        pending = (
+            select(
+                BankCapitalDelta.bank_code.label("bank_code"),
+                func.sum(BankCapitalDelta.capital_change).label("capital_change"),
+                func.sum(BankCapitalDelta.loans_change).label("loans_change"),
+                func.count(BankCapitalDelta.id).label("count"),
+                func.max(BankCapitalDelta.created_at).label("last_change")
+            )
+            .group_by(BankCapitalDelta.bank_code)
+            .subquery()
+        )
+        result = await db.execute(
+            select(BankCapital, pending.c.capital_change, pending.c.loans_change, pending.c.count, pending.c.last_change)
+            .outerjoin(pending, pending.c.bank_code == BankCapital.bank_code)
+        )
+        snapshots = {}
+        for cap, capital_change, loans_change, count, last_change in result.all():
+            snapshots[cap.bank_code] = CapitalSnapshot(
+                bank_code=cap.bank_code,
+                capital=cap.capital + Decimal(capital_change or 0),
+                initial_capital=cap.initial_capital,
+                total_deposits=cap.total_deposits or Decimal("0"),
+                total_loans=(cap.total_loans or Decimal("0")) + Decimal(loans_change or 0),
+                pending_deltas=count or 0,
+                updated_at=max(filter(None, [cap.updated_at, last_change]), default=None)
+            )
+
+        # Банк без записи bank_capital (еще не было ни одной свертки)
+        if config.BANK_CODE not in snapshots:
+            result = await db.execute(
+                select(pending.c.capital_change, pending.c.loans_change, pending.c.count, pending.c.last_change)
+                .where(pending.c.bank_code == config.BANK_CODE)
+            )
+            row = result.first()
+            if row:
+                capital_change, loans_change, count, last_change = row
+                snapshots[config.BANK_CODE] = CapitalSnapshot(
+                    bank_code=config.BANK_CODE,
+                    capital=DEFAULT_INITIAL_CAPITAL + Decimal(capital_change or 0),
+                    initial_capital=DEFAULT_INITIAL_CAPITAL,
+                    total_deposits=Decimal("0"),
+                    total_loans=Decimal(loans_change or 0),
+                    pending_deltas=count,
+                    updated_at=last_change
+                )
+        return snapshots
+
+    @staticmethod
+    async def effective(db: AsyncSession, bank_code: Optional[str] = None) -> Optional[CapitalSnapshot]:
+        """Капитал одного банка (по умолчанию своего) с учетом несвернутых дельт"""
+        return (await CapitalLedger.snapshots(db)).get(bank_code or config.BANK_CODE)
+
+    @staticmethod
+    async def fold(db: AsyncSession) -> int:
+        """
+        Свернуть накопленные дельты в bank_capital
+
+        Дельты удаляются через DELETE ... RETURNING и суммируются по
+        возвращенным строкам: дельта, закоммиченная во время свертки,
+        не будет удалена без учета и останется до следующего прохода.
+
+        Returns:
+            Количество свернутых дельт
+        """
+        result = await db.execute(
+            delete(BankCapitalDelta).returning(
+                BankCapitalDelta.bank_code,
+                BankCapitalDelta.capital_change,
+                BankCapitalDelta.loans_change
+            )
+        )
+        totals: Dict[str, list] = {}
+        folded = 0
+        for bank_code, capital_change, loans_change in result.all():
+            bank_totals = totals.setdefault(bank_code, [Decimal("0"), Decimal("0")])
+            bank_totals[0] += capital_change or Decimal("0")
+            bank_totals[1] += loans_change or Decimal("0")
+            folded += 1
+        if not folded:
+            await db.rollback()
+            return 0
+
+        for bank_code, (capital_change, loans_change) in totals.items():
+            result = await db.execute(
+                select(BankCapital).where(BankCapital.bank_code == bank_code).with_for_update()
+            )
+            capital_record = result.scalar_one_or_none()
+            if not capital_record:
+                capital_record = BankCapital(
+                    bank_code=bank_code,
+                    capital=DEFAULT_INITIAL_CAPITAL,
+                    initial_capital=DEFAULT_INITIAL_CAPITAL,
+                    total_deposits=Decimal("0"),
+                    total_loans=Decimal("0")
+                )
+                db.add(capital_record)
+            capital_record.capital += capital_change
+            capital_record.total_loans = (capital_record.total_loans or Decimal("0")) + loans_change
+            capital_record.updated_at = datetime.utcnow()
+
+        await db.commit()
+        return folded
+
+    async def _run(self):
+        while True:
+            try:
+                async with AsyncSessionLocal() as db:
+                    folded = await self.fold(db)
+                if folded:
+                    logger.debug(f"Folded {folded} capital deltas")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Capital fold failed: {str(e)}")
+            await asyncio.sleep(config.CAPITAL_FOLD_SECONDS)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Свернуть остаток, чтобы bank_capital был актуален после остановки
+        try:
+            async with AsyncSessionLocal() as db:
+                await self.fold(db)
+        except Exception as e:
+            logger.warning(f"Final capital fold failed: {str(e)}")
+
+
+# Singleton instance
+capital_ledger = CapitalLedger()
@@ -0,0 +1,230 @@
+"""
+Consent Jobs - ожидание подписания согласий в других банках (SBank)
+
+POST /multibank/request-consent больше не держит запрос до подписания:
+он регистрирует задание и сразу возвращает job_id. Один фоновый цикл
+проверяет все ожидающие согласия, у каждого - свой интервал, растущий
+от CONSENT_JOB_MIN_INTERVAL до CONSENT_JOB_MAX_INTERVAL. Клиенты ждут
+результат через long-poll или SSE (см. api/multibank_proxy.py); итог
+задания, созданного для подключения, записывается в bank_connections.
+"""
+import asyncio
+import logging
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+import httpx
+
+from config import config
+from services.bank_connection_service import BankConnectionService
+from services.http_client_pool import http_pool
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ("authorized", "rejected", "expired")
+
+
+@dataclass
+class ConsentJob:
+    """Ожидание подписания одного согласия"""
+    job_id: str
+    bank_url: str
+    bank_token: str
+    request_id: str
+    consent_response: dict
+    status: str = "pending"  # pending, authorized, rejected, expired
+    consent_id: Optional[str] = None
+    error: Optional[str] = None
+    checks: int = 0
+    created_at: float = field(default_factory=time.monotonic)
+    next_check_at: float = 0.0
+    interval: float = 0.0
+    finished_at: Optional[float] = None
+    connection_id: Optional[int] = None  # BankConnection, которому записать итог
+    changed: asyncio.Event = field(default_factory=asyncio.Event)
+
+    def to_dict(self) -> dict:
+        response = dict(self.consent_response)
+        if self.consent_id:
+            response["Data"] = {**response.get("Data", {}), "ConsentId": self.consent_id}
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "request_id": self.request_id,
+            "consent_id": self.consent_id,
+            "error": self.error,
+            "checks": self.checks,
+            "elapsed_seconds": round((self.finished_at or time.monotonic()) - self.created_at, 1),
+            "consent": response
+        }
+
+
+class ConsentJobPoller:
+    """Один цикл проверки для всех ожидающих согласий"""
+
+    def __init__(self):
+        self._jobs: Dict[str, ConsentJob] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self._saving: set = set()
+
+    def create(
+        self,
+        bank_url: str,
+        bank_token: str,
+        request_id: str,
+        consent_response: dict,
+        connection_id: Optional[int] = None
+    ) -> ConsentJob:
+        now = time.monotonic()
+        job = ConsentJob(
+            job_id=f"cjob-{uuid.uuid4().hex[:16]}",
+            bank_url=bank_url,
+            bank_token=bank_token,
+            request_id=request_id,
+            consent_response=consent_response,
+            interval=config.CONSENT_JOB_MIN_INTERVAL,
+            next_check_at=now + config.CONSENT_JOB_MIN_INTERVAL,
+            connection_id=connection_id
+        )
+        self._jobs[job.job_id] = job
+        self._wakeup.set()
+        logger.info(f"Consent job {job.job_id}: ожидаем подписания request_id={request_id} в {bank_url}")
+        return job
+
+    def get(self, job_id: str) -> Optional[ConsentJob]:
+        return self._jobs.get(job_id)
+
+    async def wait(self, job: ConsentJob, timeout: float) -> ConsentJob:
+        """Дождаться смены статуса (или таймаута) - для long-poll и SSE"""
+        if job.status in TERMINAL_STATUSES:
+            return job
+        try:
+            await asyncio.wait_for(job.changed.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        return job
+
+    def _finish(self, job: ConsentJob, status: str, consent_id: Optional[str] = None, error: Optional[str] = None):
+        job.status = status
+        job.consent_id = consent_id
+        job.error = error
+        job.finished_at = time.monotonic()
+        job.changed.set()
+        logger.info(f"Consent job {job.job_id}: {status}" + (f", consent_id={consent_id}" if consent_id else ""))
+        if job.connection_id is not None:
+            task = asyncio.create_task(self._save(job))
+            self._saving.add(task)
+            task.add_done_callback(self._saving.discard)
+
+    @staticmethod
+    async def _save(job: ConsentJob):
+        # Подключение к банку узнает итог, даже если клиент не ждет задание
+        try:
+            await BankConnectionService.attach_consent(job.connection_id, job.status, job.consent_id)
+        except Exception as e:
+            logger.warning(f"Consent job {job.job_id}: не удалось обновить подключение {job.connection_id}: {str(e)}")
+
+    async def _check(self, job: ConsentJob):
+        job.checks += 1
+        try:
+            client = http_pool.client_for(job.bank_url)
+            response = await client.get(
+                f"{job.bank_url}/account-consents/{job.request_id}",
+                headers={
+                    "Authorization": f"Bearer {job.bank_token}",
+                    "x-requesting-bank": config.TEAM_CLIENT_ID
+                },
+                timeout=config.CONSENT_JOB_CHECK_TIMEOUT
+            )
+            if response.status_code == 200:
+                data = response.json()
+                if not isinstance(data, dict):
+                    raise ValueError(f"unexpected JSON: {type(data).__name__}")
+                consent_id = (
+                    data.get("Data", {}).get("ConsentId") or
+                    data.get("consent_id") or
+                    data.get("ConsentId")
+                )
+                status = str(data.get("Data", {}).get("Status") or data.get("status") or "").lower()
+                if consent_id:
+                    self._finish(job, "authorized", consent_id=consent_id)
+                    return
+                if status in ("rejected", "revoked"):
+                    self._finish(job, "rejected", error=f"Consent {status}")
+                    return
+            elif response.status_code in (403, 404, 410):
+                self._finish(job, "rejected", error=f"Bank returned {response.status_code}")
+                return
+        except (httpx.TimeoutException, httpx.RequestError) as e:
+            logger.warning(f"Consent job {job.job_id}: ошибка проверки статуса: {e}")
+        except ValueError as e:
+            # Не JSON от банка - повторить позже (остальные задания проверяются как обычно)
+            logger.warning(f"Consent job {job.job_id}: некорректный ответ банка: {e}")
+
+        # Не подписано - следующая проверка реже
+        job.interval = min(job.interval * config.CONSENT_JOB_BACKOFF, config.CONSENT_JOB_MAX_INTERVAL)
+        job.next_check_at = time.monotonic() + job.interval
+
+    async def run_once(self) -> float:
+        """Проверить все ожидающие задания, у которых подошло время; вернуть паузу до следующего"""
+        now = time.monotonic()
+        due = []
+        for job in list(self._jobs.values()):
+            if job.status in TERMINAL_STATUSES:
+                if now - job.finished_at > config.CONSENT_JOB_RETENTION_SECONDS:
+                    del self._jobs[job.job_id]
+                continue
+            if now - job.created_at > config.CONSENT_JOB_TTL_SECONDS:
+                self._finish(job, "expired", error=f"Not signed within {config.CONSENT_JOB_TTL_SECONDS}s")
+            elif job.next_check_at <= now:
+                due.append(job)
+
+        if due:
+            results = await asyncio.gather(*(self._check(job) for job in due), return_exceptions=True)
+            for job, result in zip(due, results):
+                if isinstance(result, Exception):
+                    # Сбой одного задания не прерывает проход: проверить его позже
+                    logger.warning(f"Consent job {job.job_id}: проверка не удалась: {result!r}")
+                    job.next_check_at = time.monotonic() + job.interval
+
+        pending = [job.next_check_at for job in self._jobs.values() if job.status not in TERMINAL_STATUSES]
+        if not pending:
+            return config.CONSENT_JOB_MAX_INTERVAL
+        return max(0.0, min(pending) - time.monotonic())
+
+    async def _run(self):
+        while True:
+            try:
+                delay = await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Consent job poll failed: {str(e)}")
+                delay = config.CONSENT_JOB_MIN_INTERVAL
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# Singleton instance
+consent_jobs = ConsentJobPoller()
@@ -0,0 +1,191 @@
+"""
+Event Bus - события для клиентов (статусы платежей, балансы, уведомления)
+
+In-process pub/sub: у каждого подключения (SSE /events/stream) своя очередь
+ограниченного размера. События собираются из сессий SQLAlchemy при flush
+(новые Notification, смена Payment.status, изменение Account.balance) и
+публикуются только после успешного commit. Балансы, измененные условным
+UPDATE в PostingService, регистрируются через record_balance().
+"""
+import asyncio
+import itertools
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+
+from config import config
+from database import AsyncSessionLocal
+from models import Account, Notification, Payment
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY = "client_events"
+
+
+class Subscription:
+    """Очередь событий одного подключения"""
+
+    def __init__(self, client_id: int, maxsize: int):
+        self.client_id = client_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.overflowed = False
+
+    def offer(self, item: dict):
+        """Положить событие; при переполнении выбросить самое старое"""
+        if self.queue.full():
+            try:
+                self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+            # Клиент отстал - ему нужно перечитать состояние целиком
+            self.overflowed = True
+        self.queue.put_nowait(item)
+
+
+class EventBus:
+    """Рассылка событий подключенным клиентам"""
+
+    def __init__(self):
+        self._subscribers: Dict[int, Set[Subscription]] = {}
+        self._account_owners: Dict[int, int] = {}  # account_id -> client_id (не меняется)
+        self._ids = itertools.count(1)
+
+    @property
+    def active(self) -> bool:
+        return bool(self._subscribers)
+
+    def subscribe(self, client_id: int) -> Subscription:
+        subscription = Subscription(client_id, config.EVENT_STREAM_BUFFER)
+        self._subscribers.setdefault(client_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscriptions = self._subscribers.get(subscription.client_id)
+        if subscriptions:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscribers[subscription.client_id]
+
+    def publish(self, client_id: int, event_type: str, data: dict):
+        """Отправить событие всем подключениям клиента"""
+        for subscription in list(self._subscribers.get(client_id, ())):
+            subscription.offer({"id": next(self._ids), "event": event_type, "data": data})
+
+    async def dispatch(self, pending: List[dict]):
+        """Определить владельцев счетов и разослать события, собранные в транзакции"""
+        unknown = {
+            item["account_id"] for item in pending
+            if item.get("client_id") is None and item.get("account_id") not in self._account_owners
+        }
+        if unknown:
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(
+                    select(Account.id, Account.client_id).where(Account.id.in_(unknown))
+                )
+                self._account_owners.update(dict(result.all()))
+
+        for item in pending:
+            client_id = item.get("client_id") or self._account_owners.get(item.get("account_id"))
+            if client_id is not None:
+                self.publish(client_id, item["event"], item["data"])
+
+
+# Singleton instance
+event_bus = EventBus()
+
+
+# === Сбор событий из сессий ===
+
+def _pending(session: Session) -> List[dict]:
+    return session.info.setdefault(PENDING_KEY, [])
+
+
+def _iso(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() + "Z" if value else None
+
+
+def record_balance(db, account_id: int, balance=None, delta=None):
+    """
+    Зарегистрировать изменение баланса, сделанное в обход ORM (UPDATE ... RETURNING)
+
+    db - AsyncSession или Session; событие уйдет после commit.
+    """
+    if not event_bus.active:
+        return
+    session = getattr(db, "sync_session", db)
+    data = {"account_id": f"acc-{account_id}", "updated_at": _iso(datetime.utcnow())}
+    if balance is not None:
+        data["balance"] = str(balance)
+    if delta is not None:
+        data["delta"] = str(delta)
+    _pending(session).append({"event": "balance.changed", "account_id": account_id, "data": data})
+
+
+def _changed(obj, attr: str) -> bool:
+    return inspect(obj).attrs[attr].history.has_changes()
+
+
+@event.listens_for(Session, "after_flush")
+def _collect(session: Session, flush_context):
+    if not event_bus.active:
+        return
+    pending = _pending(session)
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Notification) and obj in session.new:
+            pending.append({
+                "event": "notification.created",
+                "client_id": obj.client_id,
+                "data": {
+                    "notification_id": obj.id,
+                    "type": obj.notification_type,
+                    "title": obj.title,
+                    "message": obj.message,
+                    "related_id": obj.related_id,
+                    "created_at": _iso(obj.created_at)
+                }
+            })
+        elif isinstance(obj, Payment) and (obj in session.new or _changed(obj, "status")):
+            pending.append({
+                "event": "payment.status",
+                "account_id": obj.account_id,
+                "data": {
+                    "payment_id": obj.payment_id,
+                    "status": obj.status,
+                    "amount": str(obj.amount),
+                    "destination_account": obj.destination_account,
+                    "status_update_date_time": _iso(obj.status_update_date_time)
+                }
+            })
+        elif isinstance(obj, Account) and obj not in session.new and _changed(obj, "balance"):
+            pending.append({
+                "event": "balance.changed",
+                "client_id": obj.client_id,
+                "data": {
+                    "account_id": f"acc-{obj.id}",
+                    "balance": str(obj.balance),
+                    "updated_at": _iso(datetime.utcnow())
+                }
+            })
+
+
+@event.listens_for(Session, "after_commit")
+def _publish(session: Session):
+    pending = session.info.pop(PENDING_KEY, None)
+    if not pending:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    task = loop.create_task(event_bus.dispatch(pending))
+    task.add_done_callback(
+        lambda t: t.cancelled() or not t.exception() or logger.warning(f"Event dispatch failed: {t.exception()}")
+    )
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard(session: Session):
+    session.info.pop(PENDING_KEY, None)
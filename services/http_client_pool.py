@@ -0,0 +1,116 @@
+"""
+HTTP Client Pool - общие исходящие HTTP клиенты для межбанковского трафика
+
+Один httpx.AsyncClient на удаленный банк (scheme://host:port): соединения
+keep-alive и TLS сессии переиспользуются между запросами вместо открытия
+нового клиента на каждый вызов. Пул открывается и закрывается в lifespan.
+Транспорт каждого клиента обернут в BankGuard (services/bank_guard.py).
+
+bank_url приходит в том числе из тел запросов multibank прокси, поэтому
+пул ограничен HTTP_POOL_MAX_CLIENTS: давно не использованный банк
+вытесняется, его клиент закрывается после HTTP_POOL_READ_TIMEOUT (чтобы
+дать завершиться начатым запросам), BankGuard удаляется.
+"""
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Dict
+from urllib.parse import urlsplit
+
+import httpx
+
+from config import config
+from services.bank_guard import bank_guards
+
+logger = logging.getLogger(__name__)
+
+try:
+    import h2  # noqa: F401  (нужен httpx для HTTP/2)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class HTTPClientPool:
+    """Реестр httpx.AsyncClient по базовому URL удаленного банка"""
+
+    def __init__(self):
+        self._clients: "OrderedDict[str, httpx.AsyncClient]" = OrderedDict()
+        self._closing: Dict[asyncio.Task, httpx.AsyncClient] = {}  # вытесненные, ждут закрытия
+
+    @staticmethod
+    def base_url(url: str) -> str:
+        """Ключ пула: scheme://host[:port]"""
+        parts = urlsplit(url)
+        if not parts.scheme or not parts.netloc:
+            raise ValueError(f"Invalid bank URL: {url}")
+        return f"{parts.scheme}://{parts.netloc}".lower()
+
+    def _create(self, base_url: str) -> httpx.AsyncClient:
+        # HTTP/2 согласуется через ALPN, поэтому включаем его только для https
+        http2 = HTTP2_AVAILABLE and config.HTTP_POOL_HTTP2 and base_url.startswith("https://")
+        logger.debug(f"Opening HTTP client for {base_url} (http2={http2})")
+        transport = httpx.AsyncHTTPTransport(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=config.HTTP_POOL_MAX_CONNECTIONS_PER_HOST,
+                max_keepalive_connections=config.HTTP_POOL_MAX_KEEPALIVE_PER_HOST,
+                keepalive_expiry=config.HTTP_POOL_KEEPALIVE_EXPIRY
+            )
+        )
+        return httpx.AsyncClient(
+            # bulkhead / circuit breaker / hedging - см. services/bank_guard.py
+            transport=bank_guards.wrap(base_url, transport),
+            timeout=httpx.Timeout(
+                config.HTTP_POOL_READ_TIMEOUT,
+                connect=config.HTTP_POOL_CONNECT_TIMEOUT
+            )
+        )
+
+    def client_for(self, url: str) -> httpx.AsyncClient:
+        """
+        Клиент для банка, которому принадлежит url
+
+        Клиент не закрывается вызывающим кодом (без `async with`):
+        таймаут конкретного запроса передается параметром `timeout=`.
+        """
+        key = self.base_url(url)
+        client = self._clients.get(key)
+        if client is None or client.is_closed:
+            client = self._create(key)
+            self._clients[key] = client
+        self._clients.move_to_end(key)
+        while len(self._clients) > config.HTTP_POOL_MAX_CLIENTS:
+            self._evict(*self._clients.popitem(last=False))
+        return client
+
+    def _evict(self, base_url: str, client: httpx.AsyncClient):
+        logger.debug(f"Evicting HTTP client for {base_url}")
+        bank_guards.discard(base_url)
+        task = asyncio.create_task(self._close_later(client))
+        self._closing[task] = client
+        task.add_done_callback(lambda done: self._closing.pop(done, None))
+
+    @staticmethod
+    async def _close_later(client: httpx.AsyncClient):
+        await asyncio.sleep(config.HTTP_POOL_READ_TIMEOUT)
+        try:
+            await client.aclose()
+        except Exception as e:
+            logger.debug(f"Failed to close HTTP client: {str(e)}")
+
+    async def aclose(self):
+        """Закрыть все клиенты (shutdown), в том числе вытесненные"""
+        closing, self._closing = self._closing, {}
+        for task in closing:
+            task.cancel()
+        clients, self._clients = self._clients, OrderedDict()
+        for client in list(clients.values()) + list(closing.values()):
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.debug(f"Failed to close HTTP client: {str(e)}")
+
+
+# Singleton instance
+http_pool = HTTPClientPool()
@@ -0,0 +1,163 @@
+"""
+Idempotency Service - повторные запросы с заголовком Idempotency-Key
+
+Запись ключа вместе с сохраненным ответом (status="completed") коммитится
+одной транзакцией с бизнес-операцией: обработчики только делают flush, а
+коммит выполняет execute. Повтор запроса либо дождется первого
+(уникальный индекс), либо получит сохраненный ответ без повторного
+выполнения операции. Запись "processing" в БД означает, что операция не
+завершилась (упал процесс), и через IDEMPOTENCY_PROCESSING_TIMEOUT_SECONDS
+ключ освобождается.
+"""
+import hashlib
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Optional
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import delete, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import config
+from models import IdempotencyRecord
+
+logger = logging.getLogger(__name__)
+
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+
+class IdempotencyService:
+    """Хранение ключей идемпотентности и повтор сохраненных ответов"""
+
+    @staticmethod
+    def fingerprint(payload: Any) -> str:
+        """sha256 канонического JSON тела запроса"""
+        canonical = json.dumps(jsonable_encoder(payload), sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    async def _find(db: AsyncSession, scope: str, caller: str, key: str) -> Optional[IdempotencyRecord]:
+        result = await db.execute(
+            select(IdempotencyRecord).where(
+                IdempotencyRecord.scope == scope,
+                IdempotencyRecord.caller == caller,
+                IdempotencyRecord.idempotency_key == key
+            )
+        )
+        return result.scalar_one_or_none()
+
+    @staticmethod
+    def _replay(record: IdempotencyRecord, fingerprint: str) -> JSONResponse:
+        """Ответ на повтор: сохраненный результат или ошибка"""
+        if record.request_fingerprint != fingerprint:
+            raise HTTPException(422, "Idempotency-Key was already used with a different request body")
+        if record.status != "completed":
+            raise HTTPException(
+                409, "A request with this Idempotency-Key is still being processed", headers={"Retry-After": "1"}
+            )
+        logger.info(f"Idempotent replay: {record.scope} {record.caller} {record.idempotency_key}")
+        return JSONResponse(
+            status_code=record.response_code,
+            content=json.loads(record.response_body) if record.response_body else None,
+            headers={REPLAYED_HEADER: "true"}
+        )
+
+    @staticmethod
+    def _expired(record: IdempotencyRecord) -> bool:
+        """Ключ можно использовать заново: ответ устарел или операция не завершилась"""
+        now = datetime.utcnow()
+        if record.status == "completed":
+            return record.created_at < now - timedelta(hours=config.IDEMPOTENCY_TTL_HOURS)
+        # "completed" пишется в одной транзакции с операцией, поэтому
+        # "processing" после таймаута - операция не была закоммичена
+        return record.created_at < now - timedelta(seconds=config.IDEMPOTENCY_PROCESSING_TIMEOUT_SECONDS)
+
+    @staticmethod
+    async def execute(
+        db: AsyncSession,
+        scope: str,
+        caller: str,
+        key: Optional[str],
+        payload: Any,
+        handler: Callable[[], Awaitable[Any]],
+        status_code: int = 200
+    ) -> Any:
+        """
+        Выполнить handler не более одного раза для (scope, caller, key)
+
+        handler не коммитит сессию (только flush): execute коммитит
+        операцию и сохраненный ответ одной транзакцией. Без ключа handler
+        выполняется и коммитится как обычно.
+
+        Returns:
+            Результат handler или JSONResponse с сохраненным ответом
+        """
+        if not key:
+            result = await handler()
+            await db.commit()
+            return result
+
+        fingerprint = IdempotencyService.fingerprint(payload)
+
+        existing = await IdempotencyService._find(db, scope, caller, key)
+        if existing and IdempotencyService._expired(existing):
+            await db.delete(existing)
+            await db.flush()
+            existing = None
+        if existing:
+            return IdempotencyService._replay(existing, fingerprint)
+
+        # Резерв ключа: при параллельном повторе второй INSERT дождется
+        # коммита первого и упадет на уникальном индексе
+        record = IdempotencyRecord(
+            scope=scope,
+            caller=caller,
+            idempotency_key=key,
+            request_fingerprint=fingerprint,
+            status="processing"
+        )
+        db.add(record)
+        try:
+            await db.flush()
+        except IntegrityError:
+            await db.rollback()
+            existing = await IdempotencyService._find(db, scope, caller, key)
+            if not existing:
+                raise HTTPException(
+                    409, "A request with this Idempotency-Key is still being processed", headers={"Retry-After": "1"}
+                )
+            return IdempotencyService._replay(existing, fingerprint)
+
+        try:
+            result = await handler()
+        except Exception:
+            # Операция не выполнена - освободить ключ, чтобы запрос можно было
+            # повторить (запись могла попасть в промежуточный коммит handler)
+            await db.rollback()
+            await db.execute(delete(IdempotencyRecord).where(
+                IdempotencyRecord.scope == scope,
+                IdempotencyRecord.caller == caller,
+                IdempotencyRecord.idempotency_key == key,
+                IdempotencyRecord.status == "processing"
+            ))
+            await db.commit()
+            raise
+
+        if isinstance(result, JSONResponse):
+            response_code, response_body = result.status_code, result.body.decode("utf-8")
+        else:
+            response_code = status_code
+            response_body = json.dumps(jsonable_encoder(result), ensure_ascii=False)
+
+        record.status = "completed"
+        record.response_code = response_code
+        record.response_body = response_body
+        record.completed_at = datetime.utcnow()
+        # Один коммит: операция и сохраненный ответ
+        await db.commit()
+
+        return result
@@ -0,0 +1,289 @@
+"""
+Interbank Dispatcher - фоновая отправка исходящих межбанковских переводов
+
+PaymentService записывает перевод в таблицу interbank_outbox в той же
+транзакции, что и списание со счета. Диспетчер забирает записи из outbox,
+отправляет их в банк-получатель (не больше OUTBOX_DISPATCH_CONCURRENCY
+одновременно), повторяет при сбоях с экспоненциальной задержкой и после
+окончательного результата вызывает подписчиков на смену статуса платежа.
+Деньги возвращаются только при явном отказе банка-получателя; если попытки
+исчерпаны, а результат неизвестен, запись остается в needs_review до сверки.
+
+В режиме netting (INTERBANK_NETTING_ENABLED) переводы становятся доступны
+для отправки через INTERBANK_NETTING_WINDOW_SECONDS после создания, и все
+накопленные за окно переводы в один банк уходят одним подписанным пакетом.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from sqlalchemy import or_, select
+
+from config import config
+from database import AsyncSessionLocal
+from models import InterbankOutbox, Payment
+
+logger = logging.getLogger(__name__)
+
+# Подписчик: (payment или None, outbox запись) после окончательного результата
+StatusCallback = Callable[[Optional[Payment], InterbankOutbox], Awaitable[None]]
+
+
+class InterbankDispatcher:
+    """Диспетчер outbox межбанковских переводов"""
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._in_flight: set = set()
+        self._callbacks: List[StatusCallback] = []
+
+    def add_status_callback(self, callback: StatusCallback):
+        """Подписаться на окончательный статус перевода (completed / failed)"""
+        self._callbacks.append(callback)
+
+    def notify(self):
+        """Разбудить диспетчер: в outbox появилась новая запись"""
+        self._wakeup.set()
+
+    @staticmethod
+    def first_attempt_at() -> datetime:
+        """next_attempt_at новой записи outbox (в режиме netting - после окна накопления)"""
+        if config.INTERBANK_NETTING_ENABLED:
+            return datetime.utcnow() + timedelta(seconds=config.INTERBANK_NETTING_WINDOW_SECONDS)
+        return datetime.utcnow()
+
+    @staticmethod
+    def backoff(attempts: int) -> float:
+        """Задержка перед следующей попыткой (секунды)"""
+        delay = config.OUTBOX_BACKOFF_BASE_SECONDS * (2 ** max(0, attempts - 1))
+        return min(delay, config.OUTBOX_BACKOFF_MAX_SECONDS)
+
+    async def claim_batch(self, limit: int) -> List[InterbankOutbox]:
+        """
+        Забрать записи, готовые к отправке
+
+        Запись помечается как sending, а next_attempt_at сдвигается на время
+        аренды: если процесс упадет во время отправки, запись будет взята
+        повторно после истечения аренды. SKIP LOCKED позволяет нескольким
+        экземплярам сервиса разбирать outbox параллельно.
+        """
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(InterbankOutbox)
+                .where(
+                    or_(InterbankOutbox.status == "pending", InterbankOutbox.status == "sending"),
+                    InterbankOutbox.next_attempt_at <= now
+                )
+                .order_by(InterbankOutbox.next_attempt_at)
+                .limit(limit)
+                .with_for_update(skip_locked=True)
+            )
+            rows = result.scalars().all()
+            for row in rows:
+                row.status = "sending"
+                row.attempts = (row.attempts or 0) + 1
+                row.next_attempt_at = now + timedelta(seconds=config.OUTBOX_LEASE_SECONDS)
+            await db.commit()
+            return rows
+
+    async def dispatch(self, claimed: InterbankOutbox):
+        """Отправить одну запись и записать результат"""
+        from services.payment_service import PaymentService
+
+        outcome, details = await PaymentService._send_interbank_transfer(
+            transfer_id=claimed.transfer_id,
+            to_bank=claimed.to_bank,
+            to_account_number=claimed.to_account_number,
+            amount=claimed.amount,
+            description=claimed.description or ""
+        )
+
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(InterbankOutbox).where(InterbankOutbox.id == claimed.id).with_for_update()
+            )
+            outbox = result.scalar_one_or_none()
+            # Запись уже обработана или перехвачена после истечения аренды
+            if not outbox or outbox.status != "sending" or outbox.attempts != claimed.attempts:
+                return
+
+            payment = None
+            if outcome == "completed":
+                payment = await PaymentService.complete_interbank_transfer(db, outbox)
+            elif outcome == "rejected":
+                payment = await PaymentService.fail_interbank_transfer(db, outbox, details)
+            elif outbox.attempts >= config.OUTBOX_MAX_ATTEMPTS:
+                PaymentService.park_interbank_transfer(outbox, details)
+                await db.commit()
+                return
+            else:
+                self._schedule_retry(outbox, details)
+                await db.commit()
+                return
+            await db.commit()
+
+        await self._fire_callbacks([(payment, outbox)])
+
+    async def dispatch_batch(self, to_bank: str, claimed: List[InterbankOutbox]):
+        """Отправить записи в один банк одним пакетом (netting) и записать результаты"""
+        from services.payment_service import PaymentService
+        from services.capital_service import capital_ledger
+
+        outcome, details, results = await PaymentService._send_interbank_batch(to_bank, claimed)
+        attempts = {row.id: row.attempts for row in claimed}
+
+        finished = []
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(InterbankOutbox)
+                .where(InterbankOutbox.id.in_(list(attempts)))
+                .order_by(InterbankOutbox.id)
+                .with_for_update()
+            )
+            rows = [
+                row for row in result.scalars().all()
+                if row.status == "sending" and row.attempts == attempts[row.id]
+            ]
+
+            sent_total = Decimal("0")
+            sent_count = 0
+            for outbox in rows:
+                if outcome in ("completed", "partial"):
+                    item = results.get(outbox.transfer_id, {})
+                    row_outcome = "completed" if item.get("status") in ("completed", "duplicate") else item.get("status", "retry")
+                    row_details = item.get("error") or "Missing in batch response"
+                else:
+                    row_outcome, row_details = outcome, details
+
+                if row_outcome == "completed":
+                    payment = await PaymentService.complete_interbank_transfer(db, outbox, record_capital=False)
+                    sent_total += outbox.amount
+                    sent_count += 1
+                    finished.append((payment, outbox))
+                elif row_outcome == "rejected":
+                    payment = await PaymentService.fail_interbank_transfer(db, outbox, row_details)
+                    finished.append((payment, outbox))
+                elif outbox.attempts >= config.OUTBOX_MAX_ATTEMPTS:
+                    PaymentService.park_interbank_transfer(outbox, row_details)
+                else:
+                    self._schedule_retry(outbox, row_details)
+
+            # Одно изменение капитала на весь пакет
+            if sent_total:
+                capital_ledger.record(
+                    db,
+                    capital_change=-sent_total,
+                    reason=f"Outgoing netting batch to {to_bank}: {sent_count} transfers"
+                )
+            await db.commit()
+
+        await self._fire_callbacks(finished)
+
+    def _schedule_retry(self, outbox: InterbankOutbox, details: str):
+        delay = self.backoff(outbox.attempts)
+        outbox.status = "pending"
+        outbox.last_error = details
+        outbox.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+        logger.info(
+            f"Interbank transfer {outbox.transfer_id} will be retried in {delay:.0f}s "
+            f"(attempt {outbox.attempts}/{config.OUTBOX_MAX_ATTEMPTS})"
+        )
+
+    async def _fire_callbacks(self, finished):
+        for payment, outbox in finished:
+            for callback in self._callbacks:
+                try:
+                    await callback(payment, outbox)
+                except Exception as e:
+                    logger.warning(f"Outbox status callback failed: {str(e)}")
+
+    async def _dispatch_guarded(self, claimed: InterbankOutbox):
+        try:
+            await self.dispatch(claimed)
+        except Exception as e:
+            # Запись останется в sending и будет повторена после истечения аренды
+            logger.error(f"Failed to dispatch interbank transfer {claimed.transfer_id}: {str(e)}")
+        finally:
+            self._semaphore.release()
+
+    async def _dispatch_batch_guarded(self, to_bank: str, claimed: List[InterbankOutbox]):
+        try:
+            await self.dispatch_batch(to_bank, claimed)
+        except Exception as e:
+            logger.error(f"Failed to dispatch interbank batch to {to_bank}: {str(e)}")
+        finally:
+            self._semaphore.release()
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+
+    async def run_once(self) -> int:
+        """Один проход: забрать свободные слоты и запустить отправки"""
+        free = config.OUTBOX_DISPATCH_CONCURRENCY - len(self._in_flight)
+        if free <= 0:
+            return 0
+
+        if config.INTERBANK_NETTING_ENABLED:
+            rows = await self.claim_batch(config.INTERBANK_NETTING_MAX_BATCH)
+            by_bank: Dict[str, List[InterbankOutbox]] = {}
+            for row in rows:
+                by_bank.setdefault(row.to_bank, []).append(row)
+            for to_bank, bank_rows in by_bank.items():
+                await self._semaphore.acquire()
+                self._spawn(self._dispatch_batch_guarded(to_bank, bank_rows))
+            return len(rows)
+
+        rows = await self.claim_batch(min(free, config.OUTBOX_BATCH_SIZE))
+        for row in rows:
+            await self._semaphore.acquire()
+            self._spawn(self._dispatch_guarded(row))
+        return len(rows)
+
+    async def _run(self):
+        while True:
+            try:
+                claimed = await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Interbank outbox poll failed: {str(e)}")
+                claimed = 0
+
+            # Полная пачка - сразу следующий проход, иначе ждем новую запись или таймер
+            full = config.INTERBANK_NETTING_MAX_BATCH if config.INTERBANK_NETTING_ENABLED else config.OUTBOX_BATCH_SIZE
+            if claimed and claimed >= full:
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=config.OUTBOX_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if self._task is None:
+            self._semaphore = asyncio.Semaphore(config.OUTBOX_DISPATCH_CONCURRENCY)
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Дождаться уже начатых отправок, чтобы не оставлять их до истечения аренды
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+
+
+# Singleton instance
+interbank_dispatcher = InterbankDispatcher()
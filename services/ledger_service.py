@@ -0,0 +1,94 @@
+"""
+Ledger Service - остатки по счету на момент времени
+
+Записи ledger_entries дописывает PostingService; у каждой есть остаток после
+проводки, поэтому остаток на дату - одна выборка по индексу
+(account_id, posted_at, sequence), без суммирования истории.
+"""
+import logging
+from datetime import datetime
+from decimal import Decimal
+from typing import Optional
+
+from sqlalchemy import case, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Account, LedgerEntry
+
+logger = logging.getLogger(__name__)
+
+
+class LedgerService:
+    """Сервис выписок по ledger_entries"""
+
+    @staticmethod
+    async def balance_at(db: AsyncSession, account: Account, at: datetime) -> Decimal:
+        """
+        Остаток счета на момент at (включительно)
+
+        Для счетов, открытых до появления ledger_entries, остаток до первой
+        записи восстанавливается из нее (balance_after - amount).
+        """
+        result = await db.execute(
+            select(LedgerEntry.balance_after)
+            .where(LedgerEntry.account_id == account.id, LedgerEntry.posted_at <= at)
+            .order_by(LedgerEntry.posted_at.desc(), LedgerEntry.sequence.desc())
+            .limit(1)
+        )
+        balance = result.scalar_one_or_none()
+        if balance is not None:
+            return balance
+
+        if account.opened_at and at < account.opened_at:
+            return Decimal("0")
+        return await LedgerService.initial_balance(db, account)
+
+    @staticmethod
+    async def initial_balance(db: AsyncSession, account: Account) -> Decimal:
+        """Остаток до первой записи в ledger_entries (начальный баланс при открытии)"""
+        result = await db.execute(
+            select(LedgerEntry.balance_after, LedgerEntry.amount)
+            .where(LedgerEntry.account_id == account.id)
+            .order_by(LedgerEntry.posted_at, LedgerEntry.sequence)
+            .limit(1)
+        )
+        first = result.one_or_none()
+        if first is None:
+            # Проводок не было - остаток не менялся
+            return account.balance or Decimal("0")
+        return first.balance_after - first.amount
+
+    @staticmethod
+    async def statement(
+        db: AsyncSession,
+        account: Account,
+        from_date: Optional[datetime],
+        to_date: Optional[datetime]
+    ) -> dict:
+        """Входящий/исходящий остаток и обороты за период [from_date, to_date]"""
+        to_date = to_date or datetime.utcnow()
+        if from_date and from_date > to_date:
+            raise ValueError("from_booking_date_time must not be after to_booking_date_time")
+
+        if from_date:
+            opening = await LedgerService.balance_at(db, account, from_date)
+        else:
+            opening = await LedgerService.initial_balance(db, account)
+        closing = await LedgerService.balance_at(db, account, to_date)
+
+        query = select(
+            func.coalesce(func.sum(case((LedgerEntry.amount > 0, LedgerEntry.amount), else_=0)), 0),
+            func.coalesce(func.sum(case((LedgerEntry.amount < 0, -LedgerEntry.amount), else_=0)), 0),
+            func.count(LedgerEntry.id)
+        ).where(LedgerEntry.account_id == account.id, LedgerEntry.posted_at <= to_date)
+        if from_date:
+            query = query.where(LedgerEntry.posted_at > from_date)
+        credits, debits, count = (await db.execute(query)).one()
+
+        return {
+            "opening_balance": opening,
+            "closing_balance": closing,
+            "total_credits": Decimal(credits),
+            "total_debits": Decimal(debits),
+            "entries_count": count
+        }
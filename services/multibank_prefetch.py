@@ -0,0 +1,177 @@
+"""
+Multibank Prefetch - прогрев данных других банков для активных клиентов
+
+Клиент, который недавно вошел или обращался к /multibank/connections,
+считается активным MULTIBANK_PREFETCH_ACTIVE_MINUTES. Фоновый цикл
+выбирает подключения активных клиентов с подписанным согласием, которые
+не обновлялись дольше MULTIBANK_PREFETCH_REFRESH_SECONDS, и читает счета,
+балансы и первую страницу транзакций через remote_cache - с теми же
+ключами, что дашборд. Первый дашборд после входа отдается из кэша.
+
+Запросы к одному банку идут не чаще MULTIBANK_PREFETCH_BANK_RATE в
+секунду (разные банки - параллельно), поэтому прогрев не съедает
+bulkhead банка у пользовательских запросов.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+import httpx
+from sqlalchemy import or_, select
+
+from config import config
+from database import AsyncSessionLocal
+from models import BankConnection
+from services.bank_connection_service import BankConnectionService
+from services.bank_token_cache import BankTokenError
+from services.http_client_pool import http_pool
+from services.multibank_service import MultibankService, RemoteBankError
+
+logger = logging.getLogger(__name__)
+
+
+class MultibankPrefetcher:
+    """Фоновый прогрев кэша чтений по подключениям активных клиентов"""
+
+    def __init__(self):
+        self._active: Dict[int, float] = {}  # clients.id -> время последней активности
+        self._next_slot: Dict[str, float] = {}  # банк -> время следующего разрешенного запроса
+        self._retry_at: Dict[int, float] = {}  # bank_connections.id -> не раньше (после ошибки)
+        self._task = None
+        self._wakeup = None
+        self.stats = {"passes": 0, "connections": 0, "requests": 0, "failures": 0}
+
+    def touch(self, client_id: int):
+        """Клиент активен: его подключения прогреваются (после входа - сразу)"""
+        is_new = client_id not in self._active
+        self._active[client_id] = time.monotonic()
+        if is_new and self._wakeup is not None:
+            self._wakeup.set()
+
+    def _active_clients(self) -> List[int]:
+        cutoff = time.monotonic() - config.MULTIBANK_PREFETCH_ACTIVE_MINUTES * 60
+        for client_id in [c for c, seen in self._active.items() if seen < cutoff]:
+            del self._active[client_id]
+        return list(self._active)
+
+    async def _pace(self, base_url: str):
+        """Дождаться слота банка (не больше MULTIBANK_PREFETCH_BANK_RATE запросов в секунду)"""
+        now = time.monotonic()
+        slot = max(now, self._next_slot.get(base_url, 0.0))
+        self._next_slot[base_url] = slot + 1.0 / config.MULTIBANK_PREFETCH_BANK_RATE
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def _read(self, connection: BankConnection, token: str, path: str, params: dict = None) -> dict:
+        await self._pace(connection.bank_url)
+        self.stats["requests"] += 1
+        data, _ = await MultibankService.read(
+            connection.bank_url, path, token, connection.consent_id, connection.remote_client_id,
+            params=params, timeout=config.MULTIBANK_PREFETCH_TIMEOUT
+        )
+        return data
+
+    async def _prefetch(self, connection: BankConnection) -> bool:
+        """Прочитать счета, балансы и транзакции подключения (как дашборд)"""
+        try:
+            token = await BankConnectionService.token(connection)
+            client_params = {"client_id": connection.remote_client_id}
+            accounts_data = await self._read(connection, token, "/accounts", client_params)
+            accounts = accounts_data.get("data", {}).get("account", [])[:config.MULTIBANK_PREFETCH_MAX_ACCOUNTS]
+
+            reads = []
+            for account in accounts:
+                account_id = account.get("accountId")
+                if account_id:
+                    reads.append(self._read(connection, token, f"/accounts/{account_id}/balances"))
+                    reads.append(self._read(connection, token, f"/accounts/{account_id}/transactions"))
+            for result in await asyncio.gather(*reads, return_exceptions=True):
+                if isinstance(result, Exception):
+                    raise result
+        except RemoteBankError as e:
+            if e.status_code == 401:
+                BankConnectionService.forget_token(connection)
+            logger.info(f"Prefetch {connection.bank_url} (connection {connection.id}): {e.status_code} {e.detail}")
+        except (BankTokenError, httpx.HTTPError) as e:
+            logger.info(f"Prefetch {connection.bank_url} (connection {connection.id}): нет токена банка: {str(e)}")
+        else:
+            self._retry_at.pop(connection.id, None)
+            connection.last_synced_at = datetime.utcnow()
+            return True
+
+        # Банк с ошибкой не опрашивается каждый проход
+        self._retry_at[connection.id] = time.monotonic() + config.MULTIBANK_PREFETCH_REFRESH_SECONDS
+        return False
+
+    async def run_once(self) -> int:
+        """Один проход: прогреть устаревшие подключения активных клиентов"""
+        clients = self._active_clients()
+        if not clients or not config.REMOTE_CACHE_ENABLED:
+            return 0
+
+        refresh_before = datetime.utcnow() - timedelta(seconds=config.MULTIBANK_PREFETCH_REFRESH_SECONDS)
+        async with AsyncSessionLocal() as db:
+            # idx_bank_connections_status_synced: (consent_status, last_synced_at)
+            result = await db.execute(
+                select(BankConnection)
+                .where(
+                    BankConnection.consent_status == "authorized",
+                    BankConnection.consent_id.isnot(None),
+                    or_(BankConnection.last_synced_at.is_(None), BankConnection.last_synced_at < refresh_before),
+                    BankConnection.client_id.in_(clients)
+                )
+                .order_by(BankConnection.last_synced_at.asc().nulls_first())
+                .limit(config.MULTIBANK_PREFETCH_MAX_CONNECTIONS)
+            )
+            now = time.monotonic()
+            self._retry_at = {c: at for c, at in self._retry_at.items() if at > now}
+            connections = [c for c in result.scalars().all() if c.id not in self._retry_at]
+            if not connections:
+                return 0
+            await db.commit()  # Транзакция не держится на время запросов к банкам
+
+            # Банки - параллельно; запросы к одному банку разнесены _pace
+            warmed = sum(await asyncio.gather(*(self._prefetch(c) for c in connections)))
+            await db.commit()
+
+        self.stats["passes"] += 1
+        self.stats["connections"] += warmed
+        self.stats["failures"] += len(connections) - warmed
+        banks = len({http_pool.base_url(c.bank_url) for c in connections})
+        logger.info(f"Prefetch: прогрето {warmed}/{len(connections)} подключений в {banks} банках")
+        return warmed
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Multibank prefetch failed: {str(e)}")
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=config.MULTIBANK_PREFETCH_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if self._task is None and config.MULTIBANK_PREFETCH_ENABLED:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# Singleton instance
+multibank_prefetch = MultibankPrefetcher()
@@ -0,0 +1,303 @@
+"""
+Multibank Service - чтение данных клиента из других банков по согласию
+
+Агрегация для дашборда: все банки опрашиваются параллельно, внутри банка
+счета и карты - параллельно, затем балансы и транзакции всех счетов -
+параллельно. У каждого банка свой дедлайн; банк, который не успел или
+ответил ошибкой, не ломает ответ - в нем будет статус по каждому банку и
+все, что удалось получить.
+
+Чтения идут через remote_cache (stale-while-revalidate, single-flight).
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from config import config
+from services.bank_guard import BankUnavailableError
+from services.bank_token_cache import BankTokenError, bank_token_cache
+from services.http_client_pool import http_pool
+from services.remote_cache import remote_cache
+
+logger = logging.getLogger(__name__)
+
+RESOURCES = ("accounts", "balances", "cards", "transactions")
+
+# Заголовки ответа банка для режима passthrough (без hop-by-hop, длины и
+# кодирования: тело отдается уже распакованным и другими кусками)
+PASSTHROUGH_HEADERS = ("content-type", "etag", "last-modified", "cache-control")
+
+
+class RemoteBankError(Exception):
+    """Удаленный банк ответил ошибкой или недоступен"""
+
+    def __init__(self, status_code: int, detail: str):
+        self.status_code = status_code
+        self.detail = detail
+        super().__init__(detail)
+
+
+class MultibankService:
+    """Запросы к другим банкам от имени команды"""
+
+    @staticmethod
+    def _headers(bank_token: str, consent_id: Optional[str] = None, interbank: bool = True) -> dict:
+        headers = {
+            "accept": "application/json",
+            "Authorization": f"Bearer {bank_token}"
+        }
+        if interbank:
+            headers["x-requesting-bank"] = config.TEAM_CLIENT_ID
+        if consent_id:
+            headers["x-consent-id"] = consent_id
+        return headers
+
+    @staticmethod
+    async def open_stream(
+        bank_url: str,
+        path: str,
+        bank_token: str,
+        consent_id: Optional[str] = None,
+        params: Optional[dict] = None,
+        timeout: Optional[float] = None,
+        interbank: bool = True
+    ) -> httpx.Response:
+        """
+        GET к банку без чтения тела: ответ 200, тело читает вызывающий
+
+        Вызывающий обязан закрыть ответ (aclose). interbank=False - без
+        x-requesting-bank (устаревшие прямые прокси с токеном клиента).
+
+        Raises:
+            RemoteBankError: не 200, таймаут, ошибка соединения или банк
+                отключен защитой (503, см. services/bank_guard.py)
+        """
+        client = http_pool.client_for(bank_url)
+        request = client.build_request(
+            "GET",
+            f"{bank_url.rstrip('/')}{path}",
+            headers=MultibankService._headers(bank_token, consent_id, interbank),
+            params=params,
+            timeout=timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT
+        )
+        try:
+            response = await client.send(request, stream=True)
+        except BankUnavailableError as e:
+            raise RemoteBankError(503, str(e))
+        except httpx.TimeoutException:
+            raise RemoteBankError(504, "Bank server timeout")
+        except httpx.RequestError as e:
+            raise RemoteBankError(502, f"Connection error: {str(e)}")
+
+        if response.status_code != 200:
+            try:
+                await response.aread()
+            except httpx.HTTPError:
+                pass
+            finally:
+                await response.aclose()
+            if response.status_code == 401:
+                bank_token_cache.invalidate(bank_url, bank_token)
+            raise RemoteBankError(response.status_code, response.text[:500])
+        return response
+
+    @staticmethod
+    def passthrough_headers(response: httpx.Response) -> dict:
+        """Заголовки ответа банка, которые можно отдать клиенту как есть"""
+        return {name: response.headers[name] for name in PASSTHROUGH_HEADERS if name in response.headers}
+
+    @staticmethod
+    async def get_json(
+        bank_url: str,
+        path: str,
+        bank_token: str,
+        consent_id: Optional[str] = None,
+        params: Optional[dict] = None,
+        timeout: Optional[float] = None
+    ) -> dict:
+        """
+        GET к банку с x-consent-id / x-requesting-bank, разобранный JSON
+
+        Raises:
+            RemoteBankError: как open_stream
+        """
+        response = await MultibankService.open_stream(bank_url, path, bank_token, consent_id, params, timeout)
+        try:
+            await response.aread()
+        except httpx.TimeoutException:
+            raise RemoteBankError(504, "Bank server timeout")
+        except httpx.RequestError as e:
+            raise RemoteBankError(502, f"Connection error: {str(e)}")
+        finally:
+            await response.aclose()
+        return response.json()
+
+    @staticmethod
+    async def read(
+        bank_url: str,
+        path: str,
+        bank_token: str,
+        consent_id: Optional[str],
+        client_id: Optional[str] = None,
+        params: Optional[dict] = None,
+        timeout: Optional[float] = None,
+        bypass: bool = False
+    ) -> Tuple[dict, str]:
+        """
+        get_json через кэш: (данные, HIT / STALE / MISS / BYPASS)
+
+        Ключ - (банк, клиент, согласие, ресурс); токен в ключ не входит.
+        """
+        key = (
+            http_pool.base_url(bank_url), client_id, consent_id, path,
+            tuple(sorted((params or {}).items()))
+        )
+        return await remote_cache.get(
+            key,
+            lambda: MultibankService.get_json(bank_url, path, bank_token, consent_id, params=params, timeout=timeout),
+            bypass=bypass
+        )
+
+    @staticmethod
+    def wants_bypass(cache_control: Optional[str], x_cache_bypass: Optional[str]) -> bool:
+        """Cache-Control: no-cache / max-age=0 или X-Cache-Bypass: 1"""
+        if x_cache_bypass and x_cache_bypass.strip().lower() in ("1", "true", "yes"):
+            return True
+        directives = {part.strip().lower() for part in (cache_control or "").split(",")}
+        return bool(directives & {"no-cache", "no-store", "max-age=0"})
+
+    @staticmethod
+    def _cards(cards_data) -> list:
+        # Банки отдают карты в разных форматах (см. /multibank/cards-with-consent)
+        if isinstance(cards_data, list):
+            return cards_data
+        if "data" not in cards_data:
+            return [cards_data] if cards_data else []
+        return cards_data["data"].get("card", [])
+
+    @staticmethod
+    async def _collect_bank(bank: dict, include: set, result: dict, deadline: float, bypass: bool = False):
+        """Заполнять result по мере ответов банка (при дедлайне останется то, что успели)"""
+
+        def remaining() -> float:
+            return max(0.1, deadline - time.monotonic())
+
+        bank_url = bank["bank_url"]
+        token = bank.get("bank_token")
+        if not token:
+            try:
+                token = await bank_token_cache.token(bank_url)
+            except BankTokenError as e:
+                raise RemoteBankError(e.status_code, e.detail)
+            except httpx.TimeoutException:
+                raise RemoteBankError(504, "Bank server timeout")
+            except httpx.RequestError as e:
+                raise RemoteBankError(502, f"Connection error: {str(e)}")
+
+        async def fetch(resource: str, path: str, params: Optional[dict] = None):
+            try:
+                data, _ = await MultibankService.read(
+                    bank_url, path, token, bank["consent_id"], bank["client_id"],
+                    params=params, timeout=remaining(), bypass=bypass
+                )
+                return data
+            except RemoteBankError as e:
+                result["errors"].append({"resource": resource, "path": path, "status": e.status_code, "detail": e.detail})
+                return None
+
+        client_params = {"client_id": bank["client_id"]}
+        first = [fetch("accounts", "/accounts", client_params)]
+        if "cards" in include:
+            first.append(fetch("cards", "/cards", client_params))
+        accounts_data, *rest = await asyncio.gather(*first)
+
+        if rest and rest[0] is not None:
+            result["cards"] = MultibankService._cards(rest[0])
+        if accounts_data is None:
+            return
+
+        accounts = accounts_data.get("data", {}).get("account", [])
+        result["accounts"] = accounts
+
+        # Балансы и транзакции всех счетов - одной волной
+        calls = []
+        for account in accounts:
+            account_id = account.get("accountId")
+            if not account_id:
+                continue
+            if "balances" in include:
+                calls.append((account, "balance", fetch("balances", f"/accounts/{account_id}/balances")))
+            if "transactions" in include:
+                calls.append((account, "transaction", fetch("transactions", f"/accounts/{account_id}/transactions")))
+
+        async def attach(account: dict, key: str, call):
+            data = await call
+            if data is not None:
+                account[key] = data.get("data", {}).get(key, [])
+
+        await asyncio.gather(*(attach(account, key, call) for account, key, call in calls))
+
+    @staticmethod
+    async def _aggregate_bank(bank: dict, include: set, deadline_seconds: float, bypass: bool = False) -> dict:
+        started = time.monotonic()
+        result = {
+            "bank_url": bank["bank_url"],
+            "client_id": bank["client_id"],
+            "status": "ok",
+            "accounts": [],
+            "errors": []
+        }
+        if "cards" in include:
+            result["cards"] = []
+
+        try:
+            await asyncio.wait_for(
+                MultibankService._collect_bank(bank, include, result, started + deadline_seconds, bypass),
+                timeout=deadline_seconds
+            )
+            if result["errors"]:
+                result["status"] = "partial" if result["accounts"] or result.get("cards") else "error"
+        except asyncio.TimeoutError:
+            result["status"] = "timeout"
+            result["errors"].append({"resource": "bank", "status": 504, "detail": f"Deadline {deadline_seconds}s exceeded"})
+        except RemoteBankError as e:
+            result["status"] = "error"
+            result["errors"].append({"resource": "bank-token", "status": e.status_code, "detail": e.detail})
+
+        result["elapsed_ms"] = int((time.monotonic() - started) * 1000)
+        return result
+
+    @staticmethod
+    async def aggregate(
+        banks: List[dict],
+        include: Optional[set] = None,
+        deadline_seconds: Optional[float] = None,
+        bypass: bool = False
+    ) -> Dict:
+        """
+        Данные клиента из всех банков одним вызовом
+
+        banks: [{"bank_url", "consent_id", "client_id", "bank_token"?}, ...]
+        include: подмножество RESOURCES (accounts запрашиваются всегда)
+        """
+        include = set(include or RESOURCES)
+        deadline_seconds = deadline_seconds or config.MULTIBANK_BANK_DEADLINE_SECONDS
+        started = time.monotonic()
+
+        results = await asyncio.gather(*(
+            MultibankService._aggregate_bank(bank, include, deadline_seconds, bypass) for bank in banks
+        ))
+
+        return {
+            "data": {"banks": results},
+            "meta": {
+                "elapsed_ms": int((time.monotonic() - started) * 1000),
+                "banks_total": len(results),
+                "banks_ok": sum(1 for r in results if r["status"] == "ok"),
+                "banks_partial": sum(1 for r in results if r["status"] == "partial"),
+                "banks_failed": sum(1 for r in results if r["status"] in ("error", "timeout"))
+            }
+        }
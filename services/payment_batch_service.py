@@ -0,0 +1,385 @@
+"""
+Payment Batch Service - пакетные платежи (зарплатные ведомости и т.п.)
+
+Пакет принимается целиком (JSON или CSV), строки валидируются и сохраняются
+одним INSERT. Обработка идет в фоне порциями по PAYMENT_BATCH_CHUNK_SIZE строк:
+на порцию - одно условное списание со счета-отправителя, зачисления на
+счета банка одним executemany и массовые INSERT платежей и транзакций.
+Межбанковские строки ставятся в outbox и отправляются InterbankDispatcher.
+"""
+import asyncio
+import csv
+import io
+import logging
+import uuid
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import config
+from database import AsyncSessionLocal
+from models import (
+    Account, Payment, PaymentBatch, PaymentBatchItem, Transaction,
+    InterbankTransfer, InterbankOutbox
+)
+from services.interbank_dispatcher import interbank_dispatcher
+from services.posting_service import PostingService, InsufficientFundsError
+
+logger = logging.getLogger(__name__)
+
+CSV_COLUMNS = ("creditor_account", "amount", "description", "reference")
+
+
+class PaymentBatchService:
+    """Прием и обработка пакетов платежей"""
+
+    @staticmethod
+    def parse_csv(content: bytes) -> List[dict]:
+        """
+        Разобрать CSV: заголовок creditor_account,amount[,description][,reference]
+
+        Разделитель (`,` или `;`) определяется автоматически.
+        """
+        text = content.decode("utf-8-sig")
+        try:
+            dialect = csv.Sniffer().sniff(text[:4096], delimiters=",;")
+        except csv.Error:
+            dialect = csv.excel
+        reader = csv.DictReader(io.StringIO(text), dialect=dialect)
+        if not reader.fieldnames or not {"creditor_account", "amount"} <= {f.strip() for f in reader.fieldnames}:
+            raise ValueError("CSV header must contain creditor_account and amount columns")
+        return [
+            {key.strip(): (value or "").strip() for key, value in row.items() if key and key.strip() in CSV_COLUMNS}
+            for row in reader
+        ]
+
+    @staticmethod
+    def validate_item(raw: dict, debtor_account_number: str) -> Tuple[Optional[Decimal], Optional[str]]:
+        """Returns: (сумма, None) или (None, текст ошибки)"""
+        creditor = str(raw.get("creditor_account") or "").strip()
+        if not creditor:
+            return None, "creditor_account is required"
+        if creditor == debtor_account_number:
+            return None, "Cannot transfer to the same account"
+        try:
+            amount = Decimal(str(raw.get("amount")).strip())
+        except (InvalidOperation, ValueError):
+            return None, "Invalid amount format"
+        if not amount.is_finite() or amount <= 0:
+            return None, "Amount must be greater than 0"
+        if amount != amount.quantize(Decimal("0.01")):
+            return None, "Amount must have at most 2 decimal places"
+        return amount, None
+
+    @staticmethod
+    async def create_batch(
+        db: AsyncSession,
+        client_id: int,
+        debtor_account: Account,
+        raw_items: List[dict],
+        source: str = "json"
+    ) -> PaymentBatch:
+        """
+        Сохранить пакет и его строки (невалидные строки сразу отклоняются)
+
+        Коммит выполняет вызывающий код.
+        """
+        if not raw_items:
+            raise ValueError("Batch is empty")
+        if len(raw_items) > config.PAYMENT_BATCH_MAX_ITEMS:
+            raise ValueError(f"Batch is too large: {len(raw_items)} items, max {config.PAYMENT_BATCH_MAX_ITEMS}")
+
+        batch_id = f"batch-{uuid.uuid4().hex[:12]}"
+        now = datetime.utcnow()
+        rows = []
+        total_amount = Decimal("0")
+        rejected = 0
+        for line_number, raw in enumerate(raw_items, start=1):
+            amount, error = PaymentBatchService.validate_item(raw, debtor_account.account_number)
+            if error:
+                rejected += 1
+            else:
+                total_amount += amount
+            rows.append({
+                "batch_id": batch_id,
+                "line_number": line_number,
+                "creditor_account": str(raw.get("creditor_account") or "").strip()[:255] or None,
+                "amount": amount,
+                "description": raw.get("description") or None,
+                "reference": (str(raw["reference"])[:100] if raw.get("reference") else None),
+                "status": "rejected" if error else "pending",
+                "error": error,
+                "processed_at": now if error else None
+            })
+
+        batch = PaymentBatch(
+            batch_id=batch_id,
+            client_id=client_id,
+            account_id=debtor_account.id,
+            status="accepted",
+            source=source,
+            total_count=len(rows),
+            total_amount=total_amount,
+            processed_count=rejected,
+            completed_count=0,
+            queued_count=0,
+            rejected_count=rejected
+        )
+        db.add(batch)
+        await db.flush()
+        await db.execute(insert(PaymentBatchItem), rows)
+        return batch
+
+    @staticmethod
+    async def _resolve_banks(account_numbers: List[str]) -> Dict[str, Optional[str]]:
+        """Найти банки получателей, которых нет в нашем банке"""
+        from services.payment_service import PaymentService
+
+        semaphore = asyncio.Semaphore(config.PAYMENT_BATCH_LOOKUP_CONCURRENCY)
+
+        async def detect(number: str) -> Optional[str]:
+            async with semaphore:
+                return await PaymentService._detect_target_bank(number)
+
+        banks = await asyncio.gather(*(detect(number) for number in account_numbers))
+        return dict(zip(account_numbers, banks))
+
+    @staticmethod
+    async def process_chunk(db: AsyncSession, batch: PaymentBatch, items: List[PaymentBatchItem]) -> Dict[str, int]:
+        """
+        Провести порцию строк в одной транзакции
+
+        Returns:
+            {"completed": ..., "queued": ..., "rejected": ...}
+        """
+        numbers = sorted({item.creditor_account for item in items})
+        result = await db.execute(
+            select(Account.id, Account.account_number, Account.status)
+            .where(Account.account_number.in_(numbers))
+        )
+        internal = {number: (account_id, status) for account_id, number, status in result.all()}
+        external = await PaymentBatchService._resolve_banks([n for n in numbers if n not in internal])
+
+        debtor = (await db.execute(
+            select(Account.account_number, Account.balance).where(Account.id == batch.account_id)
+        )).one()
+        debtor_number, available = debtor
+
+        now = datetime.utcnow()
+        item_updates, payments, transactions, transfers, outbox_rows = [], [], [], [], []
+        credits: Dict[int, Decimal] = {}
+        debit_total = Decimal("0")
+        counts = {"completed": 0, "queued": 0, "rejected": 0}
+
+        for item in items:
+            target = internal.get(item.creditor_account)
+            target_bank = config.BANK_CODE if target else external.get(item.creditor_account)
+            error = None
+            if target and target[1] != "active":
+                error = "Creditor account is not active"
+            elif not target_bank:
+                error = f"Target account {item.creditor_account} not found in any bank"
+            elif debit_total + item.amount > available:
+                error = "Insufficient funds"
+            if error:
+                counts["rejected"] += 1
+                item_updates.append({
+                    "id": item.id, "status": "rejected", "error": error,
+                    "payment_id": None, "destination_bank": target_bank, "processed_at": now
+                })
+                continue
+
+            debit_total += item.amount
+            payment_id = f"pay-{uuid.uuid4().hex[:12]}"
+            description = item.description or f"Пакетный платеж {batch.batch_id}, строка {item.line_number}"
+            is_internal = target is not None
+            payments.append({
+                "payment_id": payment_id,
+                "account_id": batch.account_id,
+                "amount": item.amount,
+                "currency": "RUB",
+                "destination_account": item.creditor_account,
+                "destination_bank": target_bank,
+                "description": description,
+                "status": "AcceptedSettlementCompleted" if is_internal else "AcceptedSettlementInProcess",
+                "creation_date_time": now,
+                "status_update_date_time": now
+            })
+            transactions.append({
+                "account_id": batch.account_id,
+                "transaction_id": f"tx-{uuid.uuid4().hex[:12]}",
+                "amount": item.amount,
+                "direction": "debit",
+                "counterparty": item.creditor_account,
+                "description": description,
+                "transaction_date": now
+            })
+            if is_internal:
+                credits[target[0]] = credits.get(target[0], Decimal("0")) + item.amount
+                transactions.append({
+                    "account_id": target[0],
+                    "transaction_id": f"tx-{uuid.uuid4().hex[:12]}",
+                    "amount": item.amount,
+                    "direction": "credit",
+                    "counterparty": debtor_number,
+                    "description": description,
+                    "transaction_date": now
+                })
+                counts["completed"] += 1
+            else:
+                transfer_id = f"transfer-{uuid.uuid4().hex[:12]}"
+                transfers.append({
+                    "transfer_id": transfer_id,
+                    "payment_id": payment_id,
+                    "from_bank": config.BANK_CODE,
+                    "to_bank": target_bank,
+                    "amount": item.amount,
+                    "status": "processing",
+                    "created_at": now
+                })
+                outbox_rows.append({
+                    "transfer_id": transfer_id,
+                    "payment_id": payment_id,
+                    "to_bank": target_bank,
+                    "to_account_number": item.creditor_account,
+                    "amount": item.amount,
+                    "currency": "RUB",
+                    "description": description,
+                    "status": "pending",
+                    "attempts": 0,
+                    "next_attempt_at": interbank_dispatcher.first_attempt_at(),
+                    "created_at": now,
+                    "updated_at": now
+                })
+                counts["queued"] += 1
+            item_updates.append({
+                "id": item.id, "status": "completed" if is_internal else "queued", "error": None,
+                "payment_id": payment_id, "destination_bank": target_bank, "processed_at": now
+            })
+
+        # Проводки в порядке возрастания id счетов (как в PostingService.post)
+        await PostingService.credit_many(db, {k: v for k, v in credits.items() if k < batch.account_id})
+        if debit_total > 0:
+            await PostingService.debit(db, batch.account_id, debit_total)
+        await PostingService.credit_many(db, {k: v for k, v in credits.items() if k > batch.account_id})
+
+        if payments:
+            await db.execute(insert(Payment), payments)
+            await db.execute(insert(Transaction), transactions)
+        if transfers:
+            await db.execute(insert(InterbankTransfer), transfers)
+            await db.execute(insert(InterbankOutbox), outbox_rows)
+        await db.execute(update(PaymentBatchItem), item_updates)
+
+        batch.processed_count += len(items)
+        batch.completed_count += counts["completed"]
+        batch.queued_count += counts["queued"]
+        batch.rejected_count += counts["rejected"]
+        await db.commit()
+        return counts
+
+
+class PaymentBatchProcessor:
+    """Фоновая обработка пакетов"""
+
+    def __init__(self):
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._resume_task: Optional[asyncio.Task] = None
+
+    def submit(self, batch_id: str):
+        """Запустить обработку пакета (после коммита пакета)"""
+        if batch_id in self._tasks:
+            return
+        task = asyncio.create_task(self._process(batch_id))
+        self._tasks[batch_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(batch_id, None))
+
+    async def _process(self, batch_id: str):
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(select(PaymentBatch).where(PaymentBatch.batch_id == batch_id))
+            batch = result.scalar_one_or_none()
+            if not batch:
+                return
+            try:
+                batch.status = "processing"
+                batch.started_at = batch.started_at or datetime.utcnow()
+                await db.commit()
+
+                retries = 0
+                while True:
+                    result = await db.execute(
+                        select(PaymentBatchItem)
+                        .where(PaymentBatchItem.batch_id == batch_id, PaymentBatchItem.status == "pending")
+                        .order_by(PaymentBatchItem.line_number)
+                        .limit(config.PAYMENT_BATCH_CHUNK_SIZE)
+                    )
+                    items = result.scalars().all()
+                    if not items:
+                        break
+
+                    try:
+                        counts = await PaymentBatchService.process_chunk(db, batch, items)
+                    except InsufficientFundsError:
+                        # Баланс изменился параллельным платежом - пересчитать порцию заново
+                        await db.rollback()
+                        retries += 1
+                        if retries >= 3:
+                            raise
+                        await db.refresh(batch)
+                        continue
+                    retries = 0
+                    if counts["queued"]:
+                        interbank_dispatcher.notify()
+
+                batch.status = "completed_with_errors" if batch.rejected_count else "completed"
+                batch.completed_at = datetime.utcnow()
+                await db.commit()
+                logger.info(
+                    f"Payment batch {batch_id} processed: {batch.completed_count} completed, "
+                    f"{batch.queued_count} queued, {batch.rejected_count} rejected"
+                )
+            except asyncio.CancelledError:
+                # Остановка сервиса: необработанные строки останутся pending до перезапуска
+                raise
+            except Exception as e:
+                logger.exception(f"Payment batch {batch_id} failed")
+                await db.rollback()
+                await db.execute(
+                    update(PaymentBatch)
+                    .where(PaymentBatch.batch_id == batch_id)
+                    .values(status="failed", error=str(e)[:1000], completed_at=datetime.utcnow())
+                )
+                await db.commit()
+
+    async def _resume(self):
+        """Продолжить пакеты, обработка которых прервалась остановкой сервиса"""
+        try:
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(
+                    select(PaymentBatch.batch_id).where(PaymentBatch.status.in_(["accepted", "processing"]))
+                )
+                batch_ids = result.scalars().all()
+            for batch_id in batch_ids:
+                self.submit(batch_id)
+        except Exception as e:
+            logger.warning(f"Failed to resume payment batches: {str(e)}")
+
+    def start(self):
+        if self._resume_task is None:
+            self._resume_task = asyncio.create_task(self._resume())
+
+    async def stop(self):
+        tasks = list(self._tasks.values())
+        if self._resume_task is not None:
+            tasks.append(self._resume_task)
+            self._resume_task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# Singleton instance
+batch_processor = PaymentBatchProcessor()
@@ -1,18 +1,30 @@
 """
 Payment Service - логика переводов
 Iteration 3 + Межбанковские переводы (реализовано)
+
+Межбанковские переводы отправляются асинхронно: списание и запись в outbox
+коммитятся вместе, доставку выполняет InterbankDispatcher.
 """
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from decimal import Decimal
-from datetime import datetime
-from typing import Optional, Tuple
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import hashlib
+import json
 import uuid
-import httpx
 import logging
 
-from models import Account, Payment, InterbankTransfer, BankCapital, Client, Transaction
+from database import after_commit
+from models import Account, Payment, InterbankTransfer, InterbankOutbox, BankCapitalDelta, Client, Transaction
 from config import config
+from services.account_digest_service import account_digest
+from services.http_client_pool import http_pool
+from services.interbank_dispatcher import interbank_dispatcher
+from services.posting_service import PostingService
+from services.capital_service import capital_ledger
+from services.auth_service import BankSigningKeyError, create_bank_signature
 
 logger = logging.getLogger(__name__)
 
@@ -44,6 +56,7 @@ class PaymentService:
         if not from_account:
             raise ValueError("Source account not found")
         
+        # Быстрый отказ без поиска получателя; окончательная проверка - в PostingService
         if from_account.balance < amount:
             raise ValueError("Insufficient funds")
         
@@ -61,9 +74,6 @@ class PaymentService:
             status="AcceptedSettlementInProcess"
         )
         
-        # Списать со счета отправителя
-        from_account.balance -= amount
-        
         # Попытаться найти получателя в своем банке
         result = await db.execute(
             select(Account).where(Account.account_number == to_account_number)
@@ -75,8 +85,8 @@ class PaymentService:
         db.add(payment)
         
         if to_account:
-            # Внутрибанковский перевод
-            to_account.balance += amount
+            # Внутрибанковский перевод: списание и зачисление атомарно
+            await PostingService.transfer(db, from_account.id, to_account.id, amount)
             payment.status = "AcceptedSettlementCompleted"
             payment.destination_bank = config.BANK_CODE
             payment.status_update_date_time = datetime.utcnow()
@@ -84,9 +94,10 @@ class PaymentService:
             # Создать транзакцию для отправителя (Debit - списание)
             transaction_debit = Transaction(
                 account_id=from_account.id,
-                transaction_type="Debit",
+                transaction_id=f"tx-{uuid.uuid4().hex[:12]}",
                 amount=amount,
-                balance_after=from_account.balance,
+                direction="debit",
+                counterparty=to_account_number,
                 description=f"Перевод на счет {to_account_number}: {description}",
                 transaction_date=datetime.utcnow()
             )
@@ -95,9 +106,10 @@ class PaymentService:
             # Создать транзакцию для получателя (Credit - зачисление)
             transaction_credit = Transaction(
                 account_id=to_account.id,
-                transaction_type="Credit",
+                transaction_id=f"tx-{uuid.uuid4().hex[:12]}",
                 amount=amount,
-                balance_after=to_account.balance,
+                direction="credit",
+                counterparty=from_account_number,
                 description=f"Перевод от счета {from_account_number}: {description}",
                 transaction_date=datetime.utcnow()
             )
@@ -117,6 +129,11 @@ class PaymentService:
                 await db.rollback()
                 raise ValueError(f"Target account {to_account_number} not found in any bank")
             
+            payment.destination_bank = target_bank
+            
+            # Списать со счета отправителя (после опроса банков, чтобы не держать блокировку строки)
+            await PostingService.debit(db, from_account.id, amount)
+            
             # Создать запись межбанкового перевода
             transfer_id = f"transfer-{uuid.uuid4().hex[:12]}"
             interbank_transfer = InterbankTransfer(
@@ -132,88 +149,36 @@ class PaymentService:
             # Создать транзакцию для отправителя (Debit - списание)
             transaction_debit = Transaction(
                 account_id=from_account.id,
-                transaction_type="Debit",
+                transaction_id=f"tx-{uuid.uuid4().hex[:12]}",
                 amount=amount,
-                balance_after=from_account.balance,
+                direction="debit",
+                counterparty=to_account_number,
                 description=f"Межбанковский перевод в {target_bank} на счет {to_account_number}: {description}",
                 transaction_date=datetime.utcnow()
             )
             db.add(transaction_debit)
             
-            # Сохранить локальные изменения (списание со счета)
-            await db.commit()
-            
-            # Вызвать API другого банка
-            try:
-                success = await PaymentService._send_interbank_transfer(
-                    transfer_id=transfer_id,
-                    to_bank=target_bank,
-                    to_account_number=to_account_number,
-                    amount=amount,
-                    description=description
-                )
-                
-                if success:
-                    # Перевод успешен
-                    payment.status = "AcceptedSettlementCompleted"
-                    payment.destination_bank = target_bank
-                    interbank_transfer.status = "completed"
-                    interbank_transfer.completed_at = datetime.utcnow()
-                    
-                    # Обновить капитал банка-отправителя (-amount)
-                    await PaymentService.update_bank_capital(
-                        db=db,
-                        amount_change=-amount,
-                        reason=f"Outgoing transfer to {target_bank}: {transfer_id}"
-                    )
-                    
-                    logger.info(f"Interbank transfer {transfer_id} completed: {config.BANK_CODE} -> {target_bank}, {amount} RUB")
-                else:
-                    # Перевод не удался - откат
-                    payment.status = "Rejected"
-                    interbank_transfer.status = "failed"
-                    
-                    # Вернуть деньги отправителю
-                    from_account.balance += amount
-                    
-                    # Создать корректирующую транзакцию (возврат)
-                    transaction_refund = Transaction(
-                        account_id=from_account.id,
-                        transaction_type="Credit",
-                        amount=amount,
-                        balance_after=from_account.balance,
-                        description=f"Возврат неудачного перевода в {target_bank}",
-                        transaction_date=datetime.utcnow()
-                    )
-                    db.add(transaction_refund)
-                    
-                    logger.warning(f"Interbank transfer {transfer_id} failed, refunded to sender")
-                    
-            except Exception as e:
-                # Ошибка при вызове API - откат
-                logger.error(f"Interbank transfer {transfer_id} error: {str(e)}")
-                payment.status = "Rejected"
-                interbank_transfer.status = "failed"
-                
-                # Вернуть деньги отправителю
-                from_account.balance += amount
-                
-                # Создать корректирующую транзакцию (возврат)
-                transaction_refund = Transaction(
-                    account_id=from_account.id,
-                    transaction_type="Credit",
-                    amount=amount,
-                    balance_after=from_account.balance,
-                    description=f"Возврат из-за ошибки межбанковского перевода: {str(e)}",
-                    transaction_date=datetime.utcnow()
-                )
-                db.add(transaction_refund)
-            
-            payment.status_update_date_time = datetime.utcnow()
+            # Поставить перевод в outbox в той же транзакции, что и списание:
+            # отправку в банк-получатель выполнит InterbankDispatcher в фоне
+            db.add(InterbankOutbox(
+                transfer_id=transfer_id,
+                payment_id=payment_id,
+                to_bank=target_bank,
+                to_account_number=to_account_number,
+                amount=amount,
+                currency="RUB",
+                description=description,
+                status="pending",
+                next_attempt_at=interbank_dispatcher.first_attempt_at()
+            ))
         
-        await db.commit()
+        # Коммит - за вызывающим (вместе с ключом идемпотентности)
+        await db.flush()
         await db.refresh(payment)
         
+        if interbank_transfer is not None:
+            after_commit(db, interbank_dispatcher.notify)
+        
         return payment, interbank_transfer
     
     @staticmethod
@@ -228,40 +193,130 @@ class PaymentService:
         return result.scalar_one_or_none()
     
     @staticmethod
-    async def update_bank_capital(
+    async def complete_interbank_transfer(
         db: AsyncSession,
-        amount_change: Decimal,
-        reason: str = ""
-    ):
+        outbox: InterbankOutbox,
+        record_capital: bool = True
+    ) -> Optional[Payment]:
         """
-        Обновить капитал банка
+        Отметить межбанковский перевод доставленным (вызывается диспетчером outbox)
         
-        amount_change: положительное = увеличение, отрицательное = уменьшение
+        Коммит выполняет вызывающий код. record_capital=False - капитал
+        изменяется одной суммой на весь пакет (netting).
+        
+        Returns:
+            Payment или None (перевод без платежа)
         """
-        bank_code = config.BANK_CODE
+        now = datetime.utcnow()
+        outbox.status = "sent"
+        outbox.last_error = None
         
-        # Получить или создать запись капитала
         result = await db.execute(
-            select(BankCapital).where(BankCapital.bank_code == bank_code)
+            select(InterbankTransfer).where(InterbankTransfer.transfer_id == outbox.transfer_id)
         )
-        capital_record = result.scalar_one_or_none()
-        
-        if not capital_record:
-            # Создать если нет
-            capital_record = BankCapital(
-                bank_code=bank_code,
-                capital=Decimal("3500000.00"),  # Начальный капитал
-                initial_capital=Decimal("3500000.00")
+        interbank_transfer = result.scalar_one_or_none()
+        if interbank_transfer:
+            interbank_transfer.status = "completed"
+            interbank_transfer.completed_at = now
+        
+        payment = None
+        if outbox.payment_id:
+            payment = await PaymentService.get_payment(db, outbox.payment_id)
+            if payment:
+                payment.status = "AcceptedSettlementCompleted"
+                payment.status_update_date_time = now
+        
+        # Обновить капитал банка-отправителя (-amount)
+        if record_capital:
+            await PaymentService.update_bank_capital(
+                db=db,
+                amount_change=-outbox.amount,
+                reason=f"Outgoing transfer to {outbox.to_bank}: {outbox.transfer_id}"
             )
-            db.add(capital_record)
         
-        # Обновить капитал
-        capital_record.capital += amount_change
-        capital_record.updated_at = datetime.utcnow()
+        logger.info(f"Interbank transfer {outbox.transfer_id} completed: {config.BANK_CODE} -> {outbox.to_bank}, {outbox.amount} RUB")
+        return payment
+    
+    @staticmethod
+    async def fail_interbank_transfer(db: AsyncSession, outbox: InterbankOutbox, reason: str) -> Optional[Payment]:
+        """
+        Окончательно отклонить межбанковский перевод и вернуть деньги отправителю
+        
+        Коммит выполняет вызывающий код.
+        
+        Returns:
+            Payment или None (перевод без платежа)
+        """
+        now = datetime.utcnow()
+        outbox.status = "failed"
+        outbox.last_error = reason
+        
+        result = await db.execute(
+            select(InterbankTransfer).where(InterbankTransfer.transfer_id == outbox.transfer_id)
+        )
+        interbank_transfer = result.scalar_one_or_none()
+        if interbank_transfer:
+            interbank_transfer.status = "failed"
         
-        await db.commit()
+        payment = None
+        if outbox.payment_id:
+            payment = await PaymentService.get_payment(db, outbox.payment_id)
         
-        return capital_record
+        if payment:
+            payment.status = "Rejected"
+            payment.status_update_date_time = now
+            
+            # Вернуть деньги отправителю
+            result = await db.execute(select(Account).where(Account.id == payment.account_id))
+            from_account = result.scalar_one_or_none()
+            if from_account:
+                await PostingService.credit(db, from_account.id, outbox.amount)
+                
+                # Создать корректирующую транзакцию (возврат)
+                db.add(Transaction(
+                    account_id=from_account.id,
+                    transaction_id=f"tx-{uuid.uuid4().hex[:12]}",
+                    amount=outbox.amount,
+                    direction="credit",
+                    counterparty=outbox.to_account_number,
+                    description=f"Возврат неудачного перевода в {outbox.to_bank}: {reason}",
+                    transaction_date=now
+                ))
+        
+        logger.warning(f"Interbank transfer {outbox.transfer_id} failed, refunded to sender: {reason}")
+        return payment
+    
+    @staticmethod
+    def park_interbank_transfer(outbox: InterbankOutbox, reason: str):
+        """
+        Попытки исчерпаны, а результат неизвестен (таймауты, сбои банка):
+        банк-получатель мог уже зачислить перевод, поэтому деньги не
+        возвращаются - запись ждет сверки (status="needs_review")
+        
+        Коммит выполняет вызывающий код.
+        """
+        outbox.status = "needs_review"
+        outbox.last_error = reason
+        logger.error(
+            f"Interbank transfer {outbox.transfer_id} to {outbox.to_bank} needs review after "
+            f"{outbox.attempts} attempts, outcome unknown: {reason}"
+        )
+    
+    @staticmethod
+    async def update_bank_capital(
+        db: AsyncSession,
+        amount_change: Decimal,
+        reason: str = ""
+    ) -> BankCapitalDelta:
+        """
+        Обновить капитал банка
+        
+        amount_change: положительное = увеличение, отрицательное = уменьшение
+        
+        Изменение добавляется в журнал дельт (capital_ledger) в текущей сессии
+        и коммитится вместе с операцией; в bank_capital оно попадет при свертке.
+        """
+        return capital_ledger.record(db, capital_change=amount_change, reason=reason)
     
     @staticmethod
     async def _detect_target_bank(account_number: str) -> Optional[str]:
@@ -269,40 +324,55 @@ class PaymentService:
         Определить банк-получатель по номеру счета
         
         В реальности это делается через БИК (БИК включен в платежных реквизитах).
-        В MVP: пытаемся найти счет во всех банках через HTTP запросы.
+        В MVP: пытаемся найти счет в банках через HTTP запросы, порядок и
+        необходимость опроса определяются Bloom-фильтрами счетов банков.
         
         Returns:
             Код банка (vbank/abank/sbank) или None
         """
-        banks = ["vbank", "abank", "sbank"]
+        banks = config.interbank_peers()
         
-        # Исключить свой банк из поиска
-        banks = [b for b in banks if b != config.BANK_CODE]
+        # Опрашиваем только банки, где счет может быть: попадание в Bloom-фильтр,
+        # фильтра нет или он устарел. Банк с актуальным «нет» опрашивается, только
+        # если его фильтр успел смениться (счет открыт после последнего обновления).
+        candidates, excluded = account_digest.rank_banks(account_number, banks)
         
-        # Проверяем каждый банк через локальные адреса (внутри Docker сети)
-        for bank_code in banks:
-            try:
-                # В Docker сети банки доступны по именам сервисов
-                bank_url = f"http://{bank_code}:8000"
-                
-                async with httpx.AsyncClient(timeout=5.0) as client:
-                    # Проверяем существование счета через GET /accounts (упрощенная проверка)
-                    # В продакшене: специальный endpoint для проверки существования счета
-                    response = await client.get(
-                        f"{bank_url}/interbank/check-account/{account_number}",
-                        headers={"x-bank-auth-token": config.BANK_CODE}
-                    )
-                    
-                    if response.status_code == 200:
-                        logger.info(f"Account {account_number} found in {bank_code}")
-                        return bank_code
-                        
-            except Exception as e:
-                logger.debug(f"Failed to check account in {bank_code}: {str(e)}")
-                continue
+        for bank_code in candidates:
+            if await PaymentService._check_account(bank_code, account_number):
+                return bank_code
+        
+        if excluded:
+            await asyncio.gather(*(account_digest.refresh_peer(b) for b in excluded))
+            recheck, _ = account_digest.rank_banks(account_number, excluded)
+            for bank_code in recheck:
+                if await PaymentService._check_account(bank_code, account_number):
+                    return bank_code
         
         return None
     
+    @staticmethod
+    async def _check_account(bank_code: str, account_number: str) -> bool:
+        """Есть ли счет в банке (GET /interbank/check-account)"""
+        try:
+            # В Docker сети банки доступны по именам сервисов
+            bank_url = config.interbank_url(bank_code)
+            
+            client = http_pool.client_for(bank_url)
+            response = await client.get(
+                f"{bank_url}/interbank/check-account/{account_number}",
+                timeout=5.0,
+                headers={"x-bank-auth-token": config.BANK_CODE}
+            )
+            
+            if response.status_code == 200:
+                logger.info(f"Account {account_number} found in {bank_code}")
+                return True
+                    
+        except Exception as e:
+            logger.debug(f"Failed to check account in {bank_code}: {str(e)}")
+        
+        return False
+    
     @staticmethod
     async def _send_interbank_transfer(
         transfer_id: str,
@@ -310,16 +380,20 @@ class PaymentService:
         to_account_number: str,
         amount: Decimal,
         description: str
-    ) -> bool:
+    ) -> Tuple[str, str]:
         """
         Отправить межбанковский перевод через HTTP API
         
         Returns:
-            True если успешно, False если ошибка
+            (результат, подробности), где результат:
+            "completed" - банк-получатель зачислил перевод
+            "rejected" - банк-получатель отказал (повторять бессмысленно)
+            "retry" - сетевая ошибка, сбой банка или 409 (запрос с тем же
+                Idempotency-Key еще обрабатывается): результат неизвестен
         """
         try:
             # URL банка-получателя (в Docker сети)
-            bank_url = f"http://{to_bank}:8000"
+            bank_url = config.interbank_url(to_bank)
             
             # Подготовить данные для отправки
             transfer_data = {
@@ -332,25 +406,131 @@ class PaymentService:
             }
             
             # Отправить POST запрос
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.post(
-                    f"{bank_url}/interbank/receive",
-                    json=transfer_data,
-                    headers={
-                        "x-bank-auth-token": config.BANK_CODE,
-                        "Content-Type": "application/json"
-                    }
-                )
-                
-                if response.status_code == 201:
-                    result = response.json()
-                    logger.info(f"Interbank transfer {transfer_id} sent successfully to {to_bank}: {result}")
-                    return True
-                else:
-                    logger.error(f"Interbank transfer {transfer_id} failed: {response.status_code} - {response.text}")
-                    return False
+            client = http_pool.client_for(bank_url)
+            response = await client.post(
+                f"{bank_url}/interbank/receive",
+                json=transfer_data,
+                timeout=10.0,
+                headers={
+                    "x-bank-auth-token": config.BANK_CODE,
+                    "Idempotency-Key": transfer_id,
+                    "Content-Type": "application/json"
+                }
+            )
+            
+            # 200 - перевод уже был зачислен раньше (повтор или пакетом)
+            if response.status_code in (200, 201):
+                result = response.json()
+                logger.info(f"Interbank transfer {transfer_id} sent successfully to {to_bank}: {result}")
+                return "completed", ""
+            
+            logger.error(f"Interbank transfer {transfer_id} failed: {response.status_code} - {response.text}")
+            if 400 <= response.status_code < 500 and response.status_code not in (408, 409, 429):
+                return "rejected", f"{response.status_code}: {response.text[:500]}"
+            return "retry", f"{response.status_code}: {response.text[:500]}"
                     
         except Exception as e:
             logger.error(f"Failed to send interbank transfer {transfer_id}: {str(e)}")
-            return False
+            return "retry", str(e) or e.__class__.__name__
+    
+    @staticmethod
+    async def _send_interbank_batch(to_bank: str, outboxes: List[InterbankOutbox]) -> Tuple[str, str, Dict[str, dict]]:
+        """
+        Отправить пакет переводов в один банк (netting) через /interbank/receive-batch
+        
+        Пакет подписывается RS256 JWT банка-отправителя (заголовок
+        x-batch-signature), в токене - sha256 списка переводов. Без
+        приватного ключа переводы отправляются по одному.
+        
+        Returns:
+            (результат, подробности, {transfer_id: {"status": ..., "error": ...}}),
+            результат - как у _send_interbank_transfer
+        """
+        bank_url = config.interbank_url(to_bank)
+        batch_id = f"netting-{uuid.uuid4().hex[:12]}"
+        transfers = [
+            {
+                "transfer_id": outbox.transfer_id,
+                "to_account_number": outbox.to_account_number,
+                "amount": str(outbox.amount),
+                "currency": outbox.currency or "RUB",
+                "description": outbox.description or ""
+            }
+            for outbox in outboxes
+        ]
+        try:
+            signature = create_bank_signature(
+                {
+                    "sub": config.BANK_CODE,
+                    "type": "interbank-batch",
+                    "batch_id": batch_id,
+                    "digest": batch_digest(transfers)
+                },
+                expires_delta=timedelta(minutes=5)
+            )
+        except BankSigningKeyError as e:
+            # Без RS256 подписи пакет не отправляем (HS256 с общим ключом небезопасен)
+            logger.critical(f"Cannot sign interbank batch to {to_bank}: {str(e)}. Sending {len(outboxes)} transfers one by one")
+            return "partial", "", await PaymentService._send_interbank_one_by_one(to_bank, outboxes)
+        
+        try:
+            client = http_pool.client_for(bank_url)
+            response = await client.post(
+                f"{bank_url}/interbank/receive-batch",
+                json={"batch_id": batch_id, "from_bank": config.BANK_CODE, "transfers": transfers},
+                timeout=30.0,
+                headers={
+                    "x-bank-auth-token": config.BANK_CODE,
+                    "x-batch-signature": signature,
+                    "Idempotency-Key": batch_id
+                }
+            )
+        except Exception as e:
+            logger.error(f"Failed to send interbank batch {batch_id} to {to_bank}: {str(e)}")
+            return "retry", str(e) or e.__class__.__name__, {}
+        
+        if response.status_code in (404, 405):
+            # Банк-получатель не поддерживает пакеты - отправить по одному
+            logger.info(f"{to_bank} does not support /interbank/receive-batch, sending {len(outboxes)} transfers one by one")
+            return "partial", "", await PaymentService._send_interbank_one_by_one(to_bank, outboxes)
+        
+        if response.status_code in (200, 201):
+            data = response.json()
+            results = {item["transfer_id"]: item for item in data.get("results", [])}
+            logger.info(f"Interbank batch {batch_id} sent to {to_bank}: {len(transfers)} transfers, {data.get('credited_amount')} RUB credited")
+            return "completed", "", results
+        
+        if response.status_code in (401, 403):
+            # Подпись пакета не принята (ключ, JWKS, часы) - это ошибка настройки,
+            # а не отказ по переводам: не возвращаем деньги, а повторяем
+            logger.critical(
+                f"Interbank batch {batch_id} signature rejected by {to_bank}: {response.status_code} - "
+                f"{response.text[:500]}. Check signing keys / JWKS; {len(outboxes)} transfers will be retried"
+            )
+            return "retry", f"{response.status_code}: {response.text[:500]}", {}
+        
+        logger.error(f"Interbank batch {batch_id} failed: {response.status_code} - {response.text}")
+        if 400 <= response.status_code < 500 and response.status_code not in (408, 409, 429):
+            return "rejected", f"{response.status_code}: {response.text[:500]}", {}
+        return "retry", f"{response.status_code}: {response.text[:500]}", {}
+
+    @staticmethod
+    async def _send_interbank_one_by_one(to_bank: str, outboxes: List[InterbankOutbox]) -> Dict[str, dict]:
+        """Отправить переводы пакета по одному: {transfer_id: {"status": ..., "error": ...}}"""
+        results = {}
+        for outbox in outboxes:
+            outcome, details = await PaymentService._send_interbank_transfer(
+                transfer_id=outbox.transfer_id,
+                to_bank=to_bank,
+                to_account_number=outbox.to_account_number,
+                amount=outbox.amount,
+                description=outbox.description or ""
+            )
+            results[outbox.transfer_id] = {"status": outcome, "error": details}
+        return results
+
 
+def batch_digest(transfers: List[dict]) -> str:
+    """sha256 канонического JSON списка переводов (подписывается в пакете netting)"""
+    canonical = json.dumps(transfers, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
@@ -0,0 +1,192 @@
+"""
+Posting Service - атомарное изменение балансов счетов
+
+Баланс меняется одним условным UPDATE ... RETURNING на стороне БД вместо
+чтения в Python и записи `balance -= amount`: параллельные переводы с одного
+счета не теряют обновления и не уводят баланс в минус. Изменения нескольких
+счетов применяются в порядке возрастания id, чтобы транзакции блокировали
+строки в одном порядке и не попадали во взаимную блокировку.
+
+Каждое изменение баланса дописывает запись в ledger_entries с номером
+(Account.ledger_sequence, растет в том же UPDATE) и остатком после проводки.
+"""
+import logging
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, Iterable, Tuple
+
+from sqlalchemy import bindparam, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Account, LedgerEntry
+from services.event_bus import record_balance
+
+logger = logging.getLogger(__name__)
+
+
+class InsufficientFundsError(ValueError):
+    """Недостаточно средств для списания"""
+
+    def __init__(self, account_id: int, required: Decimal, available: Decimal = None):
+        self.account_id = account_id
+        self.required = required
+        self.available = available
+        super().__init__("Insufficient funds")
+
+
+class PostingService:
+    """Сервис проводок по счетам"""
+
+    @staticmethod
+    async def _apply(db: AsyncSession, account_id: int, delta: Decimal) -> Decimal:
+        """Изменить баланс одного счета на delta, вернуть новый баланс"""
+        stmt = update(Account).where(Account.id == account_id)
+        if delta < 0:
+            # Списание проходит только при достаточном остатке
+            stmt = stmt.where(Account.balance >= -delta)
+        result = await db.execute(
+            stmt.values(
+                balance=Account.balance + delta,
+                ledger_sequence=Account.ledger_sequence + 1
+            ).returning(Account.balance, Account.ledger_sequence)
+        )
+        row = result.one_or_none()
+        if row is not None:
+            new_balance, sequence = row
+            await db.execute(insert(LedgerEntry).values(
+                account_id=account_id,
+                sequence=sequence,
+                amount=delta,
+                balance_after=new_balance,
+                posted_at=datetime.utcnow()
+            ))
+            record_balance(db, account_id, balance=new_balance)
+            return new_balance
+
+        available = (await db.execute(
+            select(Account.balance).where(Account.id == account_id)
+        )).scalar_one_or_none()
+        if available is None:
+            raise ValueError(f"Account {account_id} not found")
+        raise InsufficientFundsError(account_id, -delta, available)
+
+    @staticmethod
+    async def post(db: AsyncSession, legs: Iterable[Tuple[int, Decimal]]) -> Dict[int, Decimal]:
+        """
+        Применить проводки [(account_id, delta), ...] в одной транзакции
+
+        delta > 0 - зачисление, delta < 0 - списание. Коммит выполняет
+        вызывающий код; при InsufficientFundsError сессию нужно откатить.
+
+        Returns:
+            {account_id: новый баланс}
+        """
+        totals: Dict[int, Decimal] = {}
+        for account_id, delta in legs:
+            totals[account_id] = totals.get(account_id, Decimal("0")) + Decimal(delta)
+
+        balances = {}
+        for account_id in sorted(totals):
+            balances[account_id] = await PostingService._apply(db, account_id, totals[account_id])
+        return balances
+
+    @staticmethod
+    async def debit(db: AsyncSession, account_id: int, amount: Decimal) -> Decimal:
+        """Списать amount, если хватает средств. Returns: новый баланс"""
+        if amount <= 0:
+            raise ValueError("Amount must be greater than 0")
+        return await PostingService._apply(db, account_id, -Decimal(amount))
+
+    @staticmethod
+    async def credit(db: AsyncSession, account_id: int, amount: Decimal) -> Decimal:
+        """Зачислить amount. Returns: новый баланс"""
+        if amount <= 0:
+            raise ValueError("Amount must be greater than 0")
+        return await PostingService._apply(db, account_id, Decimal(amount))
+
+    @staticmethod
+    async def transfer(
+        db: AsyncSession,
+        from_account_id: int,
+        to_account_id: int,
+        amount: Decimal
+    ) -> Tuple[Decimal, Decimal]:
+        """
+        Перевод между двумя счетами банка
+
+        Returns:
+            (баланс отправителя, баланс получателя)
+        """
+        if amount <= 0:
+            raise ValueError("Amount must be greater than 0")
+        if from_account_id == to_account_id:
+            raise ValueError("Cannot transfer to the same account")
+        balances = await PostingService.post(db, [
+            (from_account_id, -Decimal(amount)),
+            (to_account_id, Decimal(amount))
+        ])
+        return balances[from_account_id], balances[to_account_id]
+
+    @staticmethod
+    async def credit_many(db: AsyncSession, credits: Dict[int, Decimal]) -> int:
+        """
+        Зачислить суммы на много счетов одним executemany (по возрастанию id)
+
+        Для пакетной обработки: загруженные в сессию объекты Account
+        не обновляются.
+
+        Returns:
+            Количество счетов
+        """
+        if not credits:
+            return 0
+        accounts = Account.__table__
+        await db.execute(
+            update(accounts)
+            .where(accounts.c.id == bindparam("account_id"))
+            .values(
+                balance=accounts.c.balance + bindparam("delta"),
+                ledger_sequence=accounts.c.ledger_sequence + 1
+            ),
+            [
+                {"account_id": account_id, "delta": Decimal(credits[account_id])}
+                for account_id in sorted(credits)
+            ]
+        )
+
+        # Строки заблокированы этим UPDATE до конца транзакции - читаем свои значения
+        result = await db.execute(
+            select(accounts.c.id, accounts.c.balance, accounts.c.ledger_sequence)
+            .where(accounts.c.id.in_(list(credits)))
+        )
+        posted_at = datetime.utcnow()
+        entries = [
+            {
+                "account_id": account_id,
+                "sequence": sequence,
+                "amount": Decimal(credits[account_id]),
+                "balance_after": balance,
+                "posted_at": posted_at
+            }
+            for account_id, balance, sequence in result.all()
+        ]
+        await db.execute(insert(LedgerEntry), entries)
+        for entry in entries:
+            record_balance(db, entry["account_id"], balance=entry["balance_after"])
+        return len(credits)
+
+    @staticmethod
+    async def lock_balances(db: AsyncSession, account_ids: Iterable[int]) -> Dict[int, Decimal]:
+        """
+        Заблокировать счета до конца транзакции (SELECT ... FOR UPDATE по возрастанию id)
+
+        Нужно, когда сумма проводки зависит от текущего баланса
+        (закрытие счета с переводом остатка, погашение кредита).
+        """
+        result = await db.execute(
+            select(Account.id, Account.balance)
+            .where(Account.id.in_(sorted(set(account_ids))))
+            .order_by(Account.id)
+            .with_for_update()
+        )
+        return {account_id: balance for account_id, balance in result.all()}
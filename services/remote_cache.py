@@ -0,0 +1,102 @@
+"""
+Remote Read Cache - кэш чтений из других банков (stale-while-revalidate)
+
+Ответ считается свежим REMOTE_CACHE_TTL_SECONDS; после этого еще
+REMOTE_CACHE_STALE_SECONDS отдается устаревшая копия, а обновление идет в
+фоне. Одинаковые одновременные запросы схлопываются в один (single-flight).
+Кэшируются только успешные ответы; ошибка фонового обновления оставляет
+прежнюю копию.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Значение заголовка X-Cache
+HIT, STALE, MISS, BYPASS = "HIT", "STALE", "MISS", "BYPASS"
+
+Loader = Callable[[], Awaitable[Any]]
+
+
+class RemoteReadCache:
+    """LRU кэш ответов удаленных банков"""
+
+    def __init__(self):
+        self._entries: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._refreshing: set = set()
+
+    def _store(self, key: Hashable, value: Any):
+        self._entries[key] = (value, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > config.REMOTE_CACHE_MAX_ENTRIES:
+            self._entries.popitem(last=False)
+
+    async def _load(self, key: Hashable, loader: Loader) -> Any:
+        """Один запрос к банку на ключ, сколько бы вызовов его ни ждали"""
+        future = self._inflight.get(key)
+        if future is None:
+            async def load():
+                value = await loader()
+                self._store(key, value)
+                return value
+
+            future = asyncio.ensure_future(load())
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(future)
+
+    def _refresh_in_background(self, key: Hashable, loader: Loader):
+        if key in self._inflight:
+            return
+
+        async def refresh():
+            try:
+                await self._load(key, loader)
+            except Exception as e:
+                logger.info(f"Background refresh failed, keeping stale copy: {str(e)}")
+
+        task = asyncio.create_task(refresh())
+        self._refreshing.add(task)
+        task.add_done_callback(self._refreshing.discard)
+
+    async def get(self, key: Hashable, loader: Loader, bypass: bool = False) -> Tuple[Any, str]:
+        """
+        Значение по ключу и состояние кэша (HIT / STALE / MISS / BYPASS)
+
+        bypass - прочитать из банка, минуя кэш (результат все равно сохраняется).
+        """
+        if not config.REMOTE_CACHE_ENABLED:
+            return await loader(), BYPASS
+        if bypass:
+            return await self._load(key, loader), BYPASS
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, fetched_at = entry
+            age = time.monotonic() - fetched_at
+            if age < config.REMOTE_CACHE_TTL_SECONDS:
+                self._entries.move_to_end(key)
+                return value, HIT
+            if age < config.REMOTE_CACHE_TTL_SECONDS + config.REMOTE_CACHE_STALE_SECONDS:
+                self._refresh_in_background(key, loader)
+                return value, STALE
+
+        return await self._load(key, loader), MISS
+
+    def invalidate(self, predicate: Optional[Callable[[Hashable], bool]] = None):
+        """Удалить записи (все или подходящие под predicate)"""
+        if predicate is None:
+            self._entries.clear()
+            return
+        for key in [key for key in self._entries if predicate(key)]:
+            del self._entries[key]
+
+
+# Singleton instance
+remote_cache = RemoteReadCache()
@@ -0,0 +1,296 @@
+"""
+Remote Mirror - локальная копия транзакций счетов в других банках
+
+История, поиск и аналитика по счетам других банков читаются из таблицы
+remote_transactions, а у банка запрашивается только дельта: транзакции с
+bookingDateTime не раньше последней сохраненной (граница включительно,
+повторы схлопывает upsert по (bank_url, account_id, transaction_id)).
+Синхронизация счета - не чаще REMOTE_MIRROR_SYNC_INTERVAL_SECONDS;
+одновременные синхронизации одного счета по одному согласию схлопываются в одну.
+"""
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime, timezone
+from decimal import Decimal, InvalidOperation
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import case, func, select, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import config
+from database import AsyncSessionLocal
+from models import RemoteTransaction
+from services.http_client_pool import http_pool
+from services.multibank_service import MultibankService, RemoteBankError
+from services.remote_cache import BYPASS, HIT, MISS, STALE
+
+logger = logging.getLogger(__name__)
+
+# Банк отказал в доступе - подтверждение согласия для счета снимается
+ACCESS_DENIED = (401, 403, 404)
+# Синхронизация не удалась, а согласие банком не подтверждалось - копию не отдаем
+ERROR = "ERROR"
+
+
+def _naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Даты в БД хранятся как naive UTC"""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _booking(value: Optional[str]) -> Optional[datetime]:
+    """bookingDateTime банка -> naive UTC"""
+    if not value:
+        return None
+    try:
+        return _naive_utc(datetime.fromisoformat(value.replace("Z", "+00:00")))
+    except ValueError:
+        return None
+
+
+class RemoteMirror:
+    """Синхронизация и чтение remote_transactions"""
+
+    def __init__(self):
+        self._synced_at: Dict[Tuple[str, str, str], float] = {}
+        self._inflight: Dict[Tuple[str, str, str], asyncio.Future] = {}
+
+    # === Синхронизация ===
+
+    async def sync(
+        self,
+        bank_url: str,
+        account_id: str,
+        bank_token: str,
+        consent_id: str,
+        force: bool = False
+    ) -> str:
+        """
+        Догрузить новые транзакции счета из банка
+
+        Возвращает состояние как у remote_cache: HIT - копия свежая, банк не
+        запрашивался; MISS / BYPASS - дельта загружена.
+
+        Raises:
+            RemoteBankError: банк отказал или недоступен (решение, отдавать ли
+                локальную копию как STALE, - за вызывающим)
+        """
+        key = (http_pool.base_url(bank_url), account_id)
+        # Свежесть - по согласию: с другим согласием доступ сначала проверит банк
+        synced_at = self._synced_at.get(key + (consent_id,))
+        if not force and synced_at and time.monotonic() - synced_at < config.REMOTE_MIRROR_SYNC_INTERVAL_SECONDS:
+            return HIT
+
+        # Схлопываются только синхронизации с тем же согласием: запрос с
+        # другим (или недействительным) согласием сам проходит проверку банком
+        flight = key + (consent_id,)
+        future = self._inflight.get(flight)
+        if future is None:
+            future = asyncio.ensure_future(self._sync(key, bank_url, bank_token, consent_id))
+            self._inflight[flight] = future
+            future.add_done_callback(lambda _: self._inflight.pop(flight, None))
+        try:
+            await asyncio.shield(future)
+        except RemoteBankError as e:
+            if e.status_code in ACCESS_DENIED:
+                self._synced_at.pop(flight, None)
+            raise
+        return BYPASS if force else MISS
+
+    def verified(self, bank_url: str, account_id: str, consent_id: str) -> bool:
+        """
+        Согласие уже проходило проверку банком для этого счета
+
+        Только тогда при недоступном банке можно отдать локальную копию (STALE):
+        копия не привязана к согласию, а вызывающий не аутентифицирован.
+        """
+        return (http_pool.base_url(bank_url), account_id, consent_id) in self._synced_at
+
+    async def sync_many(self, accounts: List[dict], force: bool = False) -> List[dict]:
+        """
+        sync для нескольких счетов параллельно
+
+        Счет, который не удалось синхронизировать, остается в ответе с
+        ошибкой и статусом STALE, если согласие уже подтверждалось банком
+        (поиск и аналитика идут по локальной копии), иначе ERROR - счет
+        в выборку не попадает.
+        """
+
+        async def one(account: dict) -> dict:
+            status = {"bank_url": account["bank_url"], "account_id": account["account_id"]}
+            try:
+                status["state"] = await self.sync(
+                    account["bank_url"], account["account_id"], account["bank_token"], account["consent_id"], force
+                )
+            except RemoteBankError as e:
+                logger.warning(f"Синхронизация {account['account_id']} из {account['bank_url']} не удалась: {e.detail}")
+                status.update(state=STALE, error={"status": e.status_code, "detail": e.detail})
+                if not self.verified(account["bank_url"], account["account_id"], account["consent_id"]):
+                    status["state"] = ERROR
+            return status
+
+        return list(await asyncio.gather(*(one(account) for account in accounts)))
+
+    async def _sync(self, key: Tuple[str, str], bank_url: str, bank_token: str, consent_id: str):
+        base_url, account_id = key
+        async with AsyncSessionLocal() as db:
+            last_booking = (await db.execute(
+                select(func.max(RemoteTransaction.booking_date_time)).where(
+                    RemoteTransaction.bank_url == base_url,
+                    RemoteTransaction.account_id == account_id
+                )
+            )).scalar_one_or_none()
+
+            path = f"/accounts/{account_id}/transactions"
+            params = {"from_booking_date_time": last_booking.isoformat() + "Z"} if last_booking else None
+            upserted = 0
+            for _ in range(config.REMOTE_MIRROR_MAX_PAGES):
+                data = await MultibankService.get_json(bank_url, path, bank_token, consent_id, params=params)
+                rows = self._rows(base_url, account_id, data.get("data", {}).get("transaction", []))
+                upserted += await self.upsert(db, rows)
+
+                next_link = (data.get("links") or {}).get("next")
+                if not next_link or not rows:
+                    break
+                # links.next - путь с query string (или абсолютный URL того же банка)
+                path = next_link[len(base_url):] if next_link.lower().startswith(base_url) else next_link
+                params = None
+            else:
+                logger.warning(f"Mirror {base_url} {account_id}: достигнут лимит {config.REMOTE_MIRROR_MAX_PAGES} страниц")
+
+            await db.commit()
+
+        self._synced_at[key + (consent_id,)] = time.monotonic()
+        logger.info(f"Mirror {base_url} {account_id}: {upserted} новых/измененных транзакций (с {last_booking or 'начала'})")
+
+    @staticmethod
+    def _rows(base_url: str, account_id: str, transactions: list) -> List[dict]:
+        rows = {}
+        now = datetime.utcnow()
+        for tx in transactions:
+            transaction_id = tx.get("transactionId")
+            booked = _booking(tx.get("bookingDateTime") or tx.get("valueDateTime"))
+            if not transaction_id or booked is None:
+                continue
+            amount_data = tx.get("amount") or {}
+            try:
+                amount = abs(Decimal(str(amount_data.get("amount", "0"))))
+            except InvalidOperation:
+                continue
+            if tx.get("creditDebitIndicator") == "Debit":
+                amount = -amount
+            # Повтор transactionId на одной странице - берется последний
+            rows[transaction_id] = {
+                "bank_url": base_url,
+                "account_id": account_id,
+                "transaction_id": transaction_id,
+                "booking_date_time": booked,
+                "amount": amount,
+                "currency": (amount_data.get("currency") or "RUB")[:3],
+                "description": tx.get("transactionInformation"),
+                "payload": json.dumps(tx, ensure_ascii=False, sort_keys=True),
+                "synced_at": now
+            }
+        return list(rows.values())
+
+    @staticmethod
+    async def upsert(db: AsyncSession, rows: List[dict]) -> int:
+        """INSERT ... ON CONFLICT DO UPDATE пачками; неизмененные строки не перезаписываются"""
+        upserted = 0
+        for start in range(0, len(rows), config.REMOTE_MIRROR_UPSERT_BATCH):
+            statement = insert(RemoteTransaction).values(rows[start:start + config.REMOTE_MIRROR_UPSERT_BATCH])
+            excluded = statement.excluded
+            statement = statement.on_conflict_do_update(
+                index_elements=["bank_url", "account_id", "transaction_id"],
+                set_={
+                    "booking_date_time": excluded.booking_date_time,
+                    "amount": excluded.amount,
+                    "currency": excluded.currency,
+                    "description": excluded.description,
+                    "payload": excluded.payload,
+                    "synced_at": excluded.synced_at
+                },
+                where=RemoteTransaction.payload != excluded.payload
+            )
+            result = await db.execute(statement)
+            upserted += max(result.rowcount or 0, 0)
+        return upserted
+
+    # === Чтение ===
+
+    @staticmethod
+    def keys(accounts: List[dict]) -> List[Tuple[str, str]]:
+        """(bank_url, account_id) для фильтра по копии"""
+        return [(http_pool.base_url(account["bank_url"]), account["account_id"]) for account in accounts]
+
+    @staticmethod
+    def _filtered(
+        query,
+        accounts: List[Tuple[str, str]],
+        from_date: Optional[datetime] = None,
+        to_date: Optional[datetime] = None,
+        search: Optional[str] = None,
+        min_amount: Optional[Decimal] = None,
+        max_amount: Optional[Decimal] = None,
+        credit_debit: Optional[str] = None
+    ):
+        query = query.where(tuple_(RemoteTransaction.bank_url, RemoteTransaction.account_id).in_(accounts))
+        from_date, to_date = _naive_utc(from_date), _naive_utc(to_date)
+        if from_date:
+            query = query.where(RemoteTransaction.booking_date_time >= from_date)
+        if to_date:
+            query = query.where(RemoteTransaction.booking_date_time <= to_date)
+        if search:
+            query = query.where(RemoteTransaction.description.ilike(f"%{search}%"))
+        if min_amount is not None:
+            query = query.where(func.abs(RemoteTransaction.amount) >= min_amount)
+        if max_amount is not None:
+            query = query.where(func.abs(RemoteTransaction.amount) <= max_amount)
+        if credit_debit == "Credit":
+            query = query.where(RemoteTransaction.amount > 0)
+        elif credit_debit == "Debit":
+            query = query.where(RemoteTransaction.amount < 0)
+        return query
+
+    @staticmethod
+    async def transactions(db: AsyncSession, accounts: List[Tuple[str, str]], limit: int, **filters) -> List[dict]:
+        """Транзакции из копии (от новых к старым) в формате банка"""
+        query = RemoteMirror._filtered(select(RemoteTransaction.payload), accounts, **filters)
+        result = await db.execute(
+            query.order_by(RemoteTransaction.booking_date_time.desc(), RemoteTransaction.id.desc()).limit(limit)
+        )
+        return [json.loads(payload) for payload in result.scalars()]
+
+    @staticmethod
+    async def analytics(db: AsyncSession, accounts: List[Tuple[str, str]], **filters) -> List[dict]:
+        """Поступления и расходы по месяцам и валютам - одним GROUP BY"""
+        year = func.extract("year", RemoteTransaction.booking_date_time)
+        month = func.extract("month", RemoteTransaction.booking_date_time)
+        income = func.sum(case((RemoteTransaction.amount > 0, RemoteTransaction.amount), else_=0))
+        expenses = func.sum(case((RemoteTransaction.amount < 0, -RemoteTransaction.amount), else_=0))
+        query = RemoteMirror._filtered(
+            select(year, month, RemoteTransaction.currency, income, expenses, func.count(RemoteTransaction.id)),
+            accounts, **filters
+        )
+        result = await db.execute(
+            query.group_by(year, month, RemoteTransaction.currency).order_by(year.desc(), month.desc())
+        )
+        return [
+            {
+                "month": f"{int(y):04d}-{int(m):02d}",
+                "currency": currency,
+                "income": str(Decimal(inc or 0).quantize(Decimal("0.01"))),
+                "expenses": str(Decimal(exp or 0).quantize(Decimal("0.01"))),
+                "net": str(Decimal((inc or 0) - (exp or 0)).quantize(Decimal("0.01"))),
+                "count": count
+            }
+            for y, m, currency, inc, exp, count in result.all()
+        ]
+
+
+# Singleton instance
+remote_mirror = RemoteMirror()
@@ -0,0 +1,170 @@
+"""
+Statement Export Service - потоковая выгрузка истории счета (CSV / NDJSON / OFX)
+
+Строки читаются серверным курсором (AsyncSession.stream + yield_per) и сразу
+отдаются порциями, поэтому память не зависит от длины истории. Генератор
+открывает свою сессию: StreamingResponse дочитывается после того, как
+сессия из get_db уже закрыта.
+"""
+import csv
+import io
+import json
+import logging
+from datetime import datetime
+from decimal import Decimal
+from typing import AsyncIterator, Optional
+from xml.sax.saxutils import escape
+
+from sqlalchemy import select
+
+from config import config
+from database import AsyncSessionLocal
+from models import Account, Transaction
+from services.ledger_service import LedgerService
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "ofx": ("application/x-ofx", "ofx"),
+}
+
+CSV_COLUMNS = ["transaction_id", "booking_date_time", "direction", "amount", "currency", "counterparty", "description"]
+
+
+class StatementExportService:
+    """Сервис потоковой выгрузки транзакций"""
+
+    @staticmethod
+    def media_type(fmt: str) -> str:
+        return FORMATS[fmt][0]
+
+    @staticmethod
+    def filename(account: Account, fmt: str) -> str:
+        return f"statement-{account.account_number}-{datetime.utcnow():%Y%m%d}.{FORMATS[fmt][1]}"
+
+    @staticmethod
+    async def stream(
+        account: Account,
+        fmt: str,
+        from_date: Optional[datetime] = None,
+        to_date: Optional[datetime] = None
+    ) -> AsyncIterator[str]:
+        """Отдавать выписку порциями по TRANSACTIONS_EXPORT_YIELD_PER строк"""
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported format: {fmt}")
+
+        query = (
+            select(
+                Transaction.transaction_id,
+                Transaction.transaction_date,
+                Transaction.direction,
+                Transaction.amount,
+                Transaction.counterparty,
+                Transaction.description
+            )
+            .where(Transaction.account_id == account.id)
+            .order_by(Transaction.transaction_date, Transaction.id)
+            .execution_options(yield_per=config.TRANSACTIONS_EXPORT_YIELD_PER)
+        )
+        if from_date:
+            query = query.where(Transaction.transaction_date >= from_date)
+        if to_date:
+            query = query.where(Transaction.transaction_date <= to_date)
+
+        async with AsyncSessionLocal() as db:
+            if fmt == "ofx":
+                closing = await LedgerService.balance_at(db, account, to_date or datetime.utcnow())
+                yield StatementExportService._ofx_header(account, from_date, to_date)
+
+            if fmt == "csv":
+                yield ",".join(CSV_COLUMNS) + "\r\n"
+
+            result = await db.stream(query)
+            async for rows in result.partitions():
+                if fmt == "csv":
+                    yield StatementExportService._csv_chunk(rows, account.currency)
+                elif fmt == "ndjson":
+                    yield "".join(StatementExportService._ndjson_line(row, account) for row in rows)
+                else:
+                    yield "".join(StatementExportService._ofx_transaction(row) for row in rows)
+
+            if fmt == "ofx":
+                yield StatementExportService._ofx_footer(closing, to_date)
+
+    # === Форматы ===
+
+    @staticmethod
+    def _signed(row) -> Decimal:
+        amount = abs(row.amount)
+        return amount if row.direction == "credit" else -amount
+
+    @staticmethod
+    def _csv_chunk(rows, currency: str) -> str:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow([
+                row.transaction_id,
+                row.transaction_date.isoformat() + "Z",
+                row.direction,
+                str(abs(row.amount)),
+                currency,
+                row.counterparty or "",
+                row.description or ""
+            ])
+        return buffer.getvalue()
+
+    @staticmethod
+    def _ndjson_line(row, account: Account) -> str:
+        return json.dumps({
+            "accountId": f"acc-{account.id}",
+            "transactionId": row.transaction_id,
+            "bookingDateTime": row.transaction_date.isoformat() + "Z",
+            "creditDebitIndicator": "Credit" if row.direction == "credit" else "Debit",
+            "amount": {"amount": str(abs(row.amount)), "currency": account.currency},
+            "counterparty": row.counterparty,
+            "transactionInformation": row.description or ""
+        }, ensure_ascii=False) + "\n"
+
+    @staticmethod
+    def _ofx_date(value: datetime) -> str:
+        return value.strftime("%Y%m%d%H%M%S")
+
+    @staticmethod
+    def _ofx_header(account: Account, from_date: Optional[datetime], to_date: Optional[datetime]) -> str:
+        start = from_date or account.opened_at or datetime.utcnow()
+        end = to_date or datetime.utcnow()
+        return (
+            '<?xml version="1.0" encoding="UTF-8" standalone="no"?>\n'
+            '<?OFX OFXHEADER="200" VERSION="220" SECURITY="NONE" OLDFILEUID="NONE" NEWFILEUID="NONE"?>\n'
+            "<OFX><BANKMSGSRSV1><STMTTRNRS><TRNUID>0</TRNUID>"
+            "<STATUS><CODE>0</CODE><SEVERITY>INFO</SEVERITY></STATUS>\n"
+            f"<STMTRS><CURDEF>{escape(account.currency or 'RUB')}</CURDEF>\n"
+            f"<BANKACCTFROM><BANKID>{escape(config.BANK_CODE)}</BANKID>"
+            f"<ACCTID>{escape(account.account_number)}</ACCTID>"
+            f"<ACCTTYPE>{'SAVINGS' if account.account_type == 'savings' else 'CHECKING'}</ACCTTYPE></BANKACCTFROM>\n"
+            f"<BANKTRANLIST><DTSTART>{StatementExportService._ofx_date(start)}</DTSTART>"
+            f"<DTEND>{StatementExportService._ofx_date(end)}</DTEND>\n"
+        )
+
+    @staticmethod
+    def _ofx_transaction(row) -> str:
+        name = f"<NAME>{escape(row.counterparty[:32])}</NAME>" if row.counterparty else ""
+        memo = f"<MEMO>{escape(row.description[:255])}</MEMO>" if row.description else ""
+        return (
+            f"<STMTTRN><TRNTYPE>{'CREDIT' if row.direction == 'credit' else 'DEBIT'}</TRNTYPE>"
+            f"<DTPOSTED>{StatementExportService._ofx_date(row.transaction_date)}</DTPOSTED>"
+            f"<TRNAMT>{StatementExportService._signed(row)}</TRNAMT>"
+            f"<FITID>{escape(row.transaction_id)}</FITID>{name}{memo}</STMTTRN>\n"
+        )
+
+    @staticmethod
+    def _ofx_footer(closing: Decimal, to_date: Optional[datetime]) -> str:
+        return (
+            "</BANKTRANLIST>\n"
+            f"<LEDGERBAL><BALAMT>{closing}</BALAMT>"
+            f"<DTASOF>{StatementExportService._ofx_date(to_date or datetime.utcnow())}</DTASOF></LEDGERBAL>\n"
+            "</STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>\n"
+        )
@@ -20,9 +20,13 @@ CREATE TABLE IF NOT EXISTS accounts (
     balance NUMERIC(15, 2) DEFAULT 0,
     currency VARCHAR(3) DEFAULT 'RUB',
     status VARCHAR(20) DEFAULT 'active',
-    opened_at TIMESTAMP DEFAULT NOW()
+    opened_at TIMESTAMP DEFAULT NOW(),
+    ledger_sequence INTEGER NOT NULL DEFAULT 0
 );
 
+-- Базы, созданные до ledger_entries
+ALTER TABLE accounts ADD COLUMN IF NOT EXISTS ledger_sequence INTEGER NOT NULL DEFAULT 0;
+
 CREATE TABLE IF NOT EXISTS transactions (
     id SERIAL PRIMARY KEY,
     account_id INTEGER REFERENCES accounts(id),
@@ -35,6 +39,54 @@ CREATE TABLE IF NOT EXISTS transactions (
     created_at TIMESTAMP DEFAULT NOW()
 );
 
+CREATE INDEX IF NOT EXISTS idx_transactions_account_date ON transactions(account_id, transaction_date, id);
+
+CREATE TABLE IF NOT EXISTS ledger_entries (
+    id SERIAL PRIMARY KEY,
+    account_id INTEGER NOT NULL REFERENCES accounts(id),
+    sequence INTEGER NOT NULL,
+    amount NUMERIC(15, 2) NOT NULL,
+    balance_after NUMERIC(15, 2) NOT NULL,
+    posted_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    CONSTRAINT uq_ledger_entries_account_sequence UNIQUE (account_id, sequence)
+);
+
+CREATE INDEX IF NOT EXISTS idx_ledger_entries_account_posted ON ledger_entries(account_id, posted_at, sequence);
+
+CREATE TABLE IF NOT EXISTS remote_transactions (
+    id SERIAL PRIMARY KEY,
+    bank_url VARCHAR(255) NOT NULL,
+    account_id VARCHAR(100) NOT NULL,
+    transaction_id VARCHAR(100) NOT NULL,
+    booking_date_time TIMESTAMP NOT NULL,
+    amount NUMERIC(15, 2) NOT NULL,
+    currency VARCHAR(3) DEFAULT 'RUB',
+    description TEXT,
+    payload TEXT NOT NULL,
+    synced_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    CONSTRAINT uq_remote_transactions_key UNIQUE (bank_url, account_id, transaction_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_remote_transactions_account_booking ON remote_transactions(bank_url, account_id, booking_date_time);
+
+CREATE TABLE IF NOT EXISTS bank_connections (
+    id SERIAL PRIMARY KEY,
+    client_id INTEGER NOT NULL REFERENCES clients(id),
+    bank_url VARCHAR(255) NOT NULL,
+    remote_client_id VARCHAR(100) NOT NULL,
+    consent_id VARCHAR(100),
+    consent_status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    consent_job_id VARCHAR(50),
+    bank_token_sealed TEXT,
+    bank_token_expires_at TIMESTAMP,
+    last_synced_at TIMESTAMP,
+    created_at TIMESTAMP DEFAULT NOW(),
+    updated_at TIMESTAMP DEFAULT NOW(),
+    CONSTRAINT uq_bank_connections_client_bank UNIQUE (client_id, bank_url, remote_client_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_bank_connections_status_synced ON bank_connections(consent_status, last_synced_at);
+
 CREATE TABLE IF NOT EXISTS bank_settings (
     key VARCHAR(100) PRIMARY KEY,
     value TEXT,
@@ -65,6 +117,42 @@ CREATE TABLE IF NOT EXISTS payments (
     status_update_date_time TIMESTAMP DEFAULT NOW()
 );
 
+CREATE TABLE IF NOT EXISTS payment_batches (
+    id SERIAL PRIMARY KEY,
+    batch_id VARCHAR(100) UNIQUE NOT NULL,
+    client_id INTEGER REFERENCES clients(id) NOT NULL,
+    account_id INTEGER REFERENCES accounts(id) NOT NULL,
+    status VARCHAR(30) DEFAULT 'accepted',
+    source VARCHAR(10) DEFAULT 'json',
+    total_count INTEGER DEFAULT 0,
+    total_amount NUMERIC(15, 2) DEFAULT 0,
+    processed_count INTEGER DEFAULT 0,
+    completed_count INTEGER DEFAULT 0,
+    queued_count INTEGER DEFAULT 0,
+    rejected_count INTEGER DEFAULT 0,
+    error TEXT,
+    created_at TIMESTAMP DEFAULT NOW(),
+    started_at TIMESTAMP,
+    completed_at TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS payment_batch_items (
+    id SERIAL PRIMARY KEY,
+    batch_id VARCHAR(100) REFERENCES payment_batches(batch_id) NOT NULL,
+    line_number INTEGER NOT NULL,
+    creditor_account VARCHAR(255),
+    amount NUMERIC(15, 2),
+    description TEXT,
+    reference VARCHAR(100),
+    status VARCHAR(20) DEFAULT 'pending',
+    payment_id VARCHAR(100),
+    destination_bank VARCHAR(100),
+    error TEXT,
+    processed_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_payment_batch_items_batch ON payment_batch_items(batch_id, status, line_number);
+
 CREATE TABLE IF NOT EXISTS interbank_transfers (
     id SERIAL PRIMARY KEY,
     transfer_id VARCHAR(100) UNIQUE NOT NULL,
@@ -77,6 +165,39 @@ CREATE TABLE IF NOT EXISTS interbank_transfers (
     completed_at TIMESTAMP
 );
 
+CREATE TABLE IF NOT EXISTS interbank_outbox (
+    id SERIAL PRIMARY KEY,
+    transfer_id VARCHAR(100) UNIQUE NOT NULL REFERENCES interbank_transfers(transfer_id),
+    payment_id VARCHAR(100) REFERENCES payments(payment_id),
+    to_bank VARCHAR(100) NOT NULL,
+    to_account_number VARCHAR(255) NOT NULL,
+    amount NUMERIC(15, 2) NOT NULL,
+    currency VARCHAR(3) DEFAULT 'RUB',
+    description TEXT,
+    status VARCHAR(20) DEFAULT 'pending',
+    attempts INTEGER DEFAULT 0,
+    next_attempt_at TIMESTAMP DEFAULT NOW(),
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT NOW(),
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_interbank_outbox_due ON interbank_outbox(status, next_attempt_at);
+
+CREATE TABLE IF NOT EXISTS idempotency_records (
+    id SERIAL PRIMARY KEY,
+    scope VARCHAR(100) NOT NULL,
+    caller VARCHAR(100) NOT NULL,
+    idempotency_key VARCHAR(255) NOT NULL,
+    request_fingerprint VARCHAR(64) NOT NULL,
+    status VARCHAR(20) DEFAULT 'processing',
+    response_code INTEGER,
+    response_body TEXT,
+    created_at TIMESTAMP DEFAULT NOW(),
+    completed_at TIMESTAMP,
+    CONSTRAINT uq_idempotency_scope_caller_key UNIQUE (scope, caller, idempotency_key)
+);
+
 CREATE TABLE IF NOT EXISTS bank_capital (
     id SERIAL PRIMARY KEY,
     bank_code VARCHAR(100) UNIQUE NOT NULL,
@@ -87,6 +208,17 @@ CREATE TABLE IF NOT EXISTS bank_capital (
     updated_at TIMESTAMP DEFAULT NOW()
 );
 
+CREATE TABLE IF NOT EXISTS bank_capital_deltas (
+    id SERIAL PRIMARY KEY,
+    bank_code VARCHAR(100) NOT NULL,
+    capital_change NUMERIC(15, 2) NOT NULL DEFAULT 0,
+    loans_change NUMERIC(15, 2) NOT NULL DEFAULT 0,
+    reason TEXT,
+    created_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_bank_capital_deltas_bank_code ON bank_capital_deltas(bank_code);
+
 CREATE TABLE IF NOT EXISTS teams (
     id SERIAL PRIMARY KEY,
     client_id VARCHAR(100) UNIQUE NOT NULL,